@@ -47,8 +47,8 @@ def verify_firebase_token(authorization: Optional[str] = None) -> dict:
         user_id = decoded_token.get("uid")
 
         # Check access control (domain-based or email-based)
-        allowed_emails = settings.ALLOWED_EMAILS
-        allowed_domains = settings.ALLOWED_DOMAINS
+        allowed_emails = settings.ALLOWED_EMAILS_SET
+        allowed_domains = settings.ALLOWED_DOMAINS_SET
 
         # If no restrictions configured, allow all authenticated users
         if not allowed_emails and not allowed_domains:
@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from pydantic import computed_field
-from typing import List
+from pydantic import Field, computed_field
+from typing import FrozenSet, List
 
 
 def parse_email_list(value: str | None) -> List[str]:
@@ -26,6 +26,22 @@ def parse_domain_list(value: str | None) -> List[str]:
     return domains
 
 
+def parse_origin_list(value: str | None) -> List[str]:
+    """Parse comma-separated CORS origins, falling back to DEFAULT_ORIGINS if empty."""
+    if value is None or not value.strip():
+        return list(DEFAULT_ORIGINS)
+    return [o.strip().lower() for o in value.split(",") if o.strip()]
+
+
+# Default CORS origins, used when ALLOWED_ORIGINS is empty or unset
+DEFAULT_ORIGINS = [
+    "https://a5df8c929ca74fbc80fe95abcebf06ed-br-2c5574706fc84239af4efff8b.fly.dev",
+    "https://genmedia-frontend-otfo2ctxma-uc.a.run.app",
+    "http://localhost:3000",
+    "http://localhost:8080",
+]
+
+
 class Settings(BaseSettings):
     project_id: str = "genmediastudio"
     location: str = "us-central1"
@@ -38,9 +54,23 @@ class Settings(BaseSettings):
     # Email/domain allowlists - stored as comma-separated strings from env
     # Format: ALLOWED_EMAILS=email1@example.com,email2@example.com
     # Format: ALLOWED_DOMAINS=hubspot.com,example.com (or @hubspot.com)
-    _allowed_emails_raw: str = ""
-    _admin_emails_raw: str = ""
-    _allowed_domains_raw: str = ""
+    allowed_emails_raw: str = Field(default="", validation_alias="ALLOWED_EMAILS")
+    admin_emails_raw: str = Field(default="", validation_alias="ADMIN_EMAILS")
+    allowed_domains_raw: str = Field(default="", validation_alias="ALLOWED_DOMAINS")
+
+    # CORS origins - comma-separated, falls back to DEFAULT_ORIGINS when empty
+    # Format: ALLOWED_ORIGINS=https://app.example.com,http://localhost:8080
+    allowed_origins_raw: str = Field(default="", validation_alias="ALLOWED_ORIGINS")
+
+    # Parsed allowlists - computed once in model_post_init (env is read once per process)
+    _allowed_emails: List[str] = []
+    _admin_emails: List[str] = []
+    _allowed_domains: List[str] = []
+    _allowed_emails_set: FrozenSet[str] = frozenset()
+    _admin_emails_set: FrozenSet[str] = frozenset()
+    _allowed_domains_set: FrozenSet[str] = frozenset()
+    _allowed_origins: List[str] = []
+    _allowed_origins_set: FrozenSet[str] = frozenset()
 
     # Firebase config (for testing)
     firebase_api_key: str = ""
@@ -49,6 +79,34 @@ class Settings(BaseSettings):
     # ElevenLabs API key (for voice changing)
     elevenlabs_api_key: str = ""
 
+    # Put ffmpeg scratch files on /dev/shm (tmpfs) when available
+    use_tmpfs_scratch: bool = True
+    # Fast (RAM-backed) directory used for that scratch space
+    fast_tmpdir: str = "/dev/shm"
+
+    # Max concurrent ffmpeg processes per worker (0 = number of CPUs)
+    ffmpeg_concurrency: int = 0
+
+    # H.264 encoder for video processing: "auto" uses a working hardware encoder
+    # (h264_nvenc/h264_qsv/h264_videotoolbox) if found, else libx264
+    video_encoder: str = "auto"
+
+    # Video-processing outputs larger than this many bytes are uploaded to GCS
+    # and returned as a signed video_url instead of video_base64 (0 = always base64)
+    output_b64_max_bytes: int = 0
+
+    # How long finished voice changes are cached on disk, in seconds (0 disables)
+    voice_change_cache_ttl: int = 3600
+    # Total size of that cache in bytes; least recently used entries are evicted past it
+    voice_change_cache_max_bytes: int = 256 * 1024 * 1024
+
+    # Pass asset / assets-bucket image inputs to Vertex as gs:// URIs instead of
+    # downloading and inlining them (false = download bytes here as before)
+    gcs_uri_inputs: bool = True
+
+    # How long /health and /ready reuse a Firestore/GCS check result, in seconds (0 disables)
+    health_check_cache_ttl: float = 5.0
+
     # Model names
     gemini_image_model: str = "gemini-3-pro-image-preview"  # Nano Banana Pro - Gemini 3 Pro Image
     gemini_text_model: str = "gemini-2.0-flash"  # Gemini 2.0 Flash model
@@ -59,17 +117,42 @@ class Settings(BaseSettings):
     @property
     def ALLOWED_EMAILS(self) -> List[str]:
         """List of allowed emails parsed from comma-separated string."""
-        return parse_email_list(self._allowed_emails_raw)
+        return self._allowed_emails
 
     @property
     def ADMIN_EMAILS(self) -> List[str]:
         """List of admin emails parsed from comma-separated string."""
-        return parse_email_list(self._admin_emails_raw)
+        return self._admin_emails
 
     @property
     def ALLOWED_DOMAINS(self) -> List[str]:
         """List of allowed email domains parsed from comma-separated string."""
-        return parse_domain_list(self._allowed_domains_raw)
+        return self._allowed_domains
+
+    @property
+    def ALLOWED_EMAILS_SET(self) -> FrozenSet[str]:
+        """Allowed emails as a frozenset for O(1) membership checks."""
+        return self._allowed_emails_set
+
+    @property
+    def ADMIN_EMAILS_SET(self) -> FrozenSet[str]:
+        """Admin emails as a frozenset for O(1) membership checks."""
+        return self._admin_emails_set
+
+    @property
+    def ALLOWED_DOMAINS_SET(self) -> FrozenSet[str]:
+        """Allowed email domains as a frozenset for O(1) membership checks."""
+        return self._allowed_domains_set
+
+    @property
+    def ALLOWED_ORIGINS(self) -> List[str]:
+        """List of allowed CORS origins parsed from comma-separated string."""
+        return self._allowed_origins
+
+    @property
+    def ALLOWED_ORIGINS_SET(self) -> FrozenSet[str]:
+        """Allowed CORS origins as a frozenset for O(1) membership checks."""
+        return self._allowed_origins_set
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -80,15 +163,20 @@ class Settings(BaseSettings):
     )
 
     def model_post_init(self, __context):
-        """Load email/domain lists from environment after init."""
-        import os
-        # Read directly from env since pydantic-settings doesn't handle uppercase well
-        allowed = os.getenv("ALLOWED_EMAILS", "")
-        admin = os.getenv("ADMIN_EMAILS", "")
-        domains = os.getenv("ALLOWED_DOMAINS", "")
-        object.__setattr__(self, "_allowed_emails_raw", allowed)
-        object.__setattr__(self, "_admin_emails_raw", admin)
-        object.__setattr__(self, "_allowed_domains_raw", domains)
+        """Parse email/domain/origin lists once after the raw env values are loaded."""
+        # Parse once here so the properties (hit on every auth check) are plain lookups
+        allowed_emails = parse_email_list(self.allowed_emails_raw)
+        admin_emails = parse_email_list(self.admin_emails_raw)
+        allowed_domains = parse_domain_list(self.allowed_domains_raw)
+        object.__setattr__(self, "_allowed_emails", allowed_emails)
+        object.__setattr__(self, "_admin_emails", admin_emails)
+        object.__setattr__(self, "_allowed_domains", allowed_domains)
+        object.__setattr__(self, "_allowed_emails_set", frozenset(allowed_emails))
+        object.__setattr__(self, "_admin_emails_set", frozenset(admin_emails))
+        object.__setattr__(self, "_allowed_domains_set", frozenset(allowed_domains))
+        allowed_origins = parse_origin_list(self.allowed_origins_raw)
+        object.__setattr__(self, "_allowed_origins", allowed_origins)
+        object.__setattr__(self, "_allowed_origins_set", frozenset(allowed_origins))
 
 
 settings = Settings()
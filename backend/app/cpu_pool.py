@@ -0,0 +1,48 @@
+"""
+Dedicated thread pool for CPU-heavy helpers (base64 of whole videos).
+
+asyncio.to_thread shares the loop's default executor with every blocking
+SDK/Firestore/file call in the app, so a few large base64 jobs could
+occupy all of its threads and stall unrelated requests. Routing them here
+keeps that work on its own bounded pool.
+
+A thread pool (not a process pool) is deliberate: pybase64 releases the
+GIL inside encode/decode so threads already run in parallel, while a
+process pool would pickle the full payload across in both directions.
+
+To revert: Replace run_cpu_bound(...) calls with asyncio.to_thread(...).
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_cpu_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _get_cpu_pool() -> ThreadPoolExecutor:
+    """Get or create the shared CPU-bound executor."""
+    global _cpu_pool
+    if _cpu_pool is None:
+        _cpu_pool = ThreadPoolExecutor(
+            max_workers=os.cpu_count() or 4,
+            thread_name_prefix="cpu-bound",
+        )
+    return _cpu_pool
+
+
+async def run_cpu_bound(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a CPU-heavy, GIL-releasing function on the dedicated pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_cpu_pool(), partial(func, *args, **kwargs))
+
+
+def shutdown_cpu_pool() -> None:
+    """Stop the pool's threads (called on app shutdown)."""
+    global _cpu_pool
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=False, cancel_futures=True)
+        _cpu_pool = None
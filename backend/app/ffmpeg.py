@@ -0,0 +1,132 @@
+"""
+Process-wide limit on concurrent ffmpeg work.
+
+Every ffmpeg/ffprobe subprocess competes for the same CPU cores. Without a
+cap, a burst of requests forks one process each and they all slow down
+together (and can OOM the container). Callers hold a slot from
+ffmpeg_slot() for the lifetime of the subprocess so excess work queues in
+the event loop instead of in the kernel scheduler.
+
+Also picks the H.264 encoder: a hardware encoder (NVENC, Quick Sync,
+VideoToolbox) when one is present and actually works, libx264 otherwise.
+
+To revert: Remove the `async with ffmpeg_slot():` wrappers. Set
+VIDEO_ENCODER=libx264 to always encode in software.
+"""
+import asyncio
+import os
+import subprocess
+from typing import List, Optional
+from app.config import settings
+from app.logging_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def get_ffmpeg_concurrency() -> int:
+    """Max concurrent ffmpeg processes: FFMPEG_CONCURRENCY, or the CPU count when unset (0)."""
+    return settings.ffmpeg_concurrency or os.cpu_count() or 4
+
+
+_ffmpeg_semaphore = asyncio.Semaphore(get_ffmpeg_concurrency())
+
+logger.info(f"ffmpeg concurrency limit: {get_ffmpeg_concurrency()}")
+
+
+def ffmpeg_slot() -> asyncio.Semaphore:
+    """
+    Semaphore gating ffmpeg subprocesses.
+
+    Usage:
+        async with ffmpeg_slot():
+            proc = await asyncio.create_subprocess_exec("ffmpeg", ...)
+            await proc.communicate()
+    """
+    return _ffmpeg_semaphore
+
+
+# Hardware H.264 encoders in order of preference, with arguments that
+# roughly match libx264 -crf 23. VAAPI is left out: it needs a device and
+# hwupload in every filter graph, not just different output arguments.
+_HW_H264_ENCODERS = {
+    "h264_nvenc": ["-c:v", "h264_nvenc", "-preset", "p4", "-tune", "hq", "-rc", "vbr", "-cq", "23"],
+    "h264_qsv": ["-c:v", "h264_qsv", "-global_quality", "23", "-pix_fmt", "nv12"],
+    "h264_videotoolbox": ["-c:v", "h264_videotoolbox", "-q:v", "65", "-pix_fmt", "yuv420p"],
+}
+
+# Speed-first variants for the libx264 presets in _REALTIME_PRESETS (e.g. the
+# watermark overlay, which re-encodes a whole video to composite one PNG)
+_HW_H264_REALTIME_ENCODERS = {
+    "h264_nvenc": ["-c:v", "h264_nvenc", "-preset", "p1", "-tune", "ll", "-rc", "vbr", "-cq", "23"],
+    "h264_qsv": ["-c:v", "h264_qsv", "-preset", "veryfast", "-global_quality", "23", "-pix_fmt", "nv12"],
+    "h264_videotoolbox": ["-c:v", "h264_videotoolbox", "-realtime", "1", "-q:v", "65", "-pix_fmt", "yuv420p"],
+}
+
+_REALTIME_PRESETS = frozenset({"ultrafast", "superfast", "veryfast"})
+
+_h264_encoder: Optional[str] = None
+
+
+def _hw_encoder_works(name: str) -> bool:
+    """Encode a few frames with name - being compiled in doesn't mean a GPU/driver is present."""
+    test_cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+        "-f", "lavfi", "-i", "color=size=256x256:duration=0.2",
+        *_HW_H264_ENCODERS[name],
+        "-f", "null", "-"
+    ]
+    try:
+        return subprocess.run(test_cmd, capture_output=True, timeout=15).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def detect_h264_encoder() -> str:
+    """
+    Pick the H.264 encoder once per process and cache it.
+
+    VIDEO_ENCODER=auto (default) lists `ffmpeg -encoders` and takes the first
+    hardware encoder from _HW_H264_ENCODERS that passes a test encode, else
+    libx264. Any other value is used as-is. Blocking (runs ffmpeg) - the app
+    calls this at startup in a thread so requests never pay for it.
+    """
+    global _h264_encoder
+    if _h264_encoder is not None:
+        return _h264_encoder
+
+    encoder = settings.video_encoder
+    if encoder == "auto":
+        encoder = "libx264"
+        try:
+            listing = subprocess.run(
+                ["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True, timeout=15
+            ).stdout
+        except (OSError, subprocess.TimeoutExpired):
+            listing = ""
+        for name in _HW_H264_ENCODERS:
+            if f" {name} " in listing and _hw_encoder_works(name):
+                encoder = name
+                break
+
+    logger.info(f"H.264 encoder: {encoder}")
+    _h264_encoder = encoder
+    return encoder
+
+
+def h264_encoder_args(preset: str = "fast") -> List[str]:
+    """
+    Output arguments for an H.264 encode at the app's standard quality.
+
+    Args:
+        preset: libx264 preset; hardware encoders use their own equivalent
+            (their fastest/low-latency settings for ultrafast..veryfast)
+
+    Returns:
+        e.g. ["-c:v", "libx264", "-preset", "fast", "-crf", "23"]
+    """
+    encoder = detect_h264_encoder()
+    if encoder in _HW_H264_ENCODERS:
+        if preset in _REALTIME_PRESETS:
+            return list(_HW_H264_REALTIME_ENCODERS[encoder])
+        return list(_HW_H264_ENCODERS[encoder])
+    return ["-c:v", encoder, "-preset", preset, "-crf", "23"]
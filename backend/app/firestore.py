@@ -2,6 +2,8 @@
 Firestore client setup and utilities
 """
 import os
+import threading
+from functools import lru_cache
 from firebase_admin import firestore
 from app.auth import init_firebase
 from app.logging_config import setup_logger
@@ -9,15 +11,23 @@ from app.logging_config import setup_logger
 logger = setup_logger(__name__)
 
 _firestore_client = None
+_firestore_lock = threading.Lock()
 
 
 def get_firestore_client():
-    """Get or create Firestore client (singleton)"""
+    """Get or create Firestore client (singleton)
+
+    Uses double-checked locking so concurrent cold requests (threadpool
+    workers or run_in_executor calls) don't both run the SDK init.
+    """
     global _firestore_client
-    if _firestore_client is None:
-        init_firebase()  # Ensure Firebase is initialized
-        _firestore_client = firestore.client()
-        logger.info("Firestore client initialized")
+    if _firestore_client is not None:
+        return _firestore_client
+    with _firestore_lock:
+        if _firestore_client is None:
+            init_firebase()  # Ensure Firebase is initialized
+            _firestore_client = firestore.client()
+            logger.info("Firestore client initialized")
     return _firestore_client
 
 
@@ -26,7 +36,11 @@ def get_firestore_client():
 # Set to empty string or 'none' to use original collection names (workflows, assets)
 FIRESTORE_ENV = os.getenv('FIRESTORE_ENVIRONMENT', '')
 
+# Prefix resolved once at import - empty when namespacing is disabled
+_COLLECTION_PREFIX = "" if not FIRESTORE_ENV or FIRESTORE_ENV.lower() == 'none' else f"{FIRESTORE_ENV}_"
+
 
+@lru_cache(maxsize=None)
 def get_collection_name(base_name: str) -> str:
     """
     Get environment-namespaced collection name.
@@ -38,9 +52,7 @@ def get_collection_name(base_name: str) -> str:
 
     This prevents dev testing from polluting production data.
     """
-    if not FIRESTORE_ENV or FIRESTORE_ENV.lower() == 'none':
-        return base_name
-    return f"{FIRESTORE_ENV}_{base_name}"
+    return _COLLECTION_PREFIX + base_name if _COLLECTION_PREFIX else base_name
 
 
 # Collection names (automatically namespaced by environment)
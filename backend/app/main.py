@@ -1,32 +1,55 @@
-import os
-from uuid import uuid4
+import asyncio
+import logging
+import secrets
+import types
+import httpx
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Mapping
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from app.routers import generation, library, health, workflow, elevenlabs, video_processing
 from app.logging_config import setup_logger
+from app.config import settings
 from app.exceptions import AppError
+from app.firestore import get_firestore_client
+from app.cpu_pool import shutdown_cpu_pool
+from app.ffmpeg import detect_h264_encoder
 
 logger = setup_logger(__name__)
 
 # CORS configuration - restrict to known origins
 # Set ALLOWED_ORIGINS env var as comma-separated list to override defaults
+# (parsed once by Settings, see app/config.py)
 # Defined early so exception handlers can use it
-DEFAULT_ORIGINS = [
-    "https://a5df8c929ca74fbc80fe95abcebf06ed-br-2c5574706fc84239af4efff8b.fly.dev",
-    "https://genmedia-frontend-otfo2ctxma-uc.a.run.app",
-    "http://localhost:3000",
-    "http://localhost:8080",
-]
-# Parse ALLOWED_ORIGINS, falling back to defaults if env var is empty or unset
-_origins_env = os.getenv("ALLOWED_ORIGINS", "").strip()
-ALLOWED_ORIGINS = [o.strip() for o in _origins_env.split(",") if o.strip()] if _origins_env else DEFAULT_ORIGINS
+ALLOWED_ORIGINS = settings.ALLOWED_ORIGINS
+# Set view for O(1) per-request origin checks (list kept for CORSMiddleware and logging)
+_ALLOWED_ORIGINS_SET = settings.ALLOWED_ORIGINS_SET
 
 # Log CORS configuration at startup for debugging
 logger.info(f"CORS allowed origins: {ALLOWED_ORIGINS}")
 
 
-def _get_cors_headers(request: Request, allowed_origins: list[str]) -> dict:
+# Shared read-only "no CORS headers" result (avoids allocating a dict per error response)
+_EMPTY_CORS: Mapping[str, str] = types.MappingProxyType({})
+
+
+@lru_cache(maxsize=None)
+def _cors_headers_for_origin(origin: str) -> Mapping[str, str]:
+    """
+    CORS headers for an allowed origin, built once per origin.
+
+    Only called with origins from the allowlist, so the cache stays bounded.
+    Read-only so the shared mapping can't be mutated by a caller.
+    """
+    return types.MappingProxyType({
+        "Access-Control-Allow-Origin": origin,
+        "Access-Control-Allow-Credentials": "true",
+    })
+
+
+def _get_cors_headers(request: Request, allowed_origins: frozenset[str]) -> Mapping[str, str]:
     """
     Build CORS headers for a response based on the request origin.
 
@@ -35,21 +58,82 @@ def _get_cors_headers(request: Request, allowed_origins: list[str]) -> dict:
     """
     origin = request.headers.get("origin")
     if origin and origin in allowed_origins:
-        return {
-            "Access-Control-Allow-Origin": origin,
-            "Access-Control-Allow-Credentials": "true",
-        }
+        return _cors_headers_for_origin(origin)
     # Log when CORS headers are not added (helps debug CORS issues)
     if origin:
         logger.warning(f"CORS: Origin '{origin}' not in allowed list. Allowed: {allowed_origins}")
-    return {}
+    return _EMPTY_CORS
+
+
+async def _warm_services() -> None:
+    """Create the shared router services and prime their connections (see lifespan)."""
+    warmups = await asyncio.gather(
+        asyncio.to_thread(generation.get_generation_service),
+        asyncio.to_thread(generation.get_library_service),
+        asyncio.to_thread(library.get_library_service),
+        asyncio.to_thread(workflow.get_workflow_service),
+        return_exceptions=True,
+    )
+    for result in warmups:
+        if isinstance(result, Exception):
+            logger.warning(f"Service warm-up failed, will retry lazily: {result}")
+    await asyncio.gather(health.check_firestore(), health.check_gcs())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Application startup/shutdown hook.
+
+    Warms the Firestore client and the shared services so their clients
+    and connections are ready before the first request arrives instead of
+    being created on the request path, and owns the lifetime of the shared
+    HTTP clients (app.state.http_client for generation asset downloads and
+    video-processing URL inputs, plus the ElevenLabs client).
+    """
+    try:
+        get_firestore_client()
+        credentials_ok = True
+    except Exception as e:
+        # Don't block startup (e.g. local dev without credentials) - the
+        # client will be created lazily on first use instead
+        logger.warning(f"Firestore warm-up failed, will retry lazily: {e}")
+        credentials_ok = False
+
+    # Build the shared services (storage.Client auth, GenAI client) in threads
+    # so the first request after a cold start doesn't pay for it, then run the
+    # health checks once to open the Firestore/GCS connection pools. Skipped
+    # without credentials, where each would just time out looking for them.
+    # To revert: Remove this block - everything is still created lazily.
+    if credentials_ok:
+        await _warm_services()
+
+    # Pooled client for reference image and video downloads from GCS, see
+    # generation.get_http_client. To revert: drop this and the aclose() below.
+    app.state.http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(30.0, connect=10.0),
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+    )
+    elevenlabs.get_http_client()
+    # Runs test encodes - do it once here rather than on the first video request
+    await asyncio.to_thread(detect_h264_encoder)
+    yield
+    await app.state.http_client.aclose()
+    await elevenlabs.close_http_client()
+    shutdown_cpu_pool()
+
 
-app = FastAPI(title="GenMedia API")
+# No default_response_class=ORJSONResponse here: routes with a response_model
+# (including the base64-heavy /voice-change and /generate-music) are already
+# serialized straight to JSON bytes by Pydantic's Rust core (fastapi>=0.130),
+# and a custom response class would opt them out of that fast path.
+app = FastAPI(title="GenMedia API", lifespan=lifespan)
 
 
 # ============== REQUEST TRACING MIDDLEWARE ==============
 # Adds X-Request-ID header to all requests for distributed tracing
-# To revert: Remove this middleware function and uuid4 import
+# To revert: Remove this middleware function and secrets import
 
 @app.middleware("http")
 async def add_request_id(request: Request, call_next):
@@ -57,18 +141,22 @@ async def add_request_id(request: Request, call_next):
     Add request ID for tracing requests across logs.
 
     - Uses X-Request-ID from incoming request if provided (from frontend/load balancer)
-    - Generates a new UUID if not provided
+    - Generates a new random 128-bit hex ID if not provided
     - Returns the request ID in response headers
     - Stores request_id in request.state for use in route handlers
 
     Frontend can read the X-Request-ID from response headers to correlate logs.
     """
-    request_id = request.headers.get("X-Request-ID", str(uuid4()))
+    # Only generate an ID when the header is missing (a .get() default would
+    # build one on every request)
+    request_id = request.headers.get("X-Request-ID") or secrets.token_hex(16)
     # Store in request state for access in route handlers
     request.state.request_id = request_id
 
-    # Log the request with its ID
-    logger.info(f"[{request_id}] {request.method} {request.url.path}")
+    # Log the request with its ID - lazy %-formatting, and skip the URL
+    # parsing for request.url entirely when INFO is disabled
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("[%s] %s %s", request_id, request.method, request.url.path)
 
     response = await call_next(request)
     response.headers["X-Request-ID"] = request_id
@@ -96,7 +184,7 @@ async def handle_app_error(request: Request, exc: AppError):
     return JSONResponse(
         status_code=exc.status,
         content=exc.to_dict(),
-        headers=_get_cors_headers(request, ALLOWED_ORIGINS)
+        headers=_get_cors_headers(request, _ALLOWED_ORIGINS_SET)
     )
 
 
@@ -116,7 +204,7 @@ async def handle_http_exception(request: Request, exc: HTTPException):
     return JSONResponse(
         status_code=exc.status_code,
         content={"detail": exc.detail},
-        headers=_get_cors_headers(request, ALLOWED_ORIGINS)
+        headers=_get_cors_headers(request, _ALLOWED_ORIGINS_SET)
     )
 
 
@@ -135,7 +223,7 @@ async def handle_unhandled_exception(request: Request, exc: Exception):
             "detail": f"Internal server error: {type(exc).__name__}",
             "error": str(exc)
         },
-        headers=_get_cors_headers(request, ALLOWED_ORIGINS)
+        headers=_get_cors_headers(request, _ALLOWED_ORIGINS_SET)
     )
 
 logger.info("Starting GenMedia API application")
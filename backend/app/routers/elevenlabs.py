@@ -1,26 +1,109 @@
 """
 ElevenLabs API router for voice-related functionality.
 """
+import asyncio
 import base64
-import tempfile
-import subprocess
+import binascii
+import hashlib
+import heapq
 import os
+import shutil
+import tempfile
+import time
+import uuid
 import httpx
+import pybase64
+from functools import lru_cache
 from io import BytesIO
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel, Field
-from typing import Optional, List
-from elevenlabs import ElevenLabs
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from typing import TYPE_CHECKING, BinaryIO, Iterator, Optional, List
 from app.auth import get_current_user
 from app.config import settings
+from app.cpu_pool import run_cpu_bound
+from app.ffmpeg import ffmpeg_slot
 from app.logging_config import setup_logger
+from app.schemas import MAX_VIDEO_BASE64
+from app.scratch import ScratchFiles
+
+if TYPE_CHECKING:
+    from elevenlabs import ElevenLabs
 
 logger = setup_logger(__name__)
 
 router = APIRouter(prefix="/v1/elevenlabs", tags=["elevenlabs"])
 
+# Translation table that deletes whitespace from base64 payloads in one pass
+_B64_WHITESPACE = str.maketrans("", "", " \t\n\r")
+
+# Read size for streaming base64 encode - a multiple of 3 so each chunk
+# encodes without padding and the pieces concatenate cleanly
+_B64_ENCODE_CHUNK = 3 * 64 * 1024
+
+# Chunk size for copying uploads to disk and streaming the output video back
+_STREAM_CHUNK = 1024 * 1024
+
+# Raw-bytes equivalent of the base64 limit, for multipart uploads
+MAX_VIDEO_UPLOAD_BYTES = MAX_VIDEO_BASE64 * 3 // 4
+
+# Whole-body limit for the JSON /voice-change endpoint: the base64 limit plus
+# room for the rest of the JSON (voice_id, data URL prefix, keys)
+MAX_VOICE_CHANGE_BODY = MAX_VIDEO_BASE64 + 64 * 1024
+
+STS_MODEL_ID = "eleven_multilingual_sts_v2"
+
+# Voice-change output is written as fragmented MP4 in a single pass: an empty
+# moov up front, then self-contained moof+mdat fragments per keyframe. Unlike
+# +faststart there's no second pass re-reading the file to move the moov, and
+# playback can start from the first fragment.
+OUTPUT_MOVFLAGS = "frag_keyframe+empty_moov+default_base_moof"
+
+# On-disk cache of finished voice changes, keyed by (input hash, voice, model).
+# Re-running the same clip with the same voice is common while iterating in
+# the editor, and the result is deterministic enough to reuse. The temp dir
+# is RAM-backed on Cloud Run, so the cache is also capped at
+# VOICE_CHANGE_CACHE_MAX_BYTES, evicting least recently used entries.
+# To revert: Set VOICE_CHANGE_CACHE_TTL=0
+VOICE_CHANGE_CACHE_DIR = os.path.join(tempfile.gettempdir(), "genmedia-voice-change-cache")
+
+ELEVENLABS_API_BASE = "https://api.elevenlabs.io/v1"
+
+# Shared HTTP client for ElevenLabs REST calls (music generation)
+# Keeps the TCP/TLS connection to api.elevenlabs.io alive across requests
+# instead of paying a fresh handshake per call, and multiplexes concurrent
+# calls over it with HTTP/2. Only use it for ElevenLabs URLs - it carries the
+# API key header on every request.
+_http_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get or create the shared ElevenLabs HTTP client."""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            base_url=ELEVENLABS_API_BASE,
+            http2=True,
+            headers={"xi-api-key": settings.elevenlabs_api_key},
+            timeout=httpx.Timeout(300.0, connect=5.0),  # Music generation can take minutes
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Close the shared ElevenLabs HTTP client (called on app shutdown)."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 
 class VoiceInfo(BaseModel):
+    # Validated straight from the ElevenLabs JSON; ignore the many extra fields
+    model_config = ConfigDict(extra="ignore")
+
     voice_id: str
     name: str
     preview_url: Optional[str] = None
@@ -28,6 +111,8 @@ class VoiceInfo(BaseModel):
 
 
 class VoicesResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     voices: List[VoiceInfo]
 
 
@@ -53,33 +138,99 @@ class GenerateMusicResponse(BaseModel):
     duration_seconds: Optional[int] = None
 
 
-def get_elevenlabs_client() -> ElevenLabs:
-    """Get ElevenLabs client instance."""
+@lru_cache(maxsize=1)
+def _get_sts_http_client() -> httpx.Client:
+    """
+    Sync httpx client handed to the ElevenLabs SDK.
+
+    Same as the SDK's default but with a 60s keep-alive instead of httpx's
+    5s, so the TLS connection usually survives between voice changes.
+    Also used by _warm_sts_connection().
+    """
+    return httpx.Client(
+        timeout=httpx.Timeout(240.0, connect=5.0),  # SDK default is 240s
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=16, keepalive_expiry=60.0),
+    )
+
+
+def _warm_sts_connection() -> None:
+    """
+    Open (or refresh) a pooled TLS connection to the ElevenLabs API.
+
+    Cheap unauthenticated HEAD, run alongside the audio extraction so the
+    STS upload that follows doesn't pay the handshake. Best-effort.
+    """
+    try:
+        _get_sts_http_client().head(ELEVENLABS_API_BASE, timeout=5.0)
+    except httpx.HTTPError as e:
+        logger.debug(f"ElevenLabs connection warm-up failed: {e}")
+
+
+@lru_cache(maxsize=1)
+def get_elevenlabs_client() -> "ElevenLabs":
+    """
+    Cached factory for the ElevenLabs SDK client.
+
+    The client wraps an httpx session (thread-safe), so reusing one
+    instance keeps its connection pool warm across requests. A missing
+    API key raises, and exceptions are not cached.
+
+    The SDK is imported here rather than at module level - it pulls in
+    hundreds of generated models and adds ~0.3s to cold start, so defer
+    it until a voice endpoint is actually hit.
+    """
+    if not settings.elevenlabs_api_key:
+        raise HTTPException(status_code=500, detail="ElevenLabs API key not configured")
+    from elevenlabs import ElevenLabs
+    return ElevenLabs(api_key=settings.elevenlabs_api_key, httpx_client=_get_sts_http_client())
+
+
+# In-process cache for /voices - the voice list rarely changes, so serve it
+# from memory instead of a round-trip to ElevenLabs on every request
+# To revert: Make list_voices return await _fetch_voices() directly
+VOICES_CACHE_TTL = 300  # seconds
+_voices_cache: tuple[float, VoicesResponse] | None = None  # (expires_at, response)
+_voices_lock = asyncio.Lock()
+
+
+async def _fetch_voices() -> VoicesResponse:
+    """Fetch the voice list from ElevenLabs (uncached)."""
     if not settings.elevenlabs_api_key:
         raise HTTPException(status_code=500, detail="ElevenLabs API key not configured")
-    return ElevenLabs(api_key=settings.elevenlabs_api_key)
+
+    # Plain GET on the shared keep-alive client rather than the sync SDK
+    response = await get_http_client().get("/voices")
+    response.raise_for_status()
+
+    # Parse and validate the raw JSON bytes in one pass with pydantic-core's
+    # Rust parser - no intermediate dicts for the many fields we drop
+    return VoicesResponse.model_validate_json(response.content)
 
 
 @router.get("/voices", response_model=VoicesResponse)
 async def list_voices(user: dict = Depends(get_current_user)):
-    """List all available ElevenLabs voices."""
+    """List all available ElevenLabs voices (cached for VOICES_CACHE_TTL seconds)."""
+    global _voices_cache
     try:
-        logger.info(f"Fetching ElevenLabs voices for user {user['email']}")
+        logger.info("Fetching ElevenLabs voices for user %s", user['email'])
+
+        # Fast path without the lock while the cache is fresh
+        cached = _voices_cache
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
 
-        client = get_elevenlabs_client()
-        response = client.voices.get_all()
+        # Only one request refetches on expiry; the rest wait and reuse its result
+        async with _voices_lock:
+            cached = _voices_cache
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
 
-        voices = []
-        for voice in response.voices:
-            voices.append(VoiceInfo(
-                voice_id=voice.voice_id,
-                name=voice.name,
-                preview_url=voice.preview_url,
-                labels=voice.labels,
-            ))
+            voices = await _fetch_voices()
+            _voices_cache = (time.monotonic() + VOICES_CACHE_TTL, voices)
 
-        logger.info(f"Found {len(voices)} voices")
-        return VoicesResponse(voices=voices)
+        logger.info(f"Found {len(voices.voices)} voices")
+        return voices
 
     except HTTPException:
         raise
@@ -88,9 +239,451 @@ async def list_voices(user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/voice-change", response_model=VoiceChangeResponse)
+@router.delete("/voices/cache")
+async def clear_voices_cache(user: dict = Depends(get_current_user)):
+    """Drop the cached voice list so the next /voices call refetches (admin only)."""
+    global _voices_cache
+    if user['email'] not in settings.ADMIN_EMAILS_SET:
+        raise HTTPException(status_code=403, detail="Only admins can clear the voices cache")
+
+    _voices_cache = None
+    logger.info(f"Voices cache cleared by {user['email']}")
+    return {"message": "Voices cache cleared"}
+
+
+def _decode_video_base64(video_b64: str) -> bytes:
+    """
+    Decode a base64 video payload from the JSON API.
+
+    Accepts an optional data URL prefix, embedded whitespace and missing
+    padding. Uses pybase64 (SIMD) - CPU-heavy on large videos, so callers
+    run this via run_cpu_bound.
+    """
+    # Remove data URL prefix if present
+    if video_b64.startswith("data:"):
+        comma_idx = video_b64.find(",")
+        if comma_idx != -1:
+            video_b64 = video_b64[comma_idx + 1:]
+
+    # Fast path: well-formed payloads (what browsers' FileReader produces) go
+    # straight through pybase64's strict SIMD decoder. Strict mode is ~3x
+    # faster than validate=False, and skipping the cleanup below also avoids
+    # a full-string copy in translate()
+    try:
+        return pybase64.b64decode(video_b64, validate=True)
+    except binascii.Error:
+        pass
+
+    # Remove any whitespace/newlines in a single pass
+    video_b64 = video_b64.translate(_B64_WHITESPACE)
+
+    # Fix base64 padding if needed
+    padding_needed = len(video_b64) % 4
+    if padding_needed:
+        video_b64 += "=" * (4 - padding_needed)
+
+    return pybase64.b64decode(video_b64, validate=False)
+
+
+def _b64encode_file(path: str) -> str:
+    """
+    Base64-encode a file in chunks.
+
+    Never holds the raw file in memory alongside its encoding - peak is
+    the encoded output plus one chunk, instead of raw + encoded bytes + str.
+    Blocking (file reads + SIMD encode), so callers run this via run_cpu_bound.
+    """
+    encoded = bytearray()
+    with open(path, "rb") as f:
+        while chunk := f.read(_B64_ENCODE_CHUNK):
+            encoded += pybase64.b64encode(chunk)
+    return encoded.decode("ascii")
+
+
+def _import_av():
+    """PyAV module if installed (optional 'av' extra), else None."""
+    try:
+        import av
+    except ImportError:
+        return None
+    return av
+
+
+def _extract_audio_with_pyav(av, input_video_path: str) -> Optional[bytes]:
+    """
+    Copy the video's first audio track into an in-memory .m4a with PyAV.
+
+    Same result as the ffmpeg stream copy in _extract_audio_track, without
+    spawning a process. Returns None if the video has no audio track;
+    raises if PyAV can't pass the codec through.
+    """
+    buffer = BytesIO()
+    with av.open(input_video_path) as video_in:
+        if not video_in.streams.audio:
+            return None
+        audio_stream = video_in.streams.audio[0]
+        # BytesIO is seekable, so a regular (non-fragmented) MP4 works here
+        with av.open(buffer, mode="w", format="mp4") as out:
+            out_audio = out.add_stream_from_template(audio_stream)
+            for packet in video_in.demux(audio_stream):
+                if packet.dts is None:  # Flush packet at end of stream
+                    continue
+                packet.stream = out_audio
+                out.mux(packet)
+    return buffer.getvalue()
+
+
+def _remux_with_pyav(input_video_path: str, audio_path: str, output_path: str) -> bool:
+    """
+    Mux the converted MP3 into the input video in-process with PyAV.
+
+    Both streams are copied as-is (no re-encode), so this skips the ffmpeg
+    fork/exec entirely. Returns False when PyAV is not installed or can't
+    pass the streams through, in which case the caller falls back to ffmpeg.
+    """
+    av = _import_av()
+    if av is None:
+        return False
+
+    try:
+        with av.open(input_video_path) as video_in, \
+                av.open(audio_path, format="mp3") as audio_in, \
+                av.open(output_path, mode="w", format="mp4", options={"movflags": OUTPUT_MOVFLAGS}) as out:
+            video_stream = video_in.streams.video[0]
+            audio_stream = audio_in.streams.audio[0]
+            out_video = out.add_stream_from_template(video_stream)
+            out_audio = out.add_stream_from_template(audio_stream)
+
+            # Equivalent of ffmpeg -shortest: drop packets past the shorter stream
+            durations = [
+                float(stream.duration * stream.time_base)
+                for stream in (video_stream, audio_stream)
+                if stream.duration is not None
+            ]
+            end_time = min(durations) if durations else None
+
+            def packets(container, stream, out_stream):
+                for packet in container.demux(stream):
+                    if packet.dts is None:  # Flush packet at end of stream
+                        continue
+                    packet.stream = out_stream
+                    yield packet
+
+            # Interleave the two streams by decode time so the muxer doesn't
+            # have to buffer one whole stream while waiting for the other
+            for packet in heapq.merge(
+                packets(video_in, video_stream, out_video),
+                packets(audio_in, audio_stream, out_audio),
+                key=lambda p: float(p.dts * p.time_base),
+            ):
+                if end_time is not None and packet.pts is not None and packet.pts * packet.time_base >= end_time:
+                    continue
+                out.mux(packet)
+        return True
+    except Exception as e:
+        logger.warning(f"PyAV remux failed, falling back to ffmpeg: {e}")
+        return False
+
+
+def _iter_open_file(f: BinaryIO) -> Iterator[bytes]:
+    """
+    Yield an open file in _STREAM_CHUNK pieces, closing it at the end.
+
+    Used as a StreamingResponse body. The file's path is already unlinked,
+    so the data lives only as long as this handle - if the response never
+    starts (client gone), the file object is garbage collected and the
+    space is freed with it.
+    """
+    with f:
+        while chunk := f.read(_STREAM_CHUNK):
+            yield chunk
+
+
+def _write_file(path: str, data: bytes) -> None:
+    """Write bytes to a file (blocking - call via asyncio.to_thread)."""
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _copy_upload(upload: UploadFile, path: str) -> None:
+    """Copy a spooled upload to disk in chunks (blocking - call via asyncio.to_thread)."""
+    upload.file.seek(0)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(upload.file, f, _STREAM_CHUNK)
+
+
+def _convert_voice(voice_id: str, audio_track: Optional[bytes], input_video_path: str, output_path: str) -> int:
+    """
+    Send audio to ElevenLabs STS and write the converted MP3 to output_path.
+
+    Uploads the extracted audio track when there is one, else the full
+    video. The SDK client is synchronous (upload and response streaming
+    both block), so this runs in a worker thread. Returns bytes written.
+    """
+    if audio_track is not None:
+        return _speech_to_speech(voice_id, ("audio.m4a", audio_track, "audio/mp4"), output_path)
+
+    # Pass the open file so the multipart body is streamed from disk, not copied in memory
+    with open(input_video_path, "rb") as input_file:
+        return _speech_to_speech(voice_id, input_file, output_path)
+
+
+def _speech_to_speech(voice_id: str, audio, output_path: str) -> int:
+    """Run one STS conversion; audio is anything the SDK accepts as a file."""
+    client = get_elevenlabs_client()
+
+    # Use the official SDK - it handles file upload correctly
+    audio_generator = client.speech_to_speech.convert(
+        voice_id=voice_id,
+        audio=audio,
+        model_id=STS_MODEL_ID,
+        output_format="mp3_44100_128",
+    )
+
+    # Write chunks to scratch as they arrive rather than materializing the
+    # whole response in memory; the merge step reads the file
+    written = 0
+    with open(output_path, "wb") as f:
+        for chunk in audio_generator:
+            f.write(chunk)
+            written += len(chunk)
+    return written
+
+
+async def _extract_audio_track(input_video_path: str) -> Optional[bytes]:
+    """
+    Stream-copy the video's first audio track into an in-memory .m4a.
+
+    STS only needs the audio, so uploading this instead of the whole video
+    cuts the upload by the size of the video track. No re-encode - this is
+    a bitstream copy, read straight from ffmpeg's stdout (fragmented MP4,
+    since a pipe can't be seeked back to write the moov atom). Returns
+    None if there is no audio track or the codec can't go into an MP4
+    container; the caller then sends the full video.
+
+    Done in-process with PyAV when it's installed, falling back to an
+    ffmpeg subprocess if PyAV isn't available or fails.
+    """
+    av = _import_av()
+    if av is not None:
+        try:
+            audio_track = await asyncio.to_thread(_extract_audio_with_pyav, av, input_video_path)
+            if audio_track is None:
+                logger.warning("Video has no audio track, sending full video to STS")
+            return audio_track
+        except Exception as e:
+            logger.warning(f"PyAV audio extract failed, falling back to ffmpeg: {e}")
+
+    extract_cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+        "-i", input_video_path,
+        "-map", "0:a:0",  # First audio track only
+        "-vn",
+        "-c:a", "copy",  # No re-encode
+        "-f", "mp4",
+        "-movflags", "empty_moov+default_base_moof",  # Fragmented MP4 so it can be written to a pipe
+        "-frag_duration", "1000000",  # 1s fragments (audio packets are all keyframes)
+        "pipe:1"
+    ]
+    async with ffmpeg_slot():
+        proc = await asyncio.create_subprocess_exec(
+            *extract_cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        audio_track, stderr = await proc.communicate()
+    if proc.returncode != 0 or not audio_track:
+        logger.warning(f"Audio stream copy failed, sending full video to STS: {stderr.decode(errors='replace').strip()}")
+        return None
+    return audio_track
+
+
+def _hash_file(path: str) -> str:
+    """SHA-256 of a file, read in chunks (blocking - call via asyncio.to_thread)."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def _voice_change_cache_path(input_hash: str, voice_id: str) -> str:
+    """Cache file for a given input/voice/model. voice_id is hashed, never used in the path as-is."""
+    key = hashlib.sha256(f"{input_hash}:{voice_id}:{STS_MODEL_ID}".encode()).hexdigest()
+    return os.path.join(VOICE_CHANGE_CACHE_DIR, f"{key}.mp4")
+
+
+def _checkout_from_cache(cache_path: str, dest_path: str) -> bool:
+    """
+    Link a fresh cache entry to dest_path (a scratch path) and mark it used.
+
+    The caller serves dest_path, so a concurrent prune unlinking the cache
+    entry can't pull the file out from under a response in flight. Hard
+    link when cache and scratch share a filesystem, else copy. Returns
+    False on a miss (missing, expired or pruned meanwhile).
+    """
+    try:
+        st = os.stat(cache_path)
+        if time.time() - st.st_mtime >= settings.voice_change_cache_ttl:
+            return False
+        try:
+            os.link(cache_path, dest_path)
+        except OSError:
+            shutil.copyfile(cache_path, dest_path)  # e.g. scratch on /dev/shm (EXDEV)
+        # atime records last use for LRU eviction; mtime stays the TTL start
+        os.utime(cache_path, (time.time(), st.st_mtime))
+        return True
+    except OSError:
+        return False
+
+
+def _store_in_cache(output_path: str, cache_path: str) -> None:
+    """
+    Copy a finished output into the cache atomically and prune it.
+
+    Copies to a unique temp name first and os.replace()s it into place, so
+    concurrent readers never see a partial file. Expired entries are removed,
+    then least recently used ones until the cache fits its byte budget.
+    """
+    os.makedirs(VOICE_CHANGE_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+    shutil.copyfile(output_path, tmp_path)
+    os.replace(tmp_path, cache_path)
+
+    cutoff = time.time() - settings.voice_change_cache_ttl
+    live = []  # (last used, size, path)
+    with os.scandir(VOICE_CHANGE_CACHE_DIR) as entries:
+        for entry in entries:
+            try:
+                st = entry.stat()
+                if st.st_mtime < cutoff:
+                    os.unlink(entry.path)
+                elif not entry.name.endswith(".tmp"):  # In-progress copies aren't evictable
+                    live.append((st.st_atime, st.st_size, entry.path))
+            except OSError:
+                pass  # Already removed by a concurrent prune
+
+    total = sum(size for _, size, _ in live)
+    for _, size, path in sorted(live):
+        if total <= settings.voice_change_cache_max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        total -= size
+
+
+async def _voice_change_to_file(input_video_path: str, voice_id: str, scratch: ScratchFiles) -> str:
+    """
+    Run the voice change pipeline on a video already saved to scratch.
+
+    Sends the video to ElevenLabs STS, merges the converted audio back
+    into the video and returns the output path. Shared by the base64 JSON
+    endpoint and the multipart upload endpoint.
+
+    Results are cached on disk by content hash; on a hit the cached output
+    is linked into scratch, so the returned path is always a scratch file.
+    """
+    # Log first bytes to verify it's a valid video
+    with open(input_video_path, "rb") as f:
+        header_hex = f.read(12).hex()
+    logger.info(f"Video header (hex): {header_hex}, total size: {os.path.getsize(input_video_path)} bytes")
+
+    if settings.voice_change_cache_ttl <= 0:
+        return await _run_voice_change(input_video_path, voice_id, scratch)
+
+    input_hash = await asyncio.to_thread(_hash_file, input_video_path)
+    cache_path = _voice_change_cache_path(input_hash, voice_id)
+    cached_output_path = scratch.path("cached_output.mp4")
+    if await asyncio.to_thread(_checkout_from_cache, cache_path, cached_output_path):
+        logger.info(f"Voice change cache hit: {input_hash[:12]}, voice_id={voice_id}")
+        return cached_output_path
+
+    output_video_path = await _run_voice_change(input_video_path, voice_id, scratch)
+
+    try:
+        await asyncio.to_thread(_store_in_cache, output_video_path, cache_path)
+    except OSError as e:
+        # Caching is best-effort - never fail the request over it
+        logger.warning(f"Failed to cache voice change output: {e}")
+    return output_video_path
+
+
+async def _run_voice_change(input_video_path: str, voice_id: str, scratch: ScratchFiles) -> str:
+    """Uncached voice change: extract audio, convert via STS, merge back."""
+    # Fail fast on a missing API key before handing off to a worker thread
+    get_elevenlabs_client()
+
+    # Upload just the audio track when it can be copied out, else the whole
+    # video. Warm the connection to ElevenLabs at the same time - the two are
+    # independent, so the TLS handshake overlaps the extraction
+    audio_track, _ = await asyncio.gather(
+        _extract_audio_track(input_video_path),
+        asyncio.to_thread(_warm_sts_connection),
+    )
+    sts_input_size = len(audio_track) if audio_track is not None else os.path.getsize(input_video_path)
+
+    logger.info(f"Sending to ElevenLabs STS, voice_id={voice_id}, input={'audio track' if audio_track is not None else 'full video'} ({sts_input_size} bytes)")
+
+    # Blocking SDK call runs in a thread so the event loop keeps serving
+    # other requests during the upload/conversion round-trip
+    converted_audio_path = scratch.path("converted.mp3")
+    converted_size = await asyncio.to_thread(_convert_voice, voice_id, audio_track, input_video_path, converted_audio_path)
+    del audio_track
+
+    logger.info(f"Received converted audio: {converted_size} bytes")
+
+    output_video_path = scratch.path("output.mp4")
+
+    # Fast path: remux in-process with PyAV when it's installed
+    if await asyncio.to_thread(_remux_with_pyav, input_video_path, converted_audio_path, output_video_path):
+        logger.info("Merged converted audio with video (PyAV)")
+        return output_video_path
+
+    # Merge new audio back into video using ffmpeg
+    merge_cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-y",  # Only errors on stderr
+        "-i", input_video_path,
+        "-f", "mp3", "-i", converted_audio_path,
+        "-c", "copy",  # Pure remux: copy video and the converted MP3 without re-encoding
+        "-map", "0:v:0",  # Use video from first input
+        "-map", "1:a:0",  # Use audio from second input
+        "-shortest",  # Cut to shortest stream
+        "-movflags", OUTPUT_MOVFLAGS,
+        output_video_path
+    ]
+
+    # Run as an asyncio subprocess so the event loop keeps serving other
+    # requests while ffmpeg works. Nothing useful goes to stdout - don't buffer it
+    async with ffmpeg_slot():
+        proc = await asyncio.create_subprocess_exec(
+            *merge_cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        logger.error(f"ffmpeg merge failed: {stderr.decode(errors='replace')}")
+        raise HTTPException(status_code=500, detail="Failed to merge audio with video")
+
+    logger.info("Merged converted audio with video")
+    return output_video_path
+
+
+@router.post(
+    "/voice-change",
+    response_model=VoiceChangeResponse,
+    deprecated=True,
+    # Body is parsed by hand (see below); keep it documented in OpenAPI
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": VoiceChangeRequest.model_json_schema()}},
+        }
+    },
+)
 async def change_voice(
-    request: VoiceChangeRequest,
+    http_request: Request,
     user: dict = Depends(get_current_user)
 ):
     """
@@ -98,122 +691,157 @@ async def change_voice(
 
     Process:
     1. Get video from base64 or download from URL
-    2. Send video directly to ElevenLabs STS API (it extracts audio)
+    2. Send the audio track (stream-copied out of the video) to ElevenLabs STS
     3. Merge new audio back into video using ffmpeg
     4. Return new video as base64
+
+    Deprecated: prefer /voice-change/upload, which skips base64 entirely
+    and streams the result back.
     """
+    # Size-check the raw body while reading it, so an oversized request is
+    # rejected once it passes the limit - before the rest is buffered (chunked
+    # uploads have no Content-Length) and before any of it is parsed
+    body_too_large = HTTPException(
+        status_code=413,
+        detail=f"Video exceeds max size of {MAX_VIDEO_BASE64 // 1_000_000}MB (base64)"
+    )
+    content_length = http_request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_VOICE_CHANGE_BODY:
+        raise body_too_large
+    body = bytearray()
+    async for chunk in http_request.stream():
+        body += chunk
+        if len(body) > MAX_VOICE_CHANGE_BODY:
+            raise body_too_large
+
+    # Parse the raw body with pydantic-core's JSON parser instead of letting
+    # FastAPI json.loads() it into a dict and validate that - the multi-MB
+    # base64 string is built once, straight from the bytes. Also means the
+    # body is only parsed after auth has passed.
+    try:
+        request = VoiceChangeRequest.model_validate_json(body)
+    except ValidationError as e:
+        # include_input=False: don't echo a huge payload back in the 422
+        raise RequestValidationError([
+            {**err, "loc": ("body", *err["loc"])}  # Same loc shape as FastAPI's own body errors
+            for err in e.errors(include_input=False, include_url=False)
+        ])
+    del body
+
     try:
-        logger.info(f"Voice change request from user {user['email']}, voice_id={request.voice_id}")
+        logger.info("Voice change request from user %s, voice_id=%s", user['email'], request.voice_id)
 
         # Validate input - need either video_base64 or video_url
         if not request.video_base64 and not request.video_url:
             raise HTTPException(status_code=400, detail="Either video_base64 or video_url must be provided")
 
-        # Create temp directory for processing
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # 1. Get video bytes from base64 or URL
-            input_video_path = os.path.join(tmpdir, "input.mp4")
-
-            if request.video_url:
-                # Download video from URL
-                import httpx
-                logger.info(f"Downloading video from URL: {request.video_url[:100]}...")
-                async with httpx.AsyncClient(timeout=120.0) as client:
-                    response = await client.get(request.video_url)
-                    if response.status_code != 200:
-                        raise HTTPException(status_code=400, detail=f"Failed to download video: {response.status_code}")
-                    video_bytes = response.content
-                logger.info(f"Downloaded video: {len(video_bytes)} bytes")
-            else:
-                # Decode from base64
-                video_b64 = request.video_base64
-
-                # Remove data URL prefix if present
-                if video_b64.startswith("data:"):
-                    comma_idx = video_b64.find(",")
-                    if comma_idx != -1:
-                        video_b64 = video_b64[comma_idx + 1:]
-
-                # Remove any whitespace/newlines
-                video_b64 = video_b64.strip().replace("\n", "").replace("\r", "").replace(" ", "")
-
-                # Fix base64 padding if needed
-                padding_needed = len(video_b64) % 4
-                if padding_needed:
-                    video_b64 += "=" * (4 - padding_needed)
-
-                video_bytes = base64.b64decode(video_b64)
-
-            # Log first bytes to verify it's a valid video
-            header_hex = video_bytes[:12].hex() if len(video_bytes) > 12 else video_bytes.hex()
-            logger.info(f"Video header (hex): {header_hex}, total size: {len(video_bytes)} bytes")
-
-            with open(input_video_path, "wb") as f:
-                f.write(video_bytes)
+        # 1. Get video bytes from base64 or URL
+        if request.video_url:
+            # Download video from URL
+            logger.info(f"Downloading video from URL: {request.video_url[:100]}...")
+            # Not the shared ElevenLabs client - that one sends our API key
+            async with httpx.AsyncClient(timeout=120.0) as client:
+                response = await client.get(request.video_url)
+                if response.status_code != 200:
+                    raise HTTPException(status_code=400, detail=f"Failed to download video: {response.status_code}")
+                video_bytes = response.content
+            logger.info(f"Downloaded video: {len(video_bytes)} bytes")
+        else:
+            # O(1) size check before an O(n) decode. Done here rather than as a
+            # Field max_length because the 422 body would echo the whole payload back
+            if len(request.video_base64) > MAX_VIDEO_BASE64:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Video exceeds max size of {MAX_VIDEO_BASE64 // 1_000_000}MB (base64)"
+                )
+
+            # Decode from base64 off the event loop
+            video_bytes = await run_cpu_bound(_decode_video_base64, request.video_base64)
 
+        # Scratch files for processing (tmpfs when it has room)
+        with ScratchFiles(len(video_bytes)) as scratch:
+            input_video_path = scratch.path("input.mp4")
+            await asyncio.to_thread(_write_file, input_video_path, video_bytes)
             logger.info(f"Saved input video: {len(video_bytes)} bytes")
+            del video_bytes
 
-            # 2. Send video to ElevenLabs using official SDK
-            client = get_elevenlabs_client()
+            # 2-3. Convert voice and merge back into the video
+            output_video_path = await _voice_change_to_file(input_video_path, request.voice_id, scratch)
 
-            logger.info(f"Sending to ElevenLabs STS, voice_id={request.voice_id}")
+            # 4. Encode output video as base64 straight from disk
+            output_size = os.path.getsize(output_video_path)
+            output_base64 = await run_cpu_bound(_b64encode_file, output_video_path)
 
-            # Use the official SDK - it handles file upload correctly
-            audio_generator = client.speech_to_speech.convert(
-                voice_id=request.voice_id,
-                audio=video_bytes,  # SDK accepts bytes directly
-                model_id="eleven_multilingual_sts_v2",
-                output_format="mp3_44100_128",
-            )
+            logger.info(f"Voice change complete: {output_size} bytes output")
 
-            # Collect audio bytes from generator
-            converted_audio = b"".join(audio_generator)
-
-            logger.info(f"Received converted audio: {len(converted_audio)} bytes")
-
-            # Save converted audio
-            converted_audio_path = os.path.join(tmpdir, "converted.mp3")
-            with open(converted_audio_path, "wb") as f:
-                f.write(converted_audio)
-
-            # 3. Merge new audio back into video using ffmpeg
-            output_video_path = os.path.join(tmpdir, "output.mp4")
-            merge_cmd = [
-                "ffmpeg", "-y",
-                "-i", input_video_path,
-                "-i", converted_audio_path,
-                "-c:v", "copy",  # Copy video stream without re-encoding
-                "-map", "0:v:0",  # Use video from first input
-                "-map", "1:a:0",  # Use audio from second input
-                "-shortest",  # Cut to shortest stream
-                output_video_path
-            ]
+            return VoiceChangeResponse(
+                video_base64=output_base64,
+                mime_type="video/mp4"
+            )
 
-            result = subprocess.run(merge_cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                logger.error(f"ffmpeg merge failed: {result.stderr}")
-                raise HTTPException(status_code=500, detail="Failed to merge audio with video")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Voice change failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-            logger.info("Merged converted audio with video")
 
-            # 4. Read output video and return as base64
-            with open(output_video_path, "rb") as f:
-                output_bytes = f.read()
+@router.post(
+    "/voice-change/upload",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"video/mp4": {}}, "description": "Video with converted voice"}},
+)
+async def change_voice_upload(
+    voice_id: str = Form(..., description="ElevenLabs voice ID to use"),
+    video: UploadFile = File(..., description="Video file (mp4)"),
+    user: dict = Depends(get_current_user)
+):
+    """
+    Change the voice in a video using ElevenLabs Speech-to-Speech.
 
-            output_base64 = base64.b64encode(output_bytes).decode("utf-8")
+    Same pipeline as /voice-change, but takes the video as a multipart
+    upload and streams the raw MP4 back, avoiding the ~33% base64 size
+    overhead, the decode/encode passes on both sides and holding the
+    whole video in memory.
+    """
+    logger.info("Voice change upload from user %s, voice_id=%s, filename=%s", user['email'], voice_id, video.filename)
 
-            logger.info(f"Voice change complete: {len(output_bytes)} bytes output")
+    # Reject oversized uploads before spending disk, ffmpeg and STS quota on them
+    if video.size is not None and video.size > MAX_VIDEO_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Video exceeds max size of {MAX_VIDEO_UPLOAD_BYTES // 1_000_000}MB"
+        )
 
-            return VoiceChangeResponse(
-                video_base64=output_base64,
-                mime_type="video/mp4"
-            )
+    # Every scratch file is removed when this handler exits, however it
+    # exits (error, cancellation on client disconnect, success). The output
+    # is streamed from a handle opened before that, which keeps it readable
+    scratch = ScratchFiles(video.size or 0)
+    try:
+        # Copy the spooled upload to disk in chunks instead of reading it into memory
+        input_video_path = scratch.path("input.mp4")
+        await asyncio.to_thread(_copy_upload, video, input_video_path)
+        if os.path.getsize(input_video_path) == 0:
+            raise HTTPException(status_code=400, detail="Uploaded video is empty")
+
+        output_video_path = await _voice_change_to_file(input_video_path, voice_id, scratch)
+        output_file = await asyncio.to_thread(open, output_video_path, "rb")
+        output_size = os.fstat(output_file.fileno()).st_size
+
+        logger.info(f"Voice change complete: {output_size} bytes output")
+        return StreamingResponse(
+            _iter_open_file(output_file),
+            media_type="video/mp4",
+            headers={"Content-Length": str(output_size)},
+        )
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Voice change failed: {e}")
+        logger.error(f"Voice change upload failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        scratch.cleanup()
 
 
 @router.post("/generate-music", response_model=GenerateMusicResponse)
@@ -228,9 +856,12 @@ async def generate_music(
     If duration_seconds is None, uses auto mode.
     """
     try:
-        logger.info(f"Music generation request from user {user['email']}, prompt={request.prompt[:50]}..., duration={request.duration_seconds}")
+        logger.info("Music generation request from user %s, prompt=%.50s..., duration=%s", user['email'], request.prompt, request.duration_seconds)
 
-        client = get_elevenlabs_client()
+        # Only the key is needed - the call goes through the shared httpx
+        # client, so don't pay for importing and building the SDK client
+        if not settings.elevenlabs_api_key:
+            raise HTTPException(status_code=500, detail="ElevenLabs API key not configured")
 
         duration_ms = None
         if request.duration_seconds is not None:
@@ -238,40 +869,37 @@ async def generate_music(
             duration_ms = clamped_duration * 1000
             logger.info(f"Using duration: {clamped_duration}s ({duration_ms}ms)")
 
-        api_url = "https://api.elevenlabs.io/v1/music/compose"
-        headers = {
-            "xi-api-key": settings.elevenlabs_api_key,
-            "Content-Type": "application/json"
-        }
+        api_path = "/music/compose"
         payload = {
             "prompt": request.prompt,
         }
         if duration_ms is not None:
             payload["music_length_ms"] = duration_ms
 
-        logger.info(f"Calling ElevenLabs Music API: {api_url} with payload: {payload}")
+        logger.info("Calling ElevenLabs Music API: %s with payload: %s", api_path, payload)
 
-        async with httpx.AsyncClient(timeout=300.0) as http_client:
-            response = await http_client.post(api_url, json=payload, headers=headers)
+        # Shared client supplies the base URL and xi-api-key header
+        http_client = get_http_client()
+        response = await http_client.post(api_path, json=payload)
 
-            if response.status_code == 200:
-                audio_bytes = response.content
-                audio_base64 = base64.b64encode(audio_bytes).decode("utf-8")
-                logger.info(f"Generated music: {len(audio_bytes)} bytes")
-                return GenerateMusicResponse(
-                    audio_base64=audio_base64,
-                    mime_type="audio/mpeg",
-                    duration_seconds=request.duration_seconds
-                )
-            else:
-                error_msg = f"Music generation failed: {response.status_code} - {response.text[:200]}"
-                logger.error(error_msg)
-                # Return fallback response with error info
-                return GenerateMusicResponse(
-                    audio_base64="",
-                    mime_type="audio/mpeg",
-                    duration_seconds=request.duration_seconds
-                )
+        if response.status_code == 200:
+            audio_bytes = response.content
+            audio_base64 = base64.b64encode(audio_bytes).decode("utf-8")
+            logger.info(f"Generated music: {len(audio_bytes)} bytes")
+            return GenerateMusicResponse(
+                audio_base64=audio_base64,
+                mime_type="audio/mpeg",
+                duration_seconds=request.duration_seconds
+            )
+        else:
+            error_msg = f"Music generation failed: {response.status_code} - {response.text[:200]}"
+            logger.error(error_msg)
+            # Return fallback response with error info
+            return GenerateMusicResponse(
+                audio_base64="",
+                mime_type="audio/mpeg",
+                duration_seconds=request.duration_seconds
+            )
     except Exception as e:
         logger.error(f"Music generation failed: {e}")
         # Return fallback response with error info
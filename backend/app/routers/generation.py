@@ -1,7 +1,7 @@
 import asyncio
-from functools import lru_cache
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+from urllib.parse import unquote
+from fastapi import APIRouter, Depends, HTTPException, Request
 from app.schemas import (
     ImageRequest, ImageResponse,
     VideoRequest, StatusRequest, VideoStatusResponse,
@@ -10,81 +10,155 @@ from app.schemas import (
     MusicRequest, MusicResponse
 )
 from app.auth import get_current_user
-from app.services.generation import GenerationService
+from app.services.generation import GcsImage, GenerationService, ImageInput
 from app.services.library_firestore import LibraryServiceFirestore
+from app.config import settings
 from app.logging_config import setup_logger
 from app.exceptions import AppError
-import base64
+from app.cpu_pool import run_cpu_bound
 import httpx
+import mimetypes
 import re
 
 logger = setup_logger(__name__)
 router = APIRouter()
 
-@lru_cache
+_library_service: LibraryServiceFirestore | None = None
+
+
 def get_library_service() -> LibraryServiceFirestore:
     """
-    Cached factory for LibraryServiceFirestore used in asset resolution.
+    Shared LibraryServiceFirestore used in asset resolution.
+
+    A plain module-level singleton rather than @lru_cache: it's hit on every
+    request, and this skips lru_cache's lock + argument hashing.
+
+    To revert: Put @lru_cache back on this function and return LibraryServiceFirestore() directly.
+    """
+    global _library_service
+    if _library_service is None:
+        _library_service = LibraryServiceFirestore()
+    return _library_service
 
-    To revert: Remove this function and change resolve_asset_to_base64
-    back to creating LibraryServiceFirestore() inline.
+def get_http_client(request: Request) -> httpx.AsyncClient:
     """
-    return LibraryServiceFirestore()
+    App-scoped pooled HTTP client for asset downloads (created in the lifespan).
 
-async def resolve_asset_to_base64(asset_id: str, user_id: str) -> str:
-    """Resolve an asset ID to base64 image data by fetching from GCS.
+    Keeps TCP/TLS connections to storage.googleapis.com alive across requests
+    instead of paying a fresh handshake per reference image.
+
+    To revert: Remove this dependency and go back to an
+    `async with httpx.AsyncClient(...)` block in each resolver.
+    """
+    return request.app.state.http_client
+
+async def resolve_asset_to_bytes(asset_id: str, user_id: str) -> bytes:
+    """Resolve an asset ID to raw image bytes by reading the blob from GCS.
 
     Validates that the user owns the asset before allowing access.
     """
     try:
-        # Get asset with ownership check
+        # Ownership check + authenticated blob read (no public-URL HTTPS fetch)
         library_service = get_library_service()
-        asset = await library_service.get_asset(asset_id, user_id)
+        return await library_service.get_asset_bytes(asset_id, user_id)
+    except Exception as e:
+        logger.error(f"Failed to resolve asset {asset_id}: {e}")
+        raise
 
-        if not asset or not asset.url:
-            raise ValueError(f"Asset {asset_id} not found or has no URL")
+# UUID pattern: 8-4-4-4-12 hex characters (compiled once; \Z so a trailing newline doesn't match)
+_UUID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\Z', re.IGNORECASE)
 
-        # Download the image from GCS URL with timeout to prevent hanging
-        async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0)) as client:
-            response = await client.get(asset.url)
-            response.raise_for_status()
-            image_bytes = response.content
+async def resolve_asset_to_gcs_image(asset_id: str, user_id: str) -> GcsImage:
+    """Resolve an asset ID to its gs:// URI so the model reads it from GCS directly.
 
-        # Convert to base64
-        return base64.b64encode(image_bytes).decode('utf-8')
-    except httpx.TimeoutException as e:
-        logger.error(f"Timeout downloading asset {asset_id}: {e}")
-        raise ValueError(f"Timeout downloading asset {asset_id}. The file may be too large or GCS is slow.")
+    Validates that the user owns the asset before allowing access.
+    """
+    try:
+        uri, mime_type = await get_library_service().get_asset_gcs_uri(asset_id, user_id)
+        return GcsImage(uri, mime_type)
     except Exception as e:
         logger.error(f"Failed to resolve asset {asset_id}: {e}")
         raise
 
 def is_asset_id(value: str) -> bool:
     """Check if a string looks like an asset ID (UUID format)"""
-    # UUID pattern: 8-4-4-4-12 hex characters
-    uuid_pattern = r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
-    return bool(re.match(uuid_pattern, value, re.IGNORECASE))
+    # Cheap length/dash check first so multi-MB base64 strings skip the regex
+    return len(value) == 36 and value[8] == '-' and _UUID_RE.match(value) is not None
+
+_GCS_PREFIXES = ("https://storage.googleapis.com/", "gs://")
 
 def is_gcs_url(value: str) -> bool:
     """Check if a string is a GCS URL"""
-    return value.startswith("https://storage.googleapis.com/") or value.startswith("gs://")
+    return value.startswith(_GCS_PREFIXES)
+
+_ASSET_BUCKET_URL_PREFIX = f"https://storage.googleapis.com/{settings.gcs_bucket}/"
+_ASSET_BUCKET_URI_PREFIX = f"gs://{settings.gcs_bucket}/"
 
-async def resolve_gcs_url_to_base64(gcs_url: str) -> str:
-    """Fetch image from GCS URL and return as base64.
+def _gcs_url_to_image(url: str) -> Optional[GcsImage]:
+    """GcsImage for an image URL in the assets bucket, or None for anything else.
+
+    Only the app's own bucket is passed through by URI - the model reads it
+    with the project's service agent, which could see objects the user
+    couldn't fetch over public HTTPS in other buckets. Names that don't look
+    like an image (.mp4, no extension) also return None, so they take the
+    download path and its format checks instead of reaching the model as an image.
+    """
+    if url.startswith(_ASSET_BUCKET_URL_PREFIX):
+        uri = _ASSET_BUCKET_URI_PREFIX + unquote(url[len(_ASSET_BUCKET_URL_PREFIX):].split("?", 1)[0])
+    elif url.startswith(_ASSET_BUCKET_URI_PREFIX):
+        uri = url
+    else:
+        return None
+    mime_type = mimetypes.guess_type(uri)[0]
+    if not mime_type or not mime_type.startswith("image/"):
+        return None
+    return GcsImage(uri, mime_type)
+
+def _classify(value: str) -> str:
+    """Classify an image input as "asset", "gcs" or "base64", cheapest checks first.
+
+    Steady-state inputs are multi-MB base64 blobs; they fail the length
+    check and a single tuple startswith() without ever reaching the regex.
+    """
+    if is_asset_id(value):
+        return "asset"
+    if is_gcs_url(value):
+        return "gcs"
+    return "base64"
+
+# Upper bound for a single image input fetched by URL (model APIs reject far
+# smaller payloads anyway); keeps one bad URL from buffering an arbitrarily large object
+MAX_INPUT_IMAGE_BYTES = 50 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 3 * 64 * 1024
+
+async def resolve_gcs_url_to_bytes(gcs_url: str, client: httpx.AsyncClient) -> bytes:
+    """Fetch image from GCS URL and return the raw bytes.
 
     This handles the case where frontend sends a GCS URL instead of base64 data,
     which can happen when loading saved workflows.
     """
     try:
         logger.info(f"Fetching image from GCS URL: {gcs_url[:80]}...")
-        async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0)) as client:
-            response = await client.get(gcs_url)
+        if gcs_url.startswith("gs://"):
+            # httpx can't fetch gs:// - use the equivalent public URL
+            gcs_url = "https://storage.googleapis.com/" + gcs_url[len("gs://"):]
+        # Stream the body so an oversized object is rejected before it's buffered
+        async with client.stream("GET", gcs_url) as response:
             response.raise_for_status()
-            image_bytes = response.content
-
-        result = base64.b64encode(image_bytes).decode('utf-8')
-        logger.info(f"Converted GCS URL to base64: {len(result)} chars, {len(image_bytes)} bytes")
-        return result
+            content_length = int(response.headers.get("content-length") or 0)
+            if content_length > MAX_INPUT_IMAGE_BYTES:
+                raise ValueError(f"Image is too large ({content_length} bytes)")
+            chunks = []
+            total = 0
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                total += len(chunk)
+                if total > MAX_INPUT_IMAGE_BYTES:
+                    raise ValueError(f"Image is too large (over {MAX_INPUT_IMAGE_BYTES} bytes)")
+                chunks.append(chunk)
+        image_bytes = b"".join(chunks)
+
+        logger.info(f"Fetched image from GCS URL: {len(image_bytes)} bytes")
+        return image_bytes
     except httpx.TimeoutException as e:
         logger.error(f"Timeout fetching GCS URL {gcs_url}: {e}")
         raise ValueError(f"Timeout fetching image from GCS. The file may be too large.")
@@ -92,68 +166,99 @@ async def resolve_gcs_url_to_base64(gcs_url: str) -> str:
         logger.error(f"Failed to fetch GCS URL {gcs_url}: {e}")
         raise ValueError(f"Failed to fetch image: {e}")
 
-@lru_cache
+async def resolve_inputs(
+    values: List[Optional[str]],
+    user_id: str,
+    client: httpx.AsyncClient,
+    service: GenerationService
+) -> List[Optional[ImageInput]]:
+    """Resolve generation image inputs in one parallel batch.
+
+    Each value may be None (passed through), an asset ID, a GCS URL, or
+    inline base64 data. Assets and assets-bucket URLs become GcsImage refs
+    the model reads from GCS itself (see settings.gcs_uri_inputs); other
+    URLs and inline data become raw bytes. Results are returned in the same
+    order as values. Raises the first resolution error, if any.
+    """
+    results: List[Optional[ImageInput]] = [None] * len(values)
+
+    async def _resolve_into(i: int, coro) -> None:
+        # Each task fills its own slot - no index bookkeeping to map back afterwards
+        results[i] = await coro
+
+    # TaskGroup cancels the sibling downloads as soon as one fails instead
+    # of letting them all finish only to be thrown away
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for i, value in enumerate(values):
+                if not value:
+                    continue
+                match _classify(value):
+                    case "asset":
+                        logger.info(f"Resolving input {i} asset ID: {value}")
+                        if settings.gcs_uri_inputs:
+                            tg.create_task(_resolve_into(i, resolve_asset_to_gcs_image(value, user_id)))
+                        else:
+                            tg.create_task(_resolve_into(i, resolve_asset_to_bytes(value, user_id)))
+                    case "gcs":
+                        # Handle GCS URLs from saved workflows
+                        gcs_image = _gcs_url_to_image(value) if settings.gcs_uri_inputs else None
+                        if gcs_image is not None:
+                            logger.info(f"Passing input {i} to the model by URI: {gcs_image.uri}")
+                            results[i] = gcs_image
+                        else:
+                            logger.info(f"Resolving input {i} GCS URL: {value[:80]}...")
+                            tg.create_task(_resolve_into(i, resolve_gcs_url_to_bytes(value, client)))
+                    case _:
+                        # Inline base64 data - decode once here, the service takes bytes
+                        logger.info(f"Input {i} is base64 data: {len(value)} chars, preview: {value[:100]}")
+                        tg.create_task(_resolve_into(i, run_cpu_bound(service.decode_base64_image, value)))
+    except ExceptionGroup as eg:
+        # Prefer an AppError (not found, access denied, ...) so the global
+        # handler returns its status; anything else becomes a 500 upstream
+        error = next((e for e in eg.exceptions if isinstance(e, AppError)), eg.exceptions[0])
+        logger.error(f"Failed to resolve image input: {error}")
+        raise error from None
+
+    return results
+
+_generation_service: GenerationService | None = None
+
+
 def get_generation_service() -> GenerationService:
     """
-    Cached factory for GenerationService.
+    Shared GenerationService instance.
 
-    Uses @lru_cache to ensure only one instance is created and reused
-    across all requests, avoiding repeated initialization of the GenAI
-    client and LibraryServiceFirestore.
+    Created once on first use and reused across all requests, avoiding
+    repeated initialization of the GenAI client and LibraryServiceFirestore.
+    A plain module-level singleton rather than @lru_cache, so the per-request
+    Depends() call is just a global lookup.
 
-    To revert: Remove @lru_cache decorator from this function.
+    To revert: Put @lru_cache back on this function and return GenerationService() directly.
     """
-    return GenerationService()
+    global _generation_service
+    if _generation_service is None:
+        _generation_service = GenerationService()
+    return _generation_service
 
 @router.post("/image", response_model=ImageResponse)
 async def generate_image(
     request: ImageRequest,
     user: dict = Depends(get_current_user),
-    service: GenerationService = Depends(get_generation_service)
+    service: GenerationService = Depends(get_generation_service),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """Generate images using Gemini 3 Pro Image"""
     try:
         ref_count = len(request.reference_images) if request.reference_images else 0
         logger.info(f"Image generation request from user {user['email']}, prompt={request.prompt[:50]}..., reference_images={ref_count}")
 
-        # Resolve asset IDs and GCS URLs to base64 image data
+        # Resolve asset IDs, GCS URLs and inline base64 to raw image bytes
         reference_images_data = None
-
         if request.reference_images:
-            async_tasks = []
-            task_mapping = []  # Track which reference images need async resolution
-            reference_images_data = [None] * len(request.reference_images)
-
-            for i, ref_img in enumerate(request.reference_images):
-                if is_asset_id(ref_img):
-                    logger.info(f"Resolving reference_image asset ID: {ref_img}")
-                    async_tasks.append(resolve_asset_to_base64(ref_img, user["uid"]))
-                    task_mapping.append(i)
-                elif is_gcs_url(ref_img):
-                    # Handle GCS URLs from saved workflows
-                    logger.info(f"Resolving reference_image GCS URL: {ref_img[:80]}...")
-                    async_tasks.append(resolve_gcs_url_to_base64(ref_img))
-                    task_mapping.append(i)
-                else:
-                    # Already base64 data
-                    reference_images_data[i] = ref_img
-                    if len(ref_img) < 200:
-                        logger.info(f"Reference image {i} appears to be raw data: {ref_img[:100]}...")
-                    else:
-                        logger.info(f"Reference image {i} is base64 data: {len(ref_img)} chars")
-
-            # Execute all asset resolutions in parallel
-            if async_tasks:
-                logger.info(f"Resolving {len(async_tasks)} reference image assets in parallel")
-                results = await asyncio.gather(*async_tasks, return_exceptions=True)
-
-                for idx, target_idx in enumerate(task_mapping):
-                    result = results[idx]
-                    if isinstance(result, Exception):
-                        logger.error(f"Failed to resolve reference image asset: {result}")
-                        raise result
-                    reference_images_data[target_idx] = result
-                    logger.info(f"Resolved reference image {target_idx}: {len(result)} chars")
+            reference_images_data = await resolve_inputs(
+                request.reference_images, user["uid"], http_client, service
+            )
 
         return await service.generate_image(
             prompt=request.prompt,
@@ -173,98 +278,28 @@ async def generate_image(
 async def generate_video(
     request: VideoRequest,
     user: dict = Depends(get_current_user),
-    service: GenerationService = Depends(get_generation_service)
+    service: GenerationService = Depends(get_generation_service),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """Generate video using Veo 3.1"""
     try:
         logger.info(f"Video generation request from user {user['email']}")
         logger.info(f"Video params: prompt={request.prompt[:50] if request.prompt else 'None'}..., first_frame={'Yes' if request.first_frame else 'No'}, aspect_ratio={request.aspect_ratio}, duration={request.duration_seconds}, seed={request.seed}")
         
-        # Resolve asset IDs to base64 image data in parallel
-        # All inputs to a single generation request are independent
-        first_frame_data = None
-        last_frame_data = None
-        reference_images_data = None
-
-        # Collect all async tasks for parallel execution
-        async_tasks = []
-        task_mapping = []  # Track what each task is for
-
-        # First frame resolution
-        if request.first_frame:
-            if is_asset_id(request.first_frame):
-                logger.info(f"Resolving first_frame asset ID: {request.first_frame}")
-                async_tasks.append(resolve_asset_to_base64(request.first_frame, user["uid"]))
-                task_mapping.append(("first_frame", 0))
-            elif is_gcs_url(request.first_frame):
-                # Handle GCS URLs from saved workflows
-                logger.info(f"Resolving first_frame GCS URL: {request.first_frame[:80]}...")
-                async_tasks.append(resolve_gcs_url_to_base64(request.first_frame))
-                task_mapping.append(("first_frame", 0))
-            else:
-                first_frame_data = request.first_frame
-                frame_preview = first_frame_data[:100] if len(first_frame_data) > 100 else first_frame_data
-                logger.info(f"First frame data length: {len(first_frame_data)}, preview: {frame_preview}")
-
-        # Last frame resolution
-        if request.last_frame:
-            if is_asset_id(request.last_frame):
-                logger.info(f"Resolving last_frame asset ID: {request.last_frame}")
-                async_tasks.append(resolve_asset_to_base64(request.last_frame, user["uid"]))
-                task_mapping.append(("last_frame", 0))
-            elif is_gcs_url(request.last_frame):
-                # Handle GCS URLs from saved workflows
-                logger.info(f"Resolving last_frame GCS URL: {request.last_frame[:80]}...")
-                async_tasks.append(resolve_gcs_url_to_base64(request.last_frame))
-                task_mapping.append(("last_frame", 0))
-            else:
-                last_frame_data = request.last_frame
-                frame_preview = last_frame_data[:100] if len(last_frame_data) > 100 else last_frame_data
-                logger.info(f"Last frame data length: {len(last_frame_data)}, preview: {frame_preview}")
-
-        # Reference images resolution - collect tasks for parallel execution
-        ref_img_indices = []  # Track which reference images need async resolution
-        if request.reference_images:
-            reference_images_data = [None] * len(request.reference_images)
-            for i, ref_img in enumerate(request.reference_images):
-                if is_asset_id(ref_img):
-                    logger.info(f"Resolving reference_image asset ID: {ref_img}")
-                    async_tasks.append(resolve_asset_to_base64(ref_img, user["uid"]))
-                    task_mapping.append(("ref_img", i))
-                    ref_img_indices.append(i)
-                elif is_gcs_url(ref_img):
-                    # Handle GCS URLs from saved workflows
-                    logger.info(f"Resolving reference_image GCS URL: {ref_img[:80]}...")
-                    async_tasks.append(resolve_gcs_url_to_base64(ref_img))
-                    task_mapping.append(("ref_img", i))
-                    ref_img_indices.append(i)
-                else:
-                    reference_images_data[i] = ref_img
-
-        # Execute all asset resolutions in parallel (single round of concurrent HTTP calls)
-        if async_tasks:
-            logger.info(f"Resolving {len(async_tasks)} assets in parallel")
-            results = await asyncio.gather(*async_tasks, return_exceptions=True)
-
-            # Map results back to their destinations
-            for idx, (task_type, target_idx) in enumerate(task_mapping):
-                result = results[idx]
-                if isinstance(result, Exception):
-                    logger.error(f"Failed to resolve asset: {result}")
-                    raise result
-                if task_type == "first_frame":
-                    first_frame_data = result
-                elif task_type == "last_frame":
-                    last_frame_data = result
-                elif task_type == "ref_img":
-                    reference_images_data[target_idx] = result
+        # Resolve first/last frame and reference images to raw image bytes in
+        # a single parallel batch - all inputs to a generation are independent
+        reference_images = request.reference_images or []
+        first_frame_data, last_frame_data, *reference_images_data = await resolve_inputs(
+            [request.first_frame, request.last_frame, *reference_images],
+            user["uid"], http_client, service
+        )
 
         return await service.generate_video(
             prompt=request.prompt,
             user_id=user["uid"],
             first_frame=first_frame_data,
             last_frame=last_frame_data,
-            reference_images=reference_images_data,
+            reference_images=reference_images_data if request.reference_images else None,
             aspect_ratio=request.aspect_ratio,
             duration_seconds=request.duration_seconds,
             generate_audio=request.generate_audio,
@@ -308,7 +343,6 @@ async def check_video_status(
     """Check video generation status"""
     try:
         # URL-decode the operation_id in case it was encoded
-        from urllib.parse import unquote
         decoded_operation_id = unquote(operation_id)
 
         # Log request details for debugging
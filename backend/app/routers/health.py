@@ -8,7 +8,10 @@ Checks the health of:
 
 To revert: Replace with simple health check that returns {"status": "ok"}
 """
-from fastapi import APIRouter
+import asyncio
+import functools
+import time
+from fastapi import APIRouter, HTTPException
 from google.cloud import storage
 from app.config import settings
 from app.firestore import get_firestore_client
@@ -18,6 +21,36 @@ logger = setup_logger(__name__)
 router = APIRouter()
 
 
+def cached_check(func):
+    """
+    Cache a dependency check's result for settings.health_check_cache_ttl seconds.
+
+    Probes hit / and /ready every few seconds on every replica; this keeps
+    them from issuing a real Firestore/GCS request each time. Concurrent
+    callers on a cache miss share one in-flight check (single-flight).
+
+    To revert: Remove the @cached_check decorators.
+    """
+    cached: tuple[float, str] | None = None  # (expires_at, status)
+    lock = asyncio.Lock()
+
+    @functools.wraps(func)
+    async def wrapper() -> str:
+        nonlocal cached
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        async with lock:
+            # Another caller may have refreshed it while we waited
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+            status = await func()
+            cached = (time.monotonic() + settings.health_check_cache_ttl, status)
+            return status
+
+    return wrapper
+
+
+@cached_check
 async def check_firestore() -> str:
     """
     Check Firestore connectivity by attempting a simple read.
@@ -26,22 +59,28 @@ async def check_firestore() -> str:
     try:
         db = get_firestore_client()
         # Try to read from a health check collection (doesn't need to exist)
-        db.collection("_health").limit(1).get()
+        # Blocking gRPC call - run it in a thread so the event loop stays free
+        await asyncio.to_thread(db.collection("_health").limit(1).get)
         return "healthy"
     except Exception as e:
         logger.error(f"Firestore health check failed: {e}")
         return "unhealthy"
 
 
+@cached_check
 async def check_gcs() -> str:
     """
     Check GCS connectivity by verifying bucket exists.
     """
     try:
-        client = storage.Client()
-        bucket = client.bucket(settings.gcs_bucket)
-        # Check if bucket exists (doesn't download anything)
-        bucket.exists()
+        # Client creation (credential lookup) and exists() both block
+        def _bucket_exists():
+            client = storage.Client()
+            bucket = client.bucket(settings.gcs_bucket)
+            # Check if bucket exists (doesn't download anything)
+            return bucket.exists()
+
+        await asyncio.to_thread(_bucket_exists)
         return "healthy"
     except Exception as e:
         logger.error(f"GCS health check failed: {e}")
@@ -59,9 +98,8 @@ async def health():
         - project: GCP project info
         - models: Available AI models
     """
-    # Run health checks
-    firestore_status = await check_firestore()
-    gcs_status = await check_gcs()
+    # Run health checks concurrently (independent network calls)
+    firestore_status, gcs_status = await asyncio.gather(check_firestore(), check_gcs())
 
     checks = {
         "api": "healthy",
@@ -103,10 +141,7 @@ async def readiness():
     Readiness probe - checks if service is ready to accept traffic.
     Same as full health check but returns 503 if not ready.
     """
-    from fastapi import HTTPException
-
-    firestore_status = await check_firestore()
-    gcs_status = await check_gcs()
+    firestore_status, gcs_status = await asyncio.gather(check_firestore(), check_gcs())
 
     if firestore_status != "healthy" or gcs_status != "healthy":
         raise HTTPException(
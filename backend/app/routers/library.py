@@ -1,4 +1,3 @@
-from functools import lru_cache
 from fastapi import APIRouter, Depends, HTTPException
 from typing import Optional
 from app.schemas import SaveAssetRequest, AssetResponse, LibraryResponse
@@ -10,17 +9,24 @@ from app.exceptions import AppError
 logger = setup_logger(__name__)
 router = APIRouter()
 
-@lru_cache
+_library_service: LibraryServiceFirestore | None = None
+
+
 def get_library_service() -> LibraryServiceFirestore:
     """
-    Cached factory for LibraryServiceFirestore.
+    Shared LibraryServiceFirestore instance.
 
-    Uses @lru_cache to ensure only one instance is created and reused
-    across all requests, avoiding repeated Firestore client initialization.
+    Created once on first use and reused across all requests, avoiding
+    repeated Firestore client initialization. A plain module-level singleton
+    rather than @lru_cache, so the per-request Depends() call is just a
+    global lookup.
 
-    To revert: Remove @lru_cache decorator and functools import.
+    To revert: Put @lru_cache back on this function and return LibraryServiceFirestore() directly.
     """
-    return LibraryServiceFirestore()
+    global _library_service
+    if _library_service is None:
+        _library_service = LibraryServiceFirestore()
+    return _library_service
 
 @router.post("", response_model=AssetResponse)
 async def create_asset(
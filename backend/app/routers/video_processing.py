@@ -2,17 +2,34 @@
 Video processing router for ffmpeg-based operations.
 """
 import asyncio
-import base64
 import tempfile
 import subprocess
 import os
-import json
+import bisect
+import hashlib
+import re
+import uuid
 import httpx
+import orjson
+import pybase64
+import google.auth
+import google.auth.credentials
+import google.auth.transport.requests
+from collections import OrderedDict
+from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from functools import lru_cache
+from typing import Iterable, List, Optional, Dict, Any, Tuple
+from google.auth.credentials import Signing
+from google.cloud import storage
 from app.auth import get_current_user
+from app.config import settings
+from app.cpu_pool import run_cpu_bound
+from app.ffmpeg import detect_h264_encoder, ffmpeg_slot, h264_encoder_args
 from app.logging_config import setup_logger
+from app.routers.generation import get_http_client
+from app.scratch import get_scratch_root, scratch_tempdir
 from io import BytesIO
 
 logger = setup_logger(__name__)
@@ -20,36 +37,110 @@ logger = setup_logger(__name__)
 router = APIRouter(prefix="/v1/video", tags=["video-processing"])
 
 
+# Only the end of ffmpeg's log matters for errors (see get_ffmpeg_error)
+FFMPEG_STDERR_TAIL = 8192
+
+
 async def run_ffmpeg_async(cmd: List[str], timeout: int = 120) -> subprocess.CompletedProcess:
-    """Run FFmpeg command asynchronously without blocking the event loop."""
+    """
+    Run FFmpeg command asynchronously without blocking the event loop.
+
+    stderr goes to an anonymous temp file rather than a pipe, so ffmpeg never
+    stalls on a full pipe and a long log isn't buffered in memory. Only on
+    failure is the tail of it read back into the result's stderr (it is ""
+    on success); stdout is discarded.
+    """
     def _run():
-        return subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
-    return await asyncio.to_thread(_run)
+        with tempfile.TemporaryFile(dir=get_scratch_root()) as stderr_file:
+            result = subprocess.run(
+                cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                stderr=stderr_file, timeout=timeout,
+            )
+            stderr = ""
+            if result.returncode != 0:
+                size = stderr_file.seek(0, os.SEEK_END)
+                stderr_file.seek(max(0, size - FFMPEG_STDERR_TAIL))
+                stderr = stderr_file.read().decode(errors="replace")
+            return subprocess.CompletedProcess(cmd, result.returncode, stdout="", stderr=stderr)
+    # Bounded so concurrent requests don't oversubscribe the CPU (see app/ffmpeg.py)
+    async with ffmpeg_slot():
+        return await asyncio.to_thread(_run)
+
+
+# In-process LRU of ffprobe output keyed by file content, so a client retrying
+# with the same inputs (each request gets a fresh scratch path) skips ffprobe.
+# Stores the raw JSON bytes - every hit parses a fresh dict callers may modify.
+# To revert: Remove the cache helpers and the cache lookup/store in probe_video.
+PROBE_CACHE_SIZE = 256
+PROBE_FINGERPRINT_BYTES = 64 * 1024
+
+_probe_cache: "OrderedDict[Tuple[int, bytes], bytes]" = OrderedDict()
 
 
-def probe_video(video_path: str) -> Dict[str, Any]:
-    """Probe video file to get format and stream information."""
+def probe_fingerprint(path: str) -> Tuple[int, bytes]:
+    """
+    Content key for a media file: its size plus a BLAKE2b hash of the first
+    and last 64 KiB.
+
+    Head and tail hold the container headers and moov/index, which change
+    with any edit to the media, so the whole file never has to be hashed.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(PROBE_FINGERPRINT_BYTES))
+        if size > PROBE_FINGERPRINT_BYTES:
+            f.seek(max(size - PROBE_FINGERPRINT_BYTES, PROBE_FINGERPRINT_BYTES))
+            digest.update(f.read(PROBE_FINGERPRINT_BYTES))
+    return size, digest.digest()
+
+
+async def probe_video(video_path: str) -> Dict[str, Any]:
+    """Probe video file to get format and stream information (cached by content, see _probe_cache)."""
+    try:
+        cache_key = probe_fingerprint(video_path)
+    except OSError:
+        cache_key = None  # Missing file - let ffprobe fail as before
+    cached = _probe_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        _probe_cache.move_to_end(cache_key)
+        return orjson.loads(cached)
+
     probe_cmd = [
         "ffprobe", "-v", "quiet",
         "-print_format", "json",
         "-show_format", "-show_streams",
         video_path
     ]
-    result = subprocess.run(probe_cmd, capture_output=True, text=True)
-    if result.returncode == 0:
-        return json.loads(result.stdout)
-    return {}
+    async with ffmpeg_slot():
+        proc = await asyncio.create_subprocess_exec(
+            *probe_cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await proc.communicate()
+    # ffprobe's JSON goes straight from the stdout bytes to dicts - orjson
+    # parses bytes without a decode-to-str step and is several times faster
+    if proc.returncode != 0:
+        return {}
+    info = orjson.loads(stdout)
+    if cache_key:
+        _probe_cache[cache_key] = stdout
+        if len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return info
+
+
+# Lines in ffmpeg's log that describe what went wrong (vs banner/progress output)
+_FFMPEG_ERROR_LINE_RE = re.compile(r'error|invalid|failed|no such|unable|cannot', re.IGNORECASE)
 
 
 def get_ffmpeg_error(stderr: str) -> str:
     """Extract meaningful error from FFmpeg stderr output."""
     lines = stderr.strip().split('\n')
     # Look for actual error lines (skip banner/info)
-    error_lines = []
-    for line in lines:
-        line_lower = line.lower()
-        if any(keyword in line_lower for keyword in ['error', 'invalid', 'failed', 'no such', 'unable', 'cannot']):
-            error_lines.append(line.strip())
+    error_lines = [line.strip() for line in lines if _FFMPEG_ERROR_LINE_RE.search(line)]
     if error_lines:
         return '; '.join(error_lines[-3:])  # Last 3 error lines
     # Fallback: return last few non-empty lines
@@ -78,10 +169,12 @@ class MergeVideosRequest(BaseModel):
     
     aspect_ratio: str = Field(default="16:9", description="Output aspect ratio: 16:9, 9:16, 1:1, 4:3, or 4:5")
     trim_silence: bool = Field(default=False, description="Auto-trim trailing silence from video clips before merging")
+    inline: Optional[bool] = Field(default=None, description="true = always return video_base64, false = always return a signed video_url, unset = by output size")
 
 
 class MergeVideosResponse(BaseModel):
-    video_base64: str
+    video_base64: Optional[str] = None
+    video_url: Optional[str] = Field(default=None, description="Signed GCS URL, set instead of video_base64 for large outputs")
     mime_type: str = "video/mp4"
 
 
@@ -92,7 +185,8 @@ class ApplyFiltersRequest(BaseModel):
 
 
 class ApplyFiltersResponse(BaseModel):
-    video_base64: str
+    video_base64: Optional[str] = None
+    video_url: Optional[str] = Field(default=None, description="Signed GCS URL, set instead of video_base64 for large outputs")
     mime_type: str = "video/mp4"
 
 
@@ -103,10 +197,12 @@ class AddMusicRequest(BaseModel):
     audio_url: Optional[str] = Field(default=None, description="GCS/HTTP URL to audio")
     music_volume: int = Field(default=50, description="Music volume 0-100")
     original_volume: int = Field(default=100, description="Original audio volume 0-100")
+    inline: Optional[bool] = Field(default=None, description="true = always return video_base64, false = always return a signed video_url, unset = by output size")
 
 
 class AddMusicResponse(BaseModel):
-    video_base64: str
+    video_base64: Optional[str] = None
+    video_url: Optional[str] = Field(default=None, description="Signed GCS URL, set instead of video_base64 for large outputs")
     mime_type: str = "video/mp4"
 
 
@@ -119,15 +215,26 @@ class ApplyFiltersRequest(BaseModel):
     video_base64: Optional[str] = Field(default=None, description="Base64 encoded video")
     video_url: Optional[str] = Field(default=None, description="GCS/HTTP URL (preferred for large files)")
     filters: List[FilterConfig] = Field(..., description="List of filters to apply in order")
+    inline: Optional[bool] = Field(default=None, description="true = always return video_base64, false = always return a signed video_url, unset = by output size")
 
 
 class ApplyFiltersResponse(BaseModel):
-    video_base64: str
+    video_base64: Optional[str] = None
+    video_url: Optional[str] = Field(default=None, description="Signed GCS URL, set instead of video_base64 for large outputs")
     mime_type: str = "video/mp4"
 
 
-def clean_base64(b64_string: str) -> bytes:
-    """Clean base64 string and decode to bytes."""
+# Drops whitespace and maps URL-safe base64 ("-", "_") to the standard alphabet
+_B64_CLEAN = str.maketrans({" ": None, "\t": None, "\n": None, "\r": None, "-": "+", "_": "/"})
+
+
+def _normalize_base64(b64_string: str) -> str:
+    """
+    Strip data URL prefix and whitespace and map URL-safe chars.
+
+    Padding is left alone - see _pad_base64(). Fixing it here would copy
+    the whole payload just to append up to two characters.
+    """
     if not b64_string:
         raise ValueError("Empty base64 string provided")
 
@@ -137,33 +244,261 @@ def clean_base64(b64_string: str) -> bytes:
         if comma_idx != -1:
             b64_string = b64_string[comma_idx + 1:]
 
-    # Remove whitespace and URL-safe characters that might have been introduced
-    b64_string = b64_string.strip().replace("\n", "").replace("\r", "").replace(" ", "")
+    # Remove whitespace and map URL-safe characters to standard base64 in one pass
+    return b64_string.translate(_B64_CLEAN)
 
-    # Replace URL-safe characters with standard base64 characters
-    b64_string = b64_string.replace("-", "+").replace("_", "/")
 
-    # Fix padding
+def _pad_base64(b64_string: str) -> str:
+    """Add missing "=" padding; returns the string itself when none is needed."""
     padding_needed = len(b64_string) % 4
     if padding_needed:
-        b64_string += "=" * (4 - padding_needed)
+        return b64_string + "=" * (4 - padding_needed)
+    return b64_string
+
+
+def b64_size_hint(*b64_strings: Optional[str], urls: Iterable[Optional[str]] = ()) -> Optional[int]:
+    """
+    Approximate decoded size of base64 inputs, for scratch_tempdir().
+
+    None (size unknown - scratch goes on disk) if any of urls is set, since
+    URL inputs are the path for large files and their size isn't known
+    until they're downloaded.
+    """
+    if any(urls):
+        return None
+    return sum(len(b64) * 3 // 4 for b64 in b64_strings if b64)
+
 
+def preallocate(f, size: int) -> bool:
+    """
+    Reserve size bytes for an open file up front (best effort).
+
+    Lets the filesystem allocate the file in one go instead of growing it
+    write by write. Returns True if space was reserved - the file is then
+    size bytes long until the caller truncates it to what was written.
+    """
+    if size <= 0 or not hasattr(os, "posix_fallocate"):
+        return False
     try:
-        return base64.b64decode(b64_string)
-    except Exception as e:
-        logger.error(f"Base64 decode failed: {e}, string length: {len(b64_string)}, first 50 chars: {b64_string[:50]}")
-        raise ValueError(f"Invalid base64 data: {str(e)}")
+        os.posix_fallocate(f.fileno(), 0, size)
+        return True
+    except OSError:
+        # Not supported by this filesystem - just write normally
+        return False
 
 
-async def download_video_from_url(url: str, timeout: float = 120.0) -> bytes:
-    """Download video from URL (GCS or HTTP)."""
-    async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-        response = await client.get(url)
-        response.raise_for_status()
-        return response.content
+# Multiple of 4 so every slice is whole base64 quads
+B64_DECODE_CHUNK = 4 * 64 * 1024
+
 
+def decode_b64_to_file(b64_string: str, out_path: str) -> int:
+    """
+    Clean a base64 string and decode it straight into out_path.
+
+    Decodes in B64_DECODE_CHUNK-character slices, so the decoded video is
+    never held in memory in full alongside the base64 string. Blocking
+    (SIMD decode + file writes), so callers run this via run_cpu_bound.
+
+    Returns:
+        Number of bytes written
+    """
+    b64_string = _normalize_base64(b64_string)
+
+    written = 0
+    with open(out_path, "wb") as f:
+        # Upper bound of the decoded size; trimmed to the real size below
+        preallocated = preallocate(f, len(b64_string) * 3 // 4)
+        for start in range(0, len(b64_string), B64_DECODE_CHUNK):
+            # Slices are quad-aligned, so only the final one can need padding
+            b64_slice = _pad_base64(b64_string[start:start + B64_DECODE_CHUNK])
+            try:
+                chunk = pybase64.b64decode(b64_slice)
+            except Exception as e:
+                logger.error(f"Base64 decode failed at offset {start}: {e}, string length: {len(b64_string)}, first 50 chars: {b64_string[:50]}")
+                raise ValueError(f"Invalid base64 data: {str(e)}")
+            f.write(chunk)
+            written += len(chunk)
+        if preallocated:
+            f.truncate(written)
+    return written
+
+
+# Multiple of 3 so every chunk encodes without padding until the last one
+B64_ENCODE_CHUNK = 3 * 64 * 1024
+
+
+def stream_b64_file(path: str) -> str:
+    """
+    Base64-encode a file in chunks.
+
+    Peak memory is the encoded output plus one chunk, instead of the raw
+    file + encoded bytes + decoded str all at once. Blocking (file reads +
+    SIMD encode), so callers run this via run_cpu_bound.
+    """
+    encoded = bytearray()
+    with open(path, "rb") as f:
+        while chunk := f.read(B64_ENCODE_CHUNK):
+            encoded += pybase64.b64encode(chunk)
+    return encoded.decode("ascii")
+
+
+# How long a signed video_url for a large output stays valid
+OUTPUT_URL_EXPIRY = timedelta(hours=1)
+# Large outputs live under this prefix of the assets bucket. Nothing here
+# deletes them - a bucket lifecycle rule (ensure_output_lifecycle_rule, applied
+# by scripts/deploy.sh) removes them once they're OUTPUT_RETENTION_DAYS old,
+# long after their signed URL has expired.
+OUTPUT_BLOB_PREFIX = "video-processing/"
+OUTPUT_RETENTION_DAYS = 1
+
+_output_credentials: Optional[google.auth.credentials.Credentials] = None
+_output_bucket: Optional[storage.Bucket] = None
+
+
+def get_output_bucket() -> storage.Bucket:
+    """Bucket for large outputs (the assets bucket), created once on first use."""
+    global _output_credentials, _output_bucket
+    if _output_bucket is None:
+        # Kept separately so signing uses the public credentials object
+        # rather than reaching into the storage client
+        _output_credentials, project = google.auth.default()
+        _output_bucket = storage.Client(credentials=_output_credentials, project=project).bucket(settings.gcs_bucket)
+    return _output_bucket
+
+
+def ensure_output_lifecycle_rule(bucket: storage.Bucket) -> bool:
+    """
+    Add a lifecycle rule deleting OUTPUT_BLOB_PREFIX objects after
+    OUTPUT_RETENTION_DAYS, keeping the bucket's other rules.
+
+    Needs storage.buckets.update, so it's run at deploy time rather than by
+    the service. Returns True if the bucket was changed.
+    """
+    bucket.reload()
+    for rule in bucket.lifecycle_rules:
+        condition = rule.get("condition", {})
+        if (
+            rule.get("action", {}).get("type") == "Delete"
+            and condition.get("age") == OUTPUT_RETENTION_DAYS
+            and condition.get("matchesPrefix") == [OUTPUT_BLOB_PREFIX]
+        ):
+            return False
+    bucket.add_lifecycle_delete_rule(age=OUTPUT_RETENTION_DAYS, matches_prefix=[OUTPUT_BLOB_PREFIX])
+    bucket.patch()
+    return True
+
+
+def upload_output_to_gcs(path: str, user_id: str) -> str:
+    """
+    Upload a finished video to GCS and return a V4 signed GET URL for it.
 
-def detect_trailing_silence(video_path: str, noise_db: float = -30, min_duration: float = 0.3) -> Optional[float]:
+    Blocking (upload + token refresh), so callers run this in a thread.
+    Credentials without a private key (Cloud Run / GCE metadata server) sign
+    through the IAM API using the service account email and an access token.
+    The object is removed by the bucket lifecycle rule, see OUTPUT_BLOB_PREFIX.
+    """
+    bucket = get_output_bucket()
+    blob = bucket.blob(f"{OUTPUT_BLOB_PREFIX}{user_id}/{uuid.uuid4()}.mp4")
+    blob.upload_from_filename(path, content_type="video/mp4")
+
+    sign_kwargs: Dict[str, Any] = {}
+    credentials = _output_credentials
+    if not isinstance(credentials, Signing):
+        if not credentials.valid:
+            credentials.refresh(google.auth.transport.requests.Request())
+        sign_kwargs = {
+            "service_account_email": credentials.service_account_email,
+            "access_token": credentials.token,
+        }
+    return blob.generate_signed_url(
+        version="v4", expiration=OUTPUT_URL_EXPIRY, method="GET", **sign_kwargs
+    )
+
+
+async def encode_output(
+    output_path: str, user_id: str, inline: Optional[bool] = None
+) -> Dict[str, Optional[str]]:
+    """
+    Build the video part of an endpoint response for output_path.
+
+    Outputs the caller asked not to get inline (inline=False), or with
+    inline unset and over settings.output_b64_max_bytes, are uploaded to GCS
+    and returned as a signed video_url, skipping the base64 encode and the
+    ~1.33x larger JSON body. Everything else (or a failed upload) comes back
+    inline as video_base64 like before.
+
+    To revert: Set OUTPUT_B64_MAX_BYTES=0 (the default) and don't send inline=false.
+    """
+    if inline is None:
+        limit = settings.output_b64_max_bytes
+        use_url = bool(limit) and os.path.getsize(output_path) > limit
+    else:
+        use_url = not inline
+    if use_url:
+        try:
+            video_url = await asyncio.to_thread(upload_output_to_gcs, output_path, user_id)
+            logger.info("Output uploaded to GCS, returning signed URL instead of base64")
+            return {"video_base64": None, "video_url": video_url}
+        except Exception as e:
+            logger.warning(f"Output upload to GCS failed, returning base64 instead: {e}")
+    return {"video_base64": await run_cpu_bound(stream_b64_file, output_path), "video_url": None}
+
+
+# Max concurrent URL downloads per merge request, to stay polite to GCS/origin servers
+MERGE_DOWNLOAD_CONCURRENCY = 8
+
+# Download chunk size - large enough that per-chunk overhead is negligible
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+async def download_to_file(
+    client: httpx.AsyncClient, url: str, out_path: str, timeout: float = 120.0
+) -> int:
+    """
+    Download a video/audio/image URL (GCS or HTTP) straight into out_path.
+
+    Streams the response body to disk chunk by chunk, so memory use stays at
+    one chunk regardless of the file's size - the body is never held as one
+    bytes object. Uses the app-scoped pooled
+    client (see get_http_client), so the downloads of a merge share kept-alive
+    HTTP/2 connections instead of each paying a TLS handshake.
+
+    To revert: Drop the client parameter and wrap the body in an
+    `async with httpx.AsyncClient(timeout=timeout, follow_redirects=True)` block.
+
+    Returns:
+        Number of bytes written
+    """
+    written = 0
+    async with client.stream("GET", url, timeout=timeout, follow_redirects=True) as response:
+        response.raise_for_status()
+        # File I/O runs in a thread so a slow disk never stalls the event loop
+        f = await asyncio.to_thread(open, out_path, "wb")
+        try:
+            # Content-Length is the encoded size; only trust it for identity bodies
+            preallocated = False
+            if "content-encoding" not in response.headers:
+                preallocated = await asyncio.to_thread(preallocate, f, int(response.headers.get("content-length", 0)))
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                await asyncio.to_thread(f.write, chunk)
+                written += len(chunk)
+            if preallocated:
+                await asyncio.to_thread(f.truncate, written)
+        finally:
+            await asyncio.to_thread(f.close)
+    return written
+
+
+# silencedetect log lines: "silence_start: 5.123" / "silence_end: 7.456 | silence_duration: 2.333"
+_SILENCE_RE = re.compile(r'silence_(start|end):\s*([\d.]+)')
+
+
+async def detect_trailing_silence(
+    video_path: str,
+    noise_db: float = -30,
+    min_duration: float = 0.3,
+    probe_info: Optional[Dict[str, Any]] = None,
+) -> Optional[float]:
     """
     Detect trailing silence in a video and return the trim point (end of last non-silent audio).
 
@@ -171,14 +506,14 @@ def detect_trailing_silence(video_path: str, noise_db: float = -30, min_duration
         video_path: Path to video file
         noise_db: Silence threshold in dB (default -30dB)
         min_duration: Minimum silence duration to detect in seconds (default 0.3s)
+        probe_info: probe_video() result for video_path, if the caller already has it
 
     Returns:
         Trim point in seconds (time to trim video to), or None if no trailing silence found
     """
-    import re
-
     # First check if video has an audio track
-    probe_info = probe_video(video_path)
+    if probe_info is None:
+        probe_info = await probe_video(video_path)
     has_audio = False
     for stream in probe_info.get("streams", []):
         if stream.get("codec_type") == "audio":
@@ -196,15 +531,24 @@ def detect_trailing_silence(video_path: str, noise_db: float = -30, min_duration
         return None
 
     # Use silencedetect filter to find silence periods
+    # -vn: only the audio is analysed, so don't decode the video at all
     detect_cmd = [
         "ffmpeg", "-i", video_path,
+        "-vn",
         "-af", f"silencedetect=noise={noise_db}dB:d={min_duration}",
         "-f", "null", "-"
     ]
 
     logger.debug(f"Running silence detection: {' '.join(detect_cmd)}")
-    result = subprocess.run(detect_cmd, capture_output=True, text=True)
-    stderr = result.stderr
+    async with ffmpeg_slot():
+        proc = await asyncio.create_subprocess_exec(
+            *detect_cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr_bytes = await proc.communicate()
+    stderr = stderr_bytes.decode(errors="replace")
 
     # Log the output for debugging
     logger.debug(f"Silence detection output: {stderr[-500:] if len(stderr) > 500 else stderr}")
@@ -212,8 +556,11 @@ def detect_trailing_silence(video_path: str, noise_db: float = -30, min_duration
     # Parse silence_start and silence_end from output
     # Format: [silencedetect @ 0x...] silence_start: 5.123
     # Format: [silencedetect @ 0x...] silence_end: 7.456 | silence_duration: 2.333
-    silence_starts = re.findall(r'silence_start:\s*([\d.]+)', stderr)
-    silence_ends = re.findall(r'silence_end:\s*([\d.]+)', stderr)
+    # One scan of stderr for both markers
+    silence_starts = []
+    silence_ends = []
+    for marker, value in _SILENCE_RE.findall(stderr):
+        (silence_starts if marker == "start" else silence_ends).append(value)
 
     logger.info(f"Silence detection for {video_path}: found {len(silence_starts)} silence periods, duration={duration:.2f}s")
 
@@ -243,7 +590,7 @@ def detect_trailing_silence(video_path: str, noise_db: float = -30, min_duration
     return None
 
 
-def trim_video_to_point(video_path: str, trim_point: float, output_path: str) -> bool:
+async def trim_video_to_point(video_path: str, trim_point: float, output_path: str) -> bool:
     """
     Trim video to specified point using FFmpeg.
 
@@ -267,7 +614,20 @@ def trim_video_to_point(video_path: str, trim_point: float, output_path: str) ->
         output_path
     ]
 
-    result = subprocess.run(trim_cmd, capture_output=True, text=True)
+    async with ffmpeg_slot():
+        proc = await asyncio.create_subprocess_exec(
+            *trim_cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await proc.communicate()
+
+    if proc.returncode != 0:
+        logger.warning(f"Trim failed for {video_path}: {get_ffmpeg_error(stderr.decode(errors='replace'))}")
+        return False
+
+    return True
 
 
 def convert_svg_to_png(svg_bytes: bytes, output_path: str, width: Optional[int] = None, height: Optional[int] = None) -> bool:
@@ -343,11 +703,41 @@ def detect_image_format(image_bytes: bytes) -> str:
     
     return 'unknown'
 
-    if result.returncode != 0:
-        logger.warning(f"Trim failed for {video_path}: {get_ffmpeg_error(result.stderr)}")
-        return False
 
-    return True
+def watermark_xy(
+    position: str, margin: int, video_width: int, video_height: int, mark_width: int, mark_height: int
+) -> Tuple[int, int]:
+    """Top-left pixel offset of a mark_width x mark_height watermark at position (default bottom-right)."""
+    right = video_width - mark_width - margin
+    bottom = video_height - mark_height - margin
+    positions = {
+        "top-left": (margin, margin),
+        "top-right": (right, margin),
+        "bottom-left": (margin, bottom),
+        "bottom-right": (right, bottom),
+        "center": ((video_width - mark_width) // 2, (video_height - mark_height) // 2),
+    }
+    return positions.get(position, positions["bottom-right"])
+
+
+def stream_rotation(stream: Dict[str, Any]) -> int:
+    """
+    Display rotation of an ffprobe video stream in degrees (0, 90, 180 or 270).
+
+    ffmpeg autorotates such inputs, so for 90/270 the frame filters see is the
+    probed width x height transposed.
+    """
+    rotation = 0
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            rotation = side_data["rotation"]
+            break
+    else:
+        rotation = stream.get("tags", {}).get("rotate", 0)
+    try:
+        return round(float(rotation)) % 360
+    except (TypeError, ValueError):
+        return 0
 
 
 def filter_config_to_ffmpeg(filter_config: FilterConfig) -> str:
@@ -425,14 +815,97 @@ def filter_config_to_ffmpeg(filter_config: FilterConfig) -> str:
         return None
 
 
+def concat_copy_signature(info: Dict[str, Any]) -> tuple:
+    """
+    Stream parameters that must be identical across inputs for a stream-copy concat.
+
+    Returns:
+        (video params, audio params, stream count) from a probe_video() result;
+        video/audio params are None when the stream is missing
+    """
+    video = audio = None
+    streams = info.get("streams", [])
+    for stream in streams:
+        if stream.get("codec_type") == "video" and video is None:
+            video = (
+                stream.get("codec_name"), stream.get("profile"),
+                stream.get("width"), stream.get("height"),
+                stream.get("pix_fmt"), stream.get("r_frame_rate"),
+                stream.get("sample_aspect_ratio"),
+            )
+        elif stream.get("codec_type") == "audio" and audio is None:
+            audio = (stream.get("codec_name"), stream.get("sample_rate"), stream.get("channels"))
+    return (video, audio, len(streams))
+
+
+def write_concat_list(paths: List[str], list_path: str) -> None:
+    """Write a concat demuxer list file for paths (quotes escaped)."""
+    with open(list_path, "w") as f:
+        for path in paths:
+            escaped = path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+MERGE_AUDIO_FORMAT = "aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo"
+
+
+def build_normalize_clip_cmd(
+    video_path: str,
+    output_path: str,
+    width: int,
+    height: int,
+    has_audio: bool,
+    include_audio: bool,
+    duration: float,
+) -> List[str]:
+    """
+    FFmpeg command that re-encodes one merge input to the shared output format.
+
+    Every clip comes out with identical video (size, SAR, 30fps, H.264) and,
+    when include_audio is set, identical audio (44.1kHz stereo PCM - silence
+    if the clip has none), so the clips can be joined with the concat
+    demuxer without another decode/encode. PCM in Matroska avoids the
+    per-segment AAC priming gaps you get from concatenating AAC clips; the
+    audio is encoded to AAC once, in the final concat pass. Audio is padded
+    and cut to the clip's video length, so a short audio track can't leave a
+    timestamp gap that drifts A/V sync in the clips after it.
+    """
+    filter_parts = [
+        f"[0:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black,"
+        f"setsar=1,fps=30[v]"
+    ]
+    map_args = ["-map", "[v]"]
+    if include_audio:
+        if has_audio:
+            filter_parts.append(f"[0:a]{MERGE_AUDIO_FORMAT},apad[a]")
+        else:
+            # Generate silent audio matching the video's length
+            filter_parts.append(f"anullsrc=r=44100:cl=stereo:d={duration}[a]")
+        # -shortest ends the padded audio where the video ends
+        map_args += ["-map", "[a]", "-c:a", "pcm_s16le", "-shortest"]
+
+    return [
+        "ffmpeg", "-y",
+        "-i", video_path,
+        "-filter_complex", ";".join(filter_parts),
+        *map_args,
+        *h264_encoder_args(),
+        output_path
+    ]
+
+
 @router.post("/merge", response_model=MergeVideosResponse)
 async def merge_videos(
     request: MergeVideosRequest,
-    user: dict = Depends(get_current_user)
+    user: dict = Depends(get_current_user),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
-    Merge multiple videos into one using ffmpeg concat filter.
-    Uses concat filter (not demuxer) for better compatibility with different video sources.
+    Merge multiple videos into one using ffmpeg.
+    Each input is first normalized to the same size/fps/audio format (in
+    parallel, one ffmpeg per clip), so inputs from different sources can be
+    joined with the concat demuxer as a plain remux.
 
     Accepts:
     - videos_base64: List of base64 encoded videos (for small files)
@@ -474,82 +947,83 @@ async def merge_videos(
         if total_count > 25:
             raise HTTPException(status_code=400, detail="Maximum 25 videos allowed")
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # Save all input videos and probe them in order
-            video_paths = []
-            video_infos = []
-            
-            for video_index, video_input in enumerate(video_inputs):
-                logger.info(f"Processing video {video_index + 1} of {total_count}")
-                
-                # Get video bytes
+        with scratch_tempdir(b64_size_hint(*(v.base64 for v in video_inputs), urls=(v.url for v in video_inputs))) as tmpdir:
+            # Save and probe all input videos concurrently; each task fills its
+            # own slot so order is preserved
+            video_paths = [os.path.join(tmpdir, f"input_{i}.mp4") for i in range(total_count)]
+            video_infos: List[Dict[str, Any]] = [{}] * total_count
+            download_slots = asyncio.Semaphore(MERGE_DOWNLOAD_CONCURRENCY)
+
+            async def save_input(video_index: int, video_input: VideoInput) -> None:
+                video_path = video_paths[video_index]
                 if video_input.url:
                     logger.info(f"Downloading video {video_index} from URL: {video_input.url[:80]}...")
                     try:
-                        video_bytes = await download_video_from_url(video_input.url)
+                        async with download_slots:
+                            video_size = await download_to_file(http_client, video_input.url, video_path)
                     except httpx.HTTPError as e:
                         logger.error(f"Failed to download video {video_index}: {e}")
                         raise HTTPException(status_code=400, detail=f"Failed to download video {video_index+1}: {str(e)}")
                 elif video_input.base64:
-                    video_bytes = clean_base64(video_input.base64)
+                    video_size = await run_cpu_bound(decode_b64_to_file, video_input.base64, video_path)
                 else:
                     raise HTTPException(status_code=400, detail=f"Video {video_index+1} has no data")
-                
-                # Save video file
-                video_path = os.path.join(tmpdir, f"input_{video_index}.mp4")
-                with open(video_path, "wb") as f:
-                    f.write(video_bytes)
-                video_paths.append(video_path)
-                
-                # Probe video info
-                info = probe_video(video_path)
-                video_infos.append(info)
-                
+
                 source_type = "URL" if video_input.url else "base64"
-                logger.info(f"Saved video {video_index} ({source_type}): {len(video_bytes)} bytes")
+                logger.info(f"Saved video {video_index} ({source_type}): {video_size} bytes")
+
+                # Probe as soon as this video is on disk, while others still download
+                video_infos[video_index] = await probe_video(video_path)
+
+            # TaskGroup cancels the other downloads as soon as one fails
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    for video_index, video_input in enumerate(video_inputs):
+                        tg.create_task(save_input(video_index, video_input))
+            except ExceptionGroup as eg:
+                # Prefer an HTTPException (bad URL, missing data) so the client gets its status
+                error = next((e for e in eg.exceptions if isinstance(e, HTTPException)), eg.exceptions[0])
+                raise error from None
 
             # Apply silence trimming if enabled
             if request.trim_silence:
                 logger.info(f"Trim silence enabled - detecting and trimming trailing silence for {len(video_paths)} videos")
-                trimmed_paths = []
-                for i, video_path in enumerate(video_paths):
-                    # Try progressively more sensitive thresholds
-                    # -30dB: strict (only very quiet silence)
-                    # -40dB: medium (quiet ambient)
-                    # -50dB: lenient (catches most trailing silence)
-                    trim_point = detect_trailing_silence(video_path, noise_db=-30, min_duration=0.1)
-                    if trim_point is None:
-                        logger.debug(f"Video {i}: no silence at -30dB, trying -40dB")
-                        trim_point = detect_trailing_silence(video_path, noise_db=-40, min_duration=0.1)
-                    if trim_point is None:
-                        logger.debug(f"Video {i}: no silence at -40dB, trying -50dB")
-                        trim_point = detect_trailing_silence(video_path, noise_db=-50, min_duration=0.1)
-
-                    if trim_point is not None and trim_point > 0.5:
-                        # Create trimmed version
-                        trimmed_path = os.path.join(tmpdir, f"trimmed_{i}.mp4")
-                        if trim_video_to_point(video_path, trim_point, trimmed_path):
-                            logger.info(f"Video {i} trimmed from {trim_point:.2f}s to end")
-                            trimmed_paths.append(trimmed_path)
-                            # Re-probe the trimmed video
-                            video_infos[i] = probe_video(trimmed_path)
-                        else:
-                            logger.warning(f"Video {i} trim failed, using original")
-                            trimmed_paths.append(video_path)
-                    else:
+
+                async def trim_silence(i: int, video_path: str) -> str:
+                    """Trim one video's trailing silence; returns the path to merge and updates video_infos[i]."""
+                    # A single pass at -30dB is enough: anything below -40/-50dB is
+                    # also below -30dB, so quieter thresholds can never find a
+                    # trailing silence that -30dB missed
+                    trim_point = await detect_trailing_silence(
+                        video_path, noise_db=-30, min_duration=0.1, probe_info=video_infos[i]
+                    )
+
+                    if trim_point is None or trim_point <= 0.5:
                         logger.info(f"Video {i}: no trailing silence detected, using original")
-                        trimmed_paths.append(video_path)
-                video_paths = trimmed_paths
+                        return video_path
+
+                    # Create trimmed version
+                    trimmed_path = os.path.join(tmpdir, f"trimmed_{i}.mp4")
+                    if not await trim_video_to_point(video_path, trim_point, trimmed_path):
+                        logger.warning(f"Video {i} trim failed, using original")
+                        return video_path
+
+                    logger.info(f"Video {i} trimmed from {trim_point:.2f}s to end")
+                    # Stream-copy trim keeps the same streams, only the duration
+                    # changes - no need to re-probe
+                    info = video_infos[i]
+                    video_infos[i] = {**info, "format": {**info.get("format", {}), "duration": str(trim_point)}}
+                    return trimmed_path
+
+                # Videos are independent - detect/trim them all concurrently
+                video_paths = list(await asyncio.gather(
+                    *(trim_silence(i, path) for i, path in enumerate(video_paths))
+                ))
                 logger.info(f"Silence trimming complete, proceeding with merge")
 
             output_path = os.path.join(tmpdir, "output.mp4")
             n = len(video_paths)
 
-            # Build input arguments
-            input_args = []
-            for path in video_paths:
-                input_args.extend(["-i", path])
-
             # Check if all videos have audio streams
             has_audio_list = []
             for info in video_infos:
@@ -576,77 +1050,85 @@ async def merge_videos(
             output_width, output_height = aspect_resolutions.get(aspect_ratio, (1920, 1080))
             logger.info(f"Output aspect ratio: {aspect_ratio}, resolution: {output_width}x{output_height}")
 
-            # Build filter_complex using concat filter
-            # This normalizes all inputs to same format before concatenating
-            filter_parts = []
-            concat_inputs = ""
-
-            for i in range(n):
-                # Scale and pad video to consistent size, set framerate
-                filter_parts.append(
-                    f"[{i}:v]scale={output_width}:{output_height}:force_original_aspect_ratio=decrease,"
-                    f"pad={output_width}:{output_height}:(ow-iw)/2:(oh-ih)/2:black,"
-                    f"setsar=1,fps=30[v{i}]"
-                )
-                concat_inputs += f"[v{i}]"
-
-                # Handle audio - generate silence if missing
-                if all_have_audio:
-                    filter_parts.append(f"[{i}:a]aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo[a{i}]")
-                    concat_inputs += f"[a{i}]"
-                elif any_has_audio:
-                    if has_audio_list[i]:
-                        filter_parts.append(f"[{i}:a]aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo[a{i}]")
-                    else:
-                        # Generate silent audio for videos without audio
-                        # Get video duration to match the silence length
-                        video_duration = float(video_infos[i].get("format", {}).get("duration", 1.0))
-                        filter_parts.append(f"anullsrc=r=44100:cl=stereo:d={video_duration}[a{i}]")
-                    concat_inputs += f"[a{i}]"
-
-            # Add concat filter
-            if any_has_audio:
-                filter_parts.append(f"{concat_inputs}concat=n={n}:v=1:a=1[outv][outa]")
-                map_args = ["-map", "[outv]", "-map", "[outa]"]
-            else:
-                filter_parts.append(f"{concat_inputs}concat=n={n}:v=1:a=0[outv]")
-                map_args = ["-map", "[outv]"]
+            # Fast path: inputs that already share codec, size, frame rate and
+            # audio format (e.g. clips from the same generation pipeline) and are
+            # already at the output resolution are joined by remuxing alone - no
+            # decode or encode. Falls back to normalizing if the remux fails.
+            merged = False
+            signatures = {concat_copy_signature(info) for info in video_infos}
+            if not request.trim_silence and len(signatures) == 1:
+                video_signature = next(iter(signatures))[0]
+                if video_signature is not None and video_signature[2:4] == (output_width, output_height):
+                    concat_list_path = os.path.join(tmpdir, "concat_inputs.txt")
+                    write_concat_list(video_paths, concat_list_path)
+                    copy_cmd = [
+                        "ffmpeg", "-y",
+                        "-f", "concat", "-safe", "0",
+                        "-i", concat_list_path,
+                        "-c", "copy",
+                        "-movflags", "+faststart",
+                        output_path
+                    ]
+                    logger.info(f"Inputs are homogeneous, running stream-copy concat of {n} videos")
+                    result = await run_ffmpeg_async(copy_cmd)
+                    merged = result.returncode == 0
+                    if not merged:
+                        logger.warning(f"Stream-copy concat failed, re-encoding instead: {get_ffmpeg_error(result.stderr)}")
+
+            if not merged:
+                # Normalize every clip in parallel - each is its own ffmpeg process,
+                # bounded by ffmpeg_slot() inside run_ffmpeg_async
+                clip_paths = [os.path.join(tmpdir, f"clip_{i}.mkv") for i in range(n)]
+                clip_cmds = [
+                    build_normalize_clip_cmd(
+                        video_paths[i], clip_paths[i], output_width, output_height,
+                        has_audio=has_audio_list[i],
+                        include_audio=any_has_audio,
+                        duration=float(video_infos[i].get("format", {}).get("duration", 1.0)),
+                    )
+                    for i in range(n)
+                ]
 
-            filter_complex = ";".join(filter_parts)
+                logger.info(f"Normalizing {n} clips for merge")
+                clip_results = await asyncio.gather(*(run_ffmpeg_async(cmd) for cmd in clip_cmds))
+                for i, result in enumerate(clip_results):
+                    if result.returncode != 0:
+                        error_msg = get_ffmpeg_error(result.stderr)
+                        logger.error(f"ffmpeg normalize of video {i} failed: {result.stderr}")
+                        raise HTTPException(status_code=500, detail=f"Failed to merge videos: video {i+1}: {error_msg}")
 
-            # Build full command
-            merge_cmd = [
-                "ffmpeg", "-y",
-                *input_args,
-                "-filter_complex", filter_complex,
-                *map_args,
-                "-c:v", "libx264",
-                "-preset", "fast",
-                "-crf", "23",
-                "-c:a", "aac",
-                "-b:a", "128k",
-                "-movflags", "+faststart",
-                output_path
-            ]
+                # Join the normalized clips - video is copied, audio encoded once
+                concat_list_path = os.path.join(tmpdir, "concat.txt")
+                write_concat_list(clip_paths, concat_list_path)
 
-            logger.info(f"Running ffmpeg merge with concat filter, {n} inputs")
-            logger.debug(f"Filter complex: {filter_complex}")
-            result = await run_ffmpeg_async(merge_cmd)
+                merge_cmd = [
+                    "ffmpeg", "-y",
+                    "-f", "concat", "-safe", "0",
+                    "-i", concat_list_path,
+                    "-c:v", "copy",
+                    "-c:a", "aac",
+                    "-b:a", "128k",
+                    # Matroska timestamps are in ms; a 1/30s track timescale
+                    # (clips are fps=30) rounds them back to exact CFR frames
+                    "-video_track_timescale", "30",
+                    "-movflags", "+faststart",
+                    output_path
+                ]
 
-            if result.returncode != 0:
-                error_msg = get_ffmpeg_error(result.stderr)
-                logger.error(f"ffmpeg merge failed: {result.stderr}")
-                raise HTTPException(status_code=500, detail=f"Failed to merge videos: {error_msg}")
+                logger.info(f"Running ffmpeg concat of {n} normalized clips")
+                result = await run_ffmpeg_async(merge_cmd)
 
-            # Read output and return
-            with open(output_path, "rb") as f:
-                output_bytes = f.read()
+                if result.returncode != 0:
+                    error_msg = get_ffmpeg_error(result.stderr)
+                    logger.error(f"ffmpeg merge failed: {result.stderr}")
+                    raise HTTPException(status_code=500, detail=f"Failed to merge videos: {error_msg}")
 
-            output_base64 = base64.b64encode(output_bytes).decode("utf-8")
-            logger.info(f"Merge complete: {len(output_bytes)} bytes")
+            # Encode output and return
+            output = await encode_output(output_path, user['uid'], request.inline)
+            logger.info(f"Merge complete: {os.path.getsize(output_path)} bytes")
 
             return MergeVideosResponse(
-                video_base64=output_base64,
+                **output,
                 mime_type="video/mp4"
             )
 
@@ -657,16 +1139,27 @@ async def merge_videos(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def build_ffmpeg_filter_string(filters: List[Dict[str, Any]]) -> str:
+def build_ffmpeg_filter_string(filters: List[FilterConfig]) -> str:
     """
     Convert filter configurations to FFmpeg video filter string.
     Supports: hueSaturation, brightnessContrast, blur, sharpen, vignette, filmGrain, noise
+
+    Results are memoized per distinct filter list - the UI sends the same
+    presets over and over. Params that aren't hashable skip the cache.
     """
+    key = tuple((f.type, tuple(sorted(f.params.items()))) for f in filters)
+    try:
+        return _build_filter_string_cached(key)
+    except TypeError:
+        return _build_filter_string(key)
+
+
+def _build_filter_string(filters: Tuple[Tuple[str, Tuple[Tuple[str, Any], ...]], ...]) -> str:
+    """build_ffmpeg_filter_string() on (type, sorted param items) pairs."""
     filter_parts = []
 
-    for f in filters:
-        filter_type = f.get("type", "")
-        params = f.get("params", {})
+    for filter_type, param_items in filters:
+        params = dict(param_items)
 
         if filter_type == "hueSaturation":
             # FFmpeg eq filter for hue/saturation
@@ -720,10 +1213,14 @@ def build_ffmpeg_filter_string(filters: List[Dict[str, Any]]) -> str:
     return ",".join(filter_parts) if filter_parts else ""
 
 
+_build_filter_string_cached = lru_cache(maxsize=512)(_build_filter_string)
+
+
 @router.post("/apply-filters", response_model=ApplyFiltersResponse)
 async def apply_filters_to_video(
     request: ApplyFiltersRequest,
-    user: dict = Depends(get_current_user)
+    user: dict = Depends(get_current_user),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
     Apply visual filters to a video using FFmpeg.
@@ -739,23 +1236,19 @@ async def apply_filters_to_video(
         if not request.video_base64 and not request.video_url:
             raise HTTPException(status_code=400, detail="Either video_base64 or video_url must be provided")
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # Get video bytes
+        with scratch_tempdir(b64_size_hint(request.video_base64, urls=[request.video_url])) as tmpdir:
+            # Save input video
+            video_path = os.path.join(tmpdir, "input.mp4")
             if request.video_url:
                 logger.info(f"Downloading video from URL: {request.video_url[:80]}...")
                 try:
-                    video_bytes = await download_video_from_url(request.video_url)
+                    video_size = await download_to_file(http_client, request.video_url, video_path)
                 except httpx.HTTPError as e:
                     logger.error(f"Failed to download video: {e}")
                     raise HTTPException(status_code=400, detail=f"Failed to download video: {str(e)}")
             else:
-                video_bytes = clean_base64(request.video_base64)
-
-            # Save input video
-            video_path = os.path.join(tmpdir, "input.mp4")
-            with open(video_path, "wb") as f:
-                f.write(video_bytes)
-            logger.info(f"Saved video: {len(video_bytes)} bytes")
+                video_size = await run_cpu_bound(decode_b64_to_file, request.video_base64, video_path)
+            logger.info(f"Saved video: {video_size} bytes")
 
             # Build filter string
             filter_string = build_ffmpeg_filter_string(request.filters)
@@ -763,7 +1256,7 @@ async def apply_filters_to_video(
             if not filter_string:
                 logger.info("No applicable filters, returning original video")
                 return ApplyFiltersResponse(
-                    video_base64=base64.b64encode(video_bytes).decode("utf-8"),
+                    **await encode_output(video_path, user['uid'], request.inline),
                     mime_type="video/mp4"
                 )
 
@@ -776,9 +1269,7 @@ async def apply_filters_to_video(
                 "ffmpeg", "-y",
                 "-i", video_path,
                 "-vf", filter_string,
-                "-c:v", "libx264",
-                "-preset", "fast",
-                "-crf", "23",
+                *h264_encoder_args(),
                 "-c:a", "copy",  # Preserve audio
                 "-movflags", "+faststart",
                 output_path
@@ -791,15 +1282,12 @@ async def apply_filters_to_video(
                 logger.error(f"FFmpeg filter failed: {result.stderr}")
                 raise HTTPException(status_code=500, detail=f"Failed to apply filters: {error_msg}")
 
-            # Read output
-            with open(output_path, "rb") as f:
-                output_bytes = f.read()
-
-            output_base64 = base64.b64encode(output_bytes).decode("utf-8")
-            logger.info(f"Filter application complete: {len(output_bytes)} bytes")
+            # Encode output
+            output = await encode_output(output_path, user['uid'], request.inline)
+            logger.info(f"Filter application complete: {os.path.getsize(output_path)} bytes")
 
             return ApplyFiltersResponse(
-                video_base64=output_base64,
+                **output,
                 mime_type="video/mp4"
             )
 
@@ -813,7 +1301,8 @@ async def apply_filters_to_video(
 @router.post("/add-music", response_model=AddMusicResponse)
 async def add_music_to_video(
     request: AddMusicRequest,
-    user: dict = Depends(get_current_user)
+    user: dict = Depends(get_current_user),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
     Add/mix music into a video using ffmpeg.
@@ -828,46 +1317,46 @@ async def add_music_to_video(
         if not request.audio_base64 and not request.audio_url:
             raise HTTPException(status_code=400, detail="Either audio_base64 or audio_url must be provided")
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # Get video bytes from base64 or URL
+        with scratch_tempdir(b64_size_hint(request.video_base64, request.audio_base64, urls=[request.video_url, request.audio_url])) as tmpdir:
+            # Save video and audio (from base64 or URL) straight to disk,
+            # both at once
+            video_path = os.path.join(tmpdir, "input.mp4")
+            raw_audio_path = os.path.join(tmpdir, "music.download")
             if request.video_url:
                 logger.info(f"Downloading video from URL: {request.video_url[:80]}...")
-                video_bytes = await download_video_from_url(request.video_url)
+                save_video = download_to_file(http_client, request.video_url, video_path)
             else:
-                video_bytes = clean_base64(request.video_base64)
-            video_path = os.path.join(tmpdir, "input.mp4")
-            with open(video_path, "wb") as f:
-                f.write(video_bytes)
-            logger.info(f"Saved video: {len(video_bytes)} bytes")
-
-            # Get audio bytes from base64 or URL
+                save_video = run_cpu_bound(decode_b64_to_file, request.video_base64, video_path)
             if request.audio_url:
                 logger.info(f"Downloading audio from URL: {request.audio_url[:80]}...")
-                async with httpx.AsyncClient(timeout=60.0, follow_redirects=True) as client:
-                    response = await client.get(request.audio_url)
-                    response.raise_for_status()
-                    audio_bytes = response.content
+                save_audio = download_to_file(http_client, request.audio_url, raw_audio_path, timeout=60.0)
             else:
-                audio_bytes = clean_base64(request.audio_base64)
+                save_audio = run_cpu_bound(decode_b64_to_file, request.audio_base64, raw_audio_path)
+            video_size, audio_size = await asyncio.gather(save_video, save_audio)
+            logger.info(f"Saved video: {video_size} bytes")
+
+            with open(raw_audio_path, "rb") as f:
+                audio_bytes = f.read(8)
 
-            # Detect audio format from magic bytes (supports mp3, wav, flac, ogg, m4a/aac)
+            # Detect audio format from magic bytes (supports mp3, wav, flac, ogg, m4a/aac),
+            # comparing the 8-byte header as one integer instead of slicing it per check
             audio_ext = "mp3"
             if len(audio_bytes) >= 4:
-                if audio_bytes[:4] == b'RIFF':
+                header = int.from_bytes(audio_bytes.ljust(8, b"\0"), "big")
+                if header >> 32 == 0x52494646:  # "RIFF"
                     audio_ext = "wav"
-                elif audio_bytes[:3] == b'ID3' or audio_bytes[:2] == b'\xff\xfb' or audio_bytes[:2] == b'\xff\xfa':
+                elif header >> 40 == 0x494433 or header >> 48 in (0xFFFB, 0xFFFA):  # "ID3" / MPEG sync
                     audio_ext = "mp3"
-                elif audio_bytes[:4] == b'fLaC':
+                elif header >> 32 == 0x664C6143:  # "fLaC"
                     audio_ext = "flac"
-                elif audio_bytes[:4] == b'OggS':
+                elif header >> 32 == 0x4F676753:  # "OggS"
                     audio_ext = "ogg"
-                elif audio_bytes[4:8] == b'ftyp':
+                elif header & 0xFFFFFFFF == 0x66747970:  # "ftyp" at offset 4
                     audio_ext = "m4a"
 
             audio_path = os.path.join(tmpdir, f"music.{audio_ext}")
-            with open(audio_path, "wb") as f:
-                f.write(audio_bytes)
-            logger.info(f"Saved audio: {len(audio_bytes)} bytes, format: {audio_ext}")
+            os.rename(raw_audio_path, audio_path)
+            logger.info(f"Saved audio: {audio_size} bytes, format: {audio_ext}")
 
             # Calculate volume multipliers (0-1 scale)
             music_vol = request.music_volume / 100.0
@@ -876,7 +1365,7 @@ async def add_music_to_video(
             output_path = os.path.join(tmpdir, "output.mp4")
 
             # Probe video for audio stream info
-            video_info = probe_video(video_path)
+            video_info = await probe_video(video_path)
             has_audio = False
             for stream in video_info.get("streams", []):
                 if stream.get("codec_type") == "audio":
@@ -893,130 +1382,52 @@ async def add_music_to_video(
             if not duration:
                 duration = video_info.get("format", {}).get("duration")
 
-            # Strategy: Use simpler, more robust approach
-            # 1. If video has audio and we want to mix: use amerge (simpler than amix)
-            # 2. If video has no audio or orig_vol is 0: just add music track
-
+            # One ffmpeg run, no speculative retries:
+            # 1. Video has audio and we want to mix: both tracks are brought to the
+            #    same stereo format first, so amix works for any channel layout or
+            #    sample rate (amerge + pan needed two stereo inputs), then summed
+            #    without amix's 1/n scaling - the volumes stay as requested
+            # 2. Video has no audio or orig_vol is 0: just add the music track
             if has_audio and orig_vol > 0:
-                # Mix original audio with music using amerge + pan for volume control
-                # amerge is more reliable than amix for two-stream mixing
+                stereo_format = "aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo"
                 filter_complex = (
-                    f"[0:a]volume={orig_vol}[orig];"
-                    f"[1:a]volume={music_vol}[music];"
-                    f"[orig][music]amerge=inputs=2,pan=stereo|c0<c0+c2|c1<c1+c3[aout]"
+                    f"[0:a]{stereo_format},volume={orig_vol}[orig];"
+                    f"[1:a]{stereo_format},volume={music_vol}[music];"
+                    f"[orig][music]amix=inputs=2:duration=first:normalize=0[aout]"
                 )
-
-                mix_cmd = [
-                    "ffmpeg", "-y",
-                    "-i", video_path,
-                    "-i", audio_path,
-                    "-filter_complex", filter_complex,
-                    "-map", "0:v",
-                    "-map", "[aout]",
-                    "-c:v", "copy",  # Preserve original video codec
-                    "-c:a", "aac",
-                    "-b:a", "192k",
-                    "-shortest",
-                    output_path
-                ]
-
-                logger.info(f"Running ffmpeg mix with amerge")
-                result = await run_ffmpeg_async(mix_cmd)
-
-                if result.returncode != 0:
-                    logger.warning(f"amerge failed, trying amix fallback: {get_ffmpeg_error(result.stderr)}")
-                    # Fallback to amix
-                    filter_complex = (
-                        f"[0:a]volume={orig_vol}[orig];"
-                        f"[1:a]volume={music_vol}[music];"
-                        f"[orig][music]amix=inputs=2:duration=first:dropout_transition=2[aout]"
-                    )
-                    mix_cmd = [
-                        "ffmpeg", "-y",
-                        "-i", video_path,
-                        "-i", audio_path,
-                        "-filter_complex", filter_complex,
-                        "-map", "0:v",
-                        "-map", "[aout]",
-                        "-c:v", "copy",
-                        "-c:a", "aac",
-                        "-b:a", "192k",
-                        "-shortest",
-                        output_path
-                    ]
-                    result = await run_ffmpeg_async(mix_cmd)
+                audio_map = ["-filter_complex", filter_complex, "-map", "0:v", "-map", "[aout]"]
+                logger.info("Running ffmpeg mix with amix")
+            elif music_vol != 1.0:
+                audio_map = ["-filter_complex", f"[1:a]volume={music_vol}[aout]", "-map", "0:v", "-map", "[aout]"]
+                logger.info("Adding music track only (no mixing)")
             else:
-                # No original audio or volume is 0 - just add music track directly
-                logger.info(f"Adding music track only (no mixing)")
-                mix_cmd = [
-                    "ffmpeg", "-y",
-                    "-i", video_path,
-                    "-i", audio_path,
-                    "-map", "0:v",
-                    "-map", "1:a",
-                    "-c:v", "copy",  # Preserve original video codec
-                    "-c:a", "aac",
-                    "-b:a", "192k",
-                    "-shortest",
-                    output_path
-                ]
-
-                # Apply volume if not 100%
-                if music_vol != 1.0:
-                    mix_cmd = [
-                        "ffmpeg", "-y",
-                        "-i", video_path,
-                        "-i", audio_path,
-                        "-filter_complex", f"[1:a]volume={music_vol}[aout]",
-                        "-map", "0:v",
-                        "-map", "[aout]",
-                        "-c:v", "copy",
-                        "-c:a", "aac",
-                        "-b:a", "192k",
-                        "-shortest",
-                        output_path
-                    ]
+                audio_map = ["-map", "0:v", "-map", "1:a"]
+                logger.info("Adding music track only (no mixing)")
 
-                result = await run_ffmpeg_async(mix_cmd)
+            mix_cmd = [
+                "ffmpeg", "-y",
+                "-i", video_path,
+                "-i", audio_path,
+                *audio_map,
+                "-c:v", "copy",  # Preserve original video codec
+                "-c:a", "aac",
+                "-b:a", "192k",
+                "-shortest",
+                output_path
+            ]
+            result = await run_ffmpeg_async(mix_cmd)
 
             if result.returncode != 0:
                 error_msg = get_ffmpeg_error(result.stderr)
                 logger.error(f"ffmpeg add music failed: {result.stderr}")
+                raise HTTPException(status_code=500, detail=f"Failed to add music: {error_msg}")
 
-                # Final fallback: simplest possible command
-                logger.info("Trying simplest fallback command")
-                simple_cmd = [
-                    "ffmpeg", "-y",
-                    "-i", video_path,
-                    "-i", audio_path,
-                    "-map", "0:v",
-                    "-map", "1:a",
-                    "-c:v", "copy",
-                    "-c:a", "copy",  # Try to copy audio codec too
-                    "-shortest",
-                    output_path
-                ]
-                result = await run_ffmpeg_async(simple_cmd)
-
-                if result.returncode != 0:
-                    # Last resort: re-encode audio
-                    simple_cmd[-4] = "aac"  # Change -c:a copy to -c:a aac
-                    result = await run_ffmpeg_async(simple_cmd)
-
-                    if result.returncode != 0:
-                        error_msg = get_ffmpeg_error(result.stderr)
-                        logger.error(f"All ffmpeg attempts failed: {result.stderr}")
-                        raise HTTPException(status_code=500, detail=f"Failed to add music: {error_msg}")
-
-            # Read output and return
-            with open(output_path, "rb") as f:
-                output_bytes = f.read()
-
-            output_base64 = base64.b64encode(output_bytes).decode("utf-8")
-            logger.info(f"Add music complete: {len(output_bytes)} bytes")
+            # Encode output and return
+            output = await encode_output(output_path, user['uid'], request.inline)
+            logger.info(f"Add music complete: {os.path.getsize(output_path)} bytes")
 
             return AddMusicResponse(
-                video_base64=output_base64,
+                **output,
                 mime_type="video/mp4"
             )
 
@@ -1037,17 +1448,20 @@ class AddWatermarkRequest(BaseModel):
     scale: float = Field(default=0.15, description="Scale relative to video width (0.0 to 1.0)")
     margin: int = Field(default=20, description="Margin from edges in pixels")
     mode: str = Field(default="watermark", description="Mode: watermark (scaled corner logo) or overlay (full-frame)")
+    inline: Optional[bool] = Field(default=None, description="true = always return video_base64, false = always return a signed video_url, unset = by output size")
 
 
 class AddWatermarkResponse(BaseModel):
-    video_base64: str
+    video_base64: Optional[str] = None
+    video_url: Optional[str] = Field(default=None, description="Signed GCS URL, set instead of video_base64 for large outputs")
     mime_type: str = "video/mp4"
 
 
 @router.post("/add-watermark", response_model=AddWatermarkResponse)
 async def add_watermark_to_video(
     request: AddWatermarkRequest,
-    user: dict = Depends(get_current_user)
+    user: dict = Depends(get_current_user),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
     Add a watermark/logo overlay to a video using FFmpeg.
@@ -1058,85 +1472,107 @@ async def add_watermark_to_video(
 
         if not request.video_base64 and not request.video_url:
             raise HTTPException(status_code=400, detail="Either video_base64 or video_url must be provided")
+        if not request.watermark_base64 and not request.watermark_url:
+            raise HTTPException(status_code=400, detail="Either watermark_base64 or watermark_url must be provided")
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # Get video bytes
-            if request.video_url:
-                logger.info(f"Downloading video from URL: {request.video_url[:80]}...")
-                try:
-                    video_bytes = await download_video_from_url(request.video_url)
-                except httpx.HTTPError as e:
-                    logger.error(f"Failed to download video: {e}")
-                    raise HTTPException(status_code=400, detail=f"Failed to download video: {str(e)}")
-            else:
-                video_bytes = clean_base64(request.video_base64)
-
-            # Save input video
+        with scratch_tempdir(b64_size_hint(request.video_base64, request.watermark_base64, urls=[request.video_url, request.watermark_url])) as tmpdir:
             video_path = os.path.join(tmpdir, "input.mp4")
-            with open(video_path, "wb") as f:
-                f.write(video_bytes)
-            logger.info(f"Saved video: {len(video_bytes)} bytes")
-
-            # Validate and get watermark bytes
-            if not request.watermark_base64 and not request.watermark_url:
-                raise HTTPException(status_code=400, detail="Either watermark_base64 or watermark_url must be provided")
-
-            # Get watermark bytes from URL or base64
-            if request.watermark_url:
-                logger.info(f"Downloading watermark from URL: {request.watermark_url[:80]}...")
-                async with httpx.AsyncClient(timeout=60.0, follow_redirects=True) as client:
-                    response = await client.get(request.watermark_url)
-                    if response.status_code != 200:
-                        raise HTTPException(status_code=400, detail=f"Failed to download watermark: {response.status_code}")
-                    watermark_bytes = response.content
-            else:
-                watermark_bytes = clean_base64(request.watermark_base64)
-
-            # Detect image format
-            image_format = detect_image_format(watermark_bytes)
-            logger.info(f"Detected watermark format: {image_format}")
-
-            # Convert SVG to PNG if needed
+            raw_watermark_path = os.path.join(tmpdir, "watermark.download")
             watermark_path = os.path.join(tmpdir, "watermark.png")
-            if image_format == 'svg':
-                logger.info("Converting SVG to PNG...")
-                success = convert_svg_to_png(watermark_bytes, watermark_path)
-                if not success:
-                    raise HTTPException(status_code=400, detail="Failed to convert SVG watermark to PNG")
-            else:
-                # Save as-is for other formats
-                with open(watermark_path, "wb") as f:
-                    f.write(watermark_bytes)
-            
-            logger.info(f"Saved watermark: {len(watermark_bytes)} bytes")
 
-            # Probe watermark image for format info
-            watermark_probe_cmd = ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_streams", watermark_path]
-            watermark_probe_result = subprocess.run(watermark_probe_cmd, capture_output=True, text=True)
-            if watermark_probe_result.returncode == 0:
-                try:
-                    watermark_info = json.loads(watermark_probe_result.stdout)
-                    for stream in watermark_info.get("streams", []):
-                        if stream.get("codec_type") == "video":
-                            logger.info(f"Watermark info: {stream.get('width')}x{stream.get('height')}, "
-                                       f"codec={stream.get('codec_name')}, pix_fmt={stream.get('pix_fmt')}")
-                except json.JSONDecodeError:
-                    logger.warning("Could not parse watermark probe output")
-            else:
-                logger.warning(f"Watermark probe failed: {watermark_probe_result.stderr}")
+            async def save_video() -> Dict[str, Any]:
+                """Save the input video and probe it."""
+                if request.video_url:
+                    logger.info(f"Downloading video from URL: {request.video_url[:80]}...")
+                    try:
+                        video_size = await download_to_file(http_client, request.video_url, video_path)
+                    except httpx.HTTPError as e:
+                        logger.error(f"Failed to download video: {e}")
+                        raise HTTPException(status_code=400, detail=f"Failed to download video: {str(e)}")
+                else:
+                    video_size = await run_cpu_bound(decode_b64_to_file, request.video_base64, video_path)
+                logger.info(f"Saved video: {video_size} bytes")
+                return await probe_video(video_path)
+
+            async def save_watermark() -> Optional[Tuple[int, int]]:
+                """Save the watermark as watermark_path (SVG converted to PNG); returns its size if probed."""
+                if request.watermark_url:
+                    logger.info(f"Downloading watermark from URL: {request.watermark_url[:80]}...")
+                    try:
+                        watermark_size = await download_to_file(http_client, request.watermark_url, raw_watermark_path, timeout=60.0)
+                    except httpx.HTTPStatusError as e:
+                        raise HTTPException(status_code=400, detail=f"Failed to download watermark: {e.response.status_code}")
+                else:
+                    watermark_size = await run_cpu_bound(decode_b64_to_file, request.watermark_base64, raw_watermark_path)
+
+                # Detect image format (SVG check looks at the first 200 bytes)
+                with open(raw_watermark_path, "rb") as f:
+                    watermark_head = f.read(200)
+                image_format = detect_image_format(watermark_head)
+                logger.info(f"Detected watermark format: {image_format}")
+
+                # Convert SVG to PNG if needed
+                if image_format == 'svg':
+                    logger.info("Converting SVG to PNG...")
+                    with open(raw_watermark_path, "rb") as f:
+                        svg_bytes = f.read()
+                    success = await run_cpu_bound(convert_svg_to_png, svg_bytes, watermark_path)
+                    if not success:
+                        raise HTTPException(status_code=400, detail="Failed to convert SVG watermark to PNG")
+                else:
+                    # Use as-is for other formats
+                    os.rename(raw_watermark_path, watermark_path)
+
+                logger.info(f"Saved watermark: {watermark_size} bytes")
 
-            # Probe video for dimensions
-            video_info = probe_video(video_path)
+                # Probe watermark image for format info
+                watermark_info = await probe_video(watermark_path)
+                for stream in watermark_info.get("streams", []):
+                    if stream.get("codec_type") == "video":
+                        logger.info(f"Watermark info: {stream.get('width')}x{stream.get('height')}, "
+                                   f"codec={stream.get('codec_name')}, pix_fmt={stream.get('pix_fmt')}")
+                        if stream.get("width") and stream.get("height"):
+                            return stream["width"], stream["height"]
+                        return None
+                logger.warning("Watermark probe failed")
+                return None
+
+            # Video and watermark are independent until the filter build - fetch
+            # and probe both at once. TaskGroup cancels the other if one fails.
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    video_task = tg.create_task(save_video())
+                    watermark_task = tg.create_task(save_watermark())
+            except ExceptionGroup as eg:
+                # Prefer an HTTPException (bad URL, bad SVG) so the client gets its status
+                error = next((e for e in eg.exceptions if isinstance(e, HTTPException)), eg.exceptions[0])
+                raise error from None
+
+            # Video and watermark dimensions
+            video_info = video_task.result()
+            watermark_size = watermark_task.result()
             video_width = 1280
             video_height = 720
+            # Whether video_width x video_height is the frame filters actually
+            # see: probed (not the fallback) and not transposed by autorotation
+            frame_size_known = False
             for stream in video_info.get("streams", []):
                 if stream.get("codec_type") == "video":
                     video_width = stream.get("width", 1280)
                     video_height = stream.get("height", 720)
+                    rotated = stream_rotation(stream) % 180 != 0
+                    if rotated:
+                        # Autorotated frame is transposed - size the mark for it
+                        video_width, video_height = video_height, video_width
+                    frame_size_known = bool(stream.get("width") and stream.get("height")) and not rotated
                     break
 
             logger.info(f"Video dimensions: {video_width}x{video_height}, mode={request.mode}")
 
+            # GPU pipeline (NVDEC decode, overlay_cuda, NVENC encode) for
+            # watermark mode on NVENC hosts; None means CPU overlay only
+            cuda_cmd = None
+
             if request.mode == "overlay":
                 # Full-frame overlay mode - scale image to fit video, overlay at 0:0
                 # This is for transparent PNGs that should cover the entire frame
@@ -1144,7 +1580,7 @@ async def add_watermark_to_video(
                     f"[1:v]scale={video_width}:{video_height}:force_original_aspect_ratio=decrease,"
                     f"pad={video_width}:{video_height}:(ow-iw)/2:(oh-ih)/2:color=black@0.0,"
                     f"format=rgba,colorchannelmixer=aa={request.opacity}[overlay];"
-                    f"[0:v][overlay]overlay=0:0:format=auto,format=yuv420p[vout]"
+                    f"[0:v][overlay]overlay=0:0,format=yuv420p[vout]"
                 )
             else:
                 # Watermark mode - small logo in corner
@@ -1156,25 +1592,61 @@ async def add_watermark_to_video(
                 if watermark_width < 10:
                     watermark_width = 10
 
-                # Position mapping
                 margin = request.margin
-                position_map = {
-                    "top-left": f"{margin}:{margin}",
-                    "top-right": f"W-w-{margin}:{margin}",
-                    "bottom-left": f"{margin}:H-h-{margin}",
-                    "bottom-right": f"W-w-{margin}:H-h-{margin}",
-                    "center": "(W-w)/2:(H-h)/2",
-                }
-                overlay_position = position_map.get(request.position, position_map["bottom-right"])
+                if watermark_size and frame_size_known:
+                    # Watermark and frame dimensions known: scale to an explicit
+                    # size and pass the overlay literal pixel offsets
+                    mark_width, mark_height = watermark_size
+                    watermark_height = max(2, round(mark_height * watermark_width / mark_width / 2) * 2)
+                    x, y = watermark_xy(request.position, margin, video_width, video_height, watermark_width, watermark_height)
+                    watermark_scale = f"{watermark_width}:{watermark_height}"
+                    overlay_position = f"{x}:{y}"
+                else:
+                    # Watermark or frame size unknown (probe failed, rotated
+                    # video) - let ffmpeg place it against the real frame.
+                    # eval=init evaluates the expressions once, not per frame
+                    position_map = {
+                        "top-left": f"{margin}:{margin}",
+                        "top-right": f"W-w-{margin}:{margin}",
+                        "bottom-left": f"{margin}:H-h-{margin}",
+                        "bottom-right": f"W-w-{margin}:H-h-{margin}",
+                        "center": "(W-w)/2:(H-h)/2",
+                    }
+                    watermark_scale = f"{watermark_width}:-2"
+                    overlay_position = position_map.get(request.position, position_map["bottom-right"]) + ":eval=init"
 
                 # Build filter for watermark
-                # Scale watermark, apply opacity, overlay, then convert to yuv420p for h264
+                # Scale watermark, apply opacity, overlay (blends in yuv420), then
+                # pin yuv420p for h264
                 filter_complex = (
-                    f"[1:v]scale={watermark_width}:-2,format=rgba,"
+                    f"[1:v]scale={watermark_scale},format=rgba,"
                     f"colorchannelmixer=aa={request.opacity}[watermark];"
-                    f"[0:v][watermark]overlay={overlay_position}:format=auto,format=yuv420p[vout]"
+                    f"[0:v][watermark]overlay={overlay_position},format=yuv420p[vout]"
                 )
 
+                if detect_h264_encoder() == "h264_nvenc" and watermark_size and frame_size_known:
+                    # Frames stay in GPU memory from decode to encode; only the
+                    # (already scaled) watermark is uploaded, once. overlay_cuda
+                    # needs literal x/y, so this is only safe when the frame
+                    # size is real - otherwise the CPU overlay places the mark
+                    cuda_filter = (
+                        f"[1:v]scale={watermark_width}:{watermark_height},format=rgba,"
+                        f"colorchannelmixer=aa={request.opacity},format=yuva420p,hwupload_cuda[watermark];"
+                        f"[0:v][watermark]overlay_cuda=x={x}:y={y}[vout]"
+                    )
+                    cuda_cmd = [
+                        "ffmpeg", "-y",
+                        "-hwaccel", "cuda", "-hwaccel_output_format", "cuda",
+                        "-i", video_path,
+                        "-i", watermark_path,
+                        "-filter_complex", cuda_filter,
+                        "-map", "[vout]",
+                        "-map", "0:a?",
+                        *h264_encoder_args("ultrafast"),
+                        "-c:a", "copy",
+                        "-movflags", "+faststart",
+                    ]
+
             output_path = os.path.join(tmpdir, "output.mp4")
 
             # Build FFmpeg command
@@ -1186,17 +1658,25 @@ async def add_watermark_to_video(
                 "-filter_complex", filter_complex,
                 "-map", "[vout]",  # Use filtered video output
                 "-map", "0:a?",  # Copy audio if present
-                "-c:v", "libx264",
-                "-preset", "ultrafast",  # Faster encoding
-                "-crf", "23",
+                *h264_encoder_args("ultrafast"),  # Faster encoding
                 "-c:a", "copy",
                 "-movflags", "+faststart",
                 output_path
             ]
 
-            logger.info(f"Running ffmpeg watermark overlay: {' '.join(overlay_cmd)}")
+            result = None
             try:
-                result = await run_ffmpeg_async(overlay_cmd, timeout=120)
+                if cuda_cmd:
+                    cuda_cmd.append(output_path)
+                    logger.info(f"Running ffmpeg watermark overlay on the GPU: {' '.join(cuda_cmd)}")
+                    result = await run_ffmpeg_async(cuda_cmd, timeout=120)
+                    if result.returncode != 0:
+                        # e.g. the video codec has no NVDEC decoder - do it on the CPU
+                        logger.warning(f"GPU watermark overlay failed, using CPU overlay: {get_ffmpeg_error(result.stderr)}")
+                        result = None
+                if result is None:
+                    logger.info(f"Running ffmpeg watermark overlay: {' '.join(overlay_cmd)}")
+                    result = await run_ffmpeg_async(overlay_cmd, timeout=120)
             except subprocess.TimeoutExpired:
                 logger.error("FFmpeg watermark timed out after 120 seconds")
                 raise HTTPException(status_code=500, detail="Video processing timed out")
@@ -1207,15 +1687,12 @@ async def add_watermark_to_video(
                 logger.error(f"FFmpeg stderr: {result.stderr[-1000:] if len(result.stderr) > 1000 else result.stderr}")
                 raise HTTPException(status_code=500, detail=f"Failed to add watermark: {error_msg}")
 
-            # Read output
-            with open(output_path, "rb") as f:
-                output_bytes = f.read()
-
-            output_base64 = base64.b64encode(output_bytes).decode("utf-8")
-            logger.info(f"Add watermark complete: {len(output_bytes)} bytes")
+            # Encode output
+            output = await encode_output(output_path, user['uid'], request.inline)
+            logger.info(f"Add watermark complete: {os.path.getsize(output_path)} bytes")
 
             return AddWatermarkResponse(
-                video_base64=output_base64,
+                **output,
                 mime_type="video/mp4"
             )
 
@@ -1226,6 +1703,244 @@ async def add_watermark_to_video(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def probe_keyframe_times(video_path: str) -> List[float]:
+    """Presentation times of the first video stream's keyframes (packet scan, no decoding)."""
+    probe_cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        video_path
+    ]
+    async with ffmpeg_slot():
+        proc = await asyncio.create_subprocess_exec(
+            *probe_cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await proc.communicate()
+    if proc.returncode != 0:
+        return []
+
+    keyframes = []
+    for line in stdout.decode(errors="replace").splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags:
+            try:
+                keyframes.append(float(pts_time))
+            except ValueError:
+                continue  # pts_time=N/A
+    keyframes.sort()
+    return keyframes
+
+
+async def is_idr_keyframe(video_path: str, t: float, fps: float) -> bool:
+    """
+    True if the keyframe at t (a probe_keyframe_times() entry) is an H.264 IDR picture.
+
+    Containers flag open-GOP recovery-point I-frames as keyframes too, but
+    frames after those can still reference the GOP before them, so only an
+    IDR is a clean cut point. Copies out just that one packet as Annex B and
+    looks for an IDR slice NAL unit (type 5).
+    """
+    cmd = [
+        "ffmpeg", "-v", "error",
+        # A quarter frame past t so the demuxer seeks to this keyframe, not the one before
+        "-ss", str(t + 0.25 / fps), "-i", video_path,
+        "-map", "0:v:0", "-c", "copy", "-frames:v", "1",
+        "-f", "h264", "pipe:1"
+    ]
+    async with ffmpeg_slot():
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await proc.communicate()
+    if proc.returncode != 0:
+        return False
+    return any(nal and nal[0] & 0x1F == 5 for nal in stdout.split(b"\x00\x00\x01"))
+
+
+async def probe_extradata_hash(video_path: str) -> Optional[str]:
+    """SHA-256 of the first video stream's codec extradata (SPS/PPS for H.264), None if unavailable."""
+    probe_cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_data_hash", "SHA256",
+        "-show_entries", "stream=extradata_hash",
+        "-of", "csv=p=0",
+        video_path
+    ]
+    async with ffmpeg_slot():
+        proc = await asyncio.create_subprocess_exec(
+            *probe_cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await proc.communicate()
+    extradata_hash = stdout.decode(errors="replace").strip()
+    if proc.returncode != 0 or not extradata_hash:
+        return None
+    return extradata_hash
+
+
+# ffprobe H.264 profile names -> libx264 -profile:v (4:2:0 8-bit profiles only)
+X264_PROFILES = {
+    "constrained baseline": "baseline",
+    "baseline": "baseline",
+    "main": "main",
+    "high": "high",
+}
+
+
+def nearest_keyframe(keyframes: List[float], t: float, tolerance: float) -> Optional[float]:
+    """The keyframe time within tolerance of t, or None if t isn't a keyframe boundary."""
+    i = bisect.bisect_left(keyframes, t)
+    candidates = keyframes[max(i - 1, 0):i + 1]
+    best = min(candidates, key=lambda k: abs(k - t), default=None)
+    if best is None or abs(best - t) > tolerance:
+        return None
+    return best
+
+
+def parse_frame_rate(rate: Optional[str]) -> float:
+    """ffprobe r_frame_rate ("30000/1001") as a float, 0.0 if missing or invalid."""
+    num, _, den = (rate or "").partition("/")
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+async def replace_segment_stream_copy(
+    base_path: str,
+    replacement_path: str,
+    base_info: Dict[str, Any],
+    start_time: float,
+    end_time: float,
+    base_duration: float,
+    replacement_fit_filter: str,
+    tmpdir: str,
+    output_path: str,
+) -> bool:
+    """
+    Segment replace that only re-encodes the replacement, for keep_base audio.
+
+    When the cut points fall on IDR frames of an H.264/yuv420p base, the
+    before/after parts are stream-copied out of the base, the replacement is
+    encoded with libx264 to match the base's size, frame rate, profile and
+    level, and the three are joined with the concat demuxer. The MP4 output
+    carries a single avcC, so the join only goes ahead when all the parts
+    ended up with identical SPS/PPS. The base audio is laid under the result
+    uncut, as in the filter-graph path.
+
+    Returns:
+        True if output_path was written, False if the base isn't eligible or a
+        step failed (the caller then re-encodes everything)
+    """
+    video_stream = next((s for s in base_info.get("streams", []) if s.get("codec_type") == "video"), None)
+    if not video_stream or video_stream.get("codec_name") != "h264" or video_stream.get("pix_fmt") != "yuv420p":
+        return False
+    frame_rate = video_stream.get("r_frame_rate")
+    fps = parse_frame_rate(frame_rate)
+    if fps <= 0:
+        return False
+    x264_profile = X264_PROFILES.get((video_stream.get("profile") or "").lower())
+    level = video_stream.get("level")
+    if x264_profile is None or not isinstance(level, int) or level <= 0:
+        return False
+
+    keyframes = await probe_keyframe_times(base_path)
+    half_frame = 0.5 / fps
+    cut_start = 0.0 if start_time <= 0 else nearest_keyframe(keyframes, start_time, half_frame)
+    cut_end = base_duration if end_time >= base_duration else nearest_keyframe(keyframes, end_time, half_frame)
+    if cut_start is None or cut_end is None:
+        logger.info("Segment cut points are not on base keyframes, re-encoding the whole video")
+        return False
+    inner_cuts = [t for t in (cut_start, cut_end) if 0 < t < base_duration]
+    if not all(await asyncio.gather(*(is_idr_keyframe(base_path, t, fps) for t in inner_cuts))):
+        logger.info("Segment cut points are not IDR frames (open GOP), re-encoding the whole video")
+        return False
+
+    width, height = video_stream.get("width"), video_stream.get("height")
+    match_base_filter = (
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,fps={frame_rate},format=yuv420p"
+    )
+
+    parts = []
+    part_cmds = []
+    if cut_start > 0:
+        before_path = os.path.join(tmpdir, "part_before.ts")
+        part_cmds.append([
+            "ffmpeg", "-y", "-i", base_path,
+            "-map", "0:v:0", "-t", str(cut_start),
+            "-c", "copy", "-f", "mpegts", before_path
+        ])
+        parts.append(before_path)
+
+    replace_path = os.path.join(tmpdir, "part_replace.ts")
+    part_cmds.append([
+        "ffmpeg", "-y", "-i", replacement_path,
+        "-map", "0:v:0",
+        "-vf", f"{replacement_fit_filter},{match_base_filter}",
+        "-t", str(cut_end - cut_start),
+        # Always libx264 (not a hardware encoder) so the profile/level match
+        # the base and the SPS/PPS have a chance to be identical
+        "-c:v", "libx264", "-preset", "fast", "-crf", "23",
+        "-profile:v", x264_profile, "-level:v", str(level / 10),
+        "-pix_fmt", video_stream["pix_fmt"],
+        "-f", "mpegts", replace_path
+    ])
+    parts.append(replace_path)
+
+    if cut_end < base_duration:
+        after_path = os.path.join(tmpdir, "part_after.ts")
+        # Seek a quarter frame past the keyframe so the demuxer lands on it, not the one before
+        part_cmds.append([
+            "ffmpeg", "-y", "-ss", str(cut_end + 0.25 / fps), "-i", base_path,
+            "-map", "0:v:0", "-c", "copy", "-f", "mpegts", after_path
+        ])
+        parts.append(after_path)
+
+    logger.info(f"Segment replace via stream copy: cut {cut_start}s-{cut_end}s, re-encoding only the replacement")
+    results = await asyncio.gather(*(run_ffmpeg_async(cmd) for cmd in part_cmds))
+    for result in results:
+        if result.returncode != 0:
+            logger.warning(f"Stream-copy segment part failed, re-encoding instead: {get_ffmpeg_error(result.stderr)}")
+            return False
+
+    # Parameter sets changing mid-stream aren't valid in avc1 MP4 (Safari and
+    # hardware decoders glitch on them) - only splice when they all match
+    extradata_hashes = await asyncio.gather(*(probe_extradata_hash(part) for part in parts))
+    if None in extradata_hashes or len(set(extradata_hashes)) != 1:
+        logger.info("Replacement SPS/PPS differ from the base's, re-encoding the whole video")
+        return False
+
+    list_path = os.path.join(tmpdir, "parts.txt")
+    write_concat_list(parts, list_path)
+    concat_cmd = [
+        "ffmpeg", "-y",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-i", base_path,
+        "-map", "0:v", "-map", "1:a:0",  # Use ORIGINAL UNCUT base audio
+        "-c:v", "copy",
+        "-c:a", "aac", "-b:a", "128k",
+        "-shortest",
+        "-movflags", "+faststart",
+        output_path
+    ]
+    result = await run_ffmpeg_async(concat_cmd)
+    if result.returncode != 0:
+        logger.warning(f"Stream-copy segment concat failed, re-encoding instead: {get_ffmpeg_error(result.stderr)}")
+        return False
+    return True
+
+
 # =============================================================================
 # VIDEO SEGMENT REPLACE ENDPOINT
 # =============================================================================
@@ -1239,10 +1954,12 @@ class SegmentReplaceRequest(BaseModel):
     end_time: float = Field(..., description="End time in seconds for replacement")
     audio_mode: str = Field(default="keep_base", description="Audio mode: keep_base, keep_replacement, mix")
     fit_mode: str = Field(default="trim", description="Fit mode: stretch, trim, loop")
+    inline: Optional[bool] = Field(default=None, description="true = always return video_base64, false = always return a signed video_url, unset = by output size")
 
 
 class SegmentReplaceResponse(BaseModel):
-    video_base64: str
+    video_base64: Optional[str] = None
+    video_url: Optional[str] = Field(default=None, description="Signed GCS URL, set instead of video_base64 for large outputs")
     mime_type: str = "video/mp4"
     duration: float = 0.0
 
@@ -1250,7 +1967,8 @@ class SegmentReplaceResponse(BaseModel):
 @router.post("/segment-replace", response_model=SegmentReplaceResponse)
 async def replace_video_segment(
     request: SegmentReplaceRequest,
-    user: dict = Depends(get_current_user)
+    user: dict = Depends(get_current_user),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
     Replace a segment of the base video with a replacement video.
@@ -1271,35 +1989,33 @@ async def replace_video_segment(
         if request.end_time <= request.start_time:
             raise HTTPException(status_code=400, detail="end_time must be greater than start_time")
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # Get base video bytes
+        with scratch_tempdir(b64_size_hint(
+            request.base_video_base64, request.replacement_video_base64,
+            urls=[request.base_video_url, request.replacement_video_url],
+        )) as tmpdir:
+            base_path = os.path.join(tmpdir, "base.mp4")
+            replacement_path = os.path.join(tmpdir, "replacement.mp4")
+
+            # Save base video
             if request.base_video_url:
                 logger.info(f"Downloading base video from URL")
-                base_bytes = await download_video_from_url(request.base_video_url)
+                base_size = await download_to_file(http_client, request.base_video_url, base_path)
             else:
-                base_bytes = clean_base64(request.base_video_base64)
+                base_size = await run_cpu_bound(decode_b64_to_file, request.base_video_base64, base_path)
 
-            # Get replacement video bytes
+            # Save replacement video
             if request.replacement_video_url:
                 logger.info(f"Downloading replacement video from URL")
-                replacement_bytes = await download_video_from_url(request.replacement_video_url)
+                replacement_size = await download_to_file(http_client, request.replacement_video_url, replacement_path)
             else:
-                replacement_bytes = clean_base64(request.replacement_video_base64)
+                replacement_size = await run_cpu_bound(decode_b64_to_file, request.replacement_video_base64, replacement_path)
 
-            # Save videos
-            base_path = os.path.join(tmpdir, "base.mp4")
-            replacement_path = os.path.join(tmpdir, "replacement.mp4")
-
-            with open(base_path, "wb") as f:
-                f.write(base_bytes)
-            with open(replacement_path, "wb") as f:
-                f.write(replacement_bytes)
-
-            logger.info(f"Saved base video: {len(base_bytes)} bytes, replacement: {len(replacement_bytes)} bytes")
+            logger.info(f"Saved base video: {base_size} bytes, replacement: {replacement_size} bytes")
 
             # Probe videos for duration and stream info
-            base_info = probe_video(base_path)
-            replacement_info = probe_video(replacement_path)
+            base_info, replacement_info = await asyncio.gather(
+                probe_video(base_path), probe_video(replacement_path)
+            )
 
             base_duration = float(base_info.get("format", {}).get("duration", 0))
             replacement_duration = float(replacement_info.get("format", {}).get("duration", 0))
@@ -1426,15 +2142,16 @@ async def replace_video_segment(
                     pad_duration = segment_duration - replacement_duration
                     logger.info(f"Padding replacement video: adding {pad_duration}s to reach {segment_duration}s")
                     # Don't trim first - just pad to exact duration
-                    replacement_video_filter = f"setpts=PTS-STARTPTS,tpad=stop_mode=clone:stop_duration={pad_duration},{normalize_filter}"
+                    replacement_fit_filter = f"setpts=PTS-STARTPTS,tpad=stop_mode=clone:stop_duration={pad_duration}"
                 elif replacement_duration > segment_duration:
                     # Replacement too long - trim to exact duration
                     logger.info(f"Trimming replacement video: {replacement_duration}s → {segment_duration}s")
-                    replacement_video_filter = f"trim=duration={segment_duration},setpts=PTS-STARTPTS,{normalize_filter}"
+                    replacement_fit_filter = f"trim=duration={segment_duration},setpts=PTS-STARTPTS"
                 else:
                     # Exact match - just normalize
                     logger.info(f"Replacement video matches segment duration exactly: {segment_duration}s")
-                    replacement_video_filter = f"setpts=PTS-STARTPTS,{normalize_filter}"
+                    replacement_fit_filter = "setpts=PTS-STARTPTS"
+                replacement_video_filter = f"{replacement_fit_filter},{normalize_filter}"
                 
                 # Build video-only concat filter
                 video_filter_parts = []
@@ -1465,7 +2182,7 @@ async def replace_video_segment(
                     "-filter_complex", video_filter,
                     "-map", "[outv]",          # Use edited video track
                     "-map", "0:a",             # Use ORIGINAL UNCUT base audio
-                    "-c:v", "libx264", "-preset", "fast", "-crf", "23",
+                    *h264_encoder_args(),
                     "-c:a", "aac", "-b:a", "128k",
                     "-shortest",               # End when shortest stream ends
                     "-movflags", "+faststart",
@@ -1518,28 +2235,32 @@ async def replace_video_segment(
                     if has_before:
                         base_audio_parts.append(f"[0:a]atrim=0:{request.start_time},asetpts=PTS-STARTPTS")
                     
-                    # Process replacement audio for the segment
-                    replacement_audio_filter = f"[1:a]"
+                    # Process replacement audio for the segment (filters collected
+                    # in a list and joined once)
+                    replacement_audio_filters = []
                     if request.fit_mode == "stretch":
                         speed_factor = replacement_duration / segment_duration if segment_duration > 0 else 1.0
-                        replacement_audio_filter += f"atempo={speed_factor},"
+                        replacement_audio_filters.append(f"atempo={speed_factor}")
                     elif request.fit_mode == "loop" and replacement_duration < segment_duration:
                         loop_count = int(segment_duration / replacement_duration) + 1
-                        replacement_audio_filter += f"aloop=loop={loop_count}:size=999999,atrim=duration={segment_duration},"
+                        replacement_audio_filters.append(f"aloop=loop={loop_count}:size=999999,atrim=duration={segment_duration}")
                     elif replacement_duration > segment_duration:
-                        replacement_audio_filter += f"atrim=duration={segment_duration},"
-                    
-                    replacement_audio_filter += "asetpts=PTS-STARTPTS"
-                    base_audio_parts.append(replacement_audio_filter)
+                        replacement_audio_filters.append(f"atrim=duration={segment_duration}")
+                    replacement_audio_filters.append("asetpts=PTS-STARTPTS")
+                    base_audio_parts.append(f"[1:a]{','.join(replacement_audio_filters)}")
                     
                     if has_after:
                         base_audio_parts.append(f"[0:a]atrim={request.end_time}:{base_duration},asetpts=PTS-STARTPTS")
                     
-                    # Concatenate all audio parts and format
+                    # Concatenate all audio parts and format - each part gets an
+                    # [audN] output label for the concat to consume
                     n_audio_segments = len(base_audio_parts)
                     if n_audio_segments > 1:
-                        audio_concat = ";".join(base_audio_parts) + f";{''.join([f'[aud{i}]' for i in range(n_audio_segments)])}concat=n={n_audio_segments}:v=0:a=1[mixed_audio]"
-                        filter_parts.append(f"{audio_concat};[mixed_audio]{audio_format_filter}[outa]")
+                        audio_concat_inputs = []
+                        for i, part in enumerate(base_audio_parts):
+                            filter_parts.append(f"{part}[aud{i}]")
+                            audio_concat_inputs.append(f"[aud{i}]")
+                        filter_parts.append(f"{''.join(audio_concat_inputs)}concat=n={n_audio_segments}:v=0:a=1,{audio_format_filter}[outa]")
                     else:
                         filter_parts.append(f"{base_audio_parts[0]},{audio_format_filter}[outa]")
                     include_audio = True
@@ -1572,36 +2293,42 @@ async def replace_video_segment(
                     cmd.extend(["-map", "[outa]", "-c:a", "aac", "-b:a", "128k"])
                 
                 cmd.extend([
-                    "-c:v", "libx264",
-                    "-preset", "fast",
-                    "-crf", "23",
+                    *h264_encoder_args(),
                     "-movflags", "+faststart",
                     output_path
                 ])
 
-            logger.info(f"Running ffmpeg segment replace")
-            if 'filter_complex' in locals():
-                logger.debug(f"Filter complex: {filter_complex}")
+            # keep_base with a keyframe-aligned H.264 base: copy the untouched
+            # parts and only encode the replacement (falls back to cmd otherwise)
+            stream_copied = False
+            if request.audio_mode == "keep_base" and base_has_valid_audio and (has_before or has_after):
+                stream_copied = await replace_segment_stream_copy(
+                    base_path, replacement_path, base_info,
+                    request.start_time, request.end_time, base_duration,
+                    replacement_fit_filter, tmpdir, output_path
+                )
 
-            result = await run_ffmpeg_async(cmd)
+            if not stream_copied:
+                logger.info(f"Running ffmpeg segment replace")
+                if 'filter_complex' in locals():
+                    logger.debug(f"Filter complex: {filter_complex}")
 
-            if result.returncode != 0:
-                error_msg = get_ffmpeg_error(result.stderr)
-                logger.error(f"FFmpeg segment replace failed: {result.stderr}")
-                raise HTTPException(status_code=500, detail=f"Failed to replace segment: {error_msg}")
+                result = await run_ffmpeg_async(cmd)
 
-            # Read output and get duration
-            with open(output_path, "rb") as f:
-                output_bytes = f.read()
+                if result.returncode != 0:
+                    error_msg = get_ffmpeg_error(result.stderr)
+                    logger.error(f"FFmpeg segment replace failed: {result.stderr}")
+                    raise HTTPException(status_code=500, detail=f"Failed to replace segment: {error_msg}")
 
-            output_info = probe_video(output_path)
+            # Get output duration, then encode
+            output_info = await probe_video(output_path)
             output_duration = float(output_info.get("format", {}).get("duration", 0))
 
-            output_base64 = base64.b64encode(output_bytes).decode("utf-8")
-            logger.info(f"Segment replace complete: {len(output_bytes)} bytes, duration: {output_duration}s")
+            output = await encode_output(output_path, user['uid'], request.inline)
+            logger.info(f"Segment replace complete: {os.path.getsize(output_path)} bytes, duration: {output_duration}s")
 
             return SegmentReplaceResponse(
-                video_base64=output_base64,
+                **output,
                 mime_type="video/mp4",
                 duration=output_duration
             )
@@ -1,4 +1,3 @@
-from functools import lru_cache
 from fastapi import APIRouter, Depends, HTTPException, Query
 from app.schemas import (
     SaveWorkflowRequest,
@@ -18,17 +17,24 @@ logger = setup_logger(__name__)
 router = APIRouter()
 
 
-@lru_cache
+_workflow_service: WorkflowServiceFirestore | None = None
+
+
 def get_workflow_service() -> WorkflowServiceFirestore:
     """
-    Cached factory for WorkflowServiceFirestore.
+    Shared WorkflowServiceFirestore instance.
 
-    Uses @lru_cache to ensure only one instance is created and reused
-    across all requests, avoiding repeated Firestore client initialization.
+    Created once on first use and reused across all requests, avoiding
+    repeated Firestore client initialization. A plain module-level singleton
+    rather than @lru_cache, so the per-request Depends() call is just a
+    global lookup.
 
-    To revert: Remove @lru_cache decorator and functools import.
+    To revert: Put @lru_cache back on this function and return WorkflowServiceFirestore() directly.
     """
-    return WorkflowServiceFirestore()
+    global _workflow_service
+    if _workflow_service is None:
+        _workflow_service = WorkflowServiceFirestore()
+    return _workflow_service
 
 
 @router.post("", response_model=WorkflowIdResponse)
@@ -54,7 +60,7 @@ async def create_workflow(
         logger.info(f"Save workflow request from user {user['email']}: {request.name}")
 
         # Check admin permission for public templates
-        if request.is_public and user['email'] not in settings.ADMIN_EMAILS:
+        if request.is_public and user['email'] not in settings.ADMIN_EMAILS_SET:
             raise HTTPException(
                 status_code=403,
                 detail='Only admins can create public templates'
@@ -184,7 +190,7 @@ async def update_workflow(
         logger.info(f"Update workflow request from user {user['email']}: {workflow_id}")
 
         # Check admin permission for public templates
-        if request.is_public and user['email'] not in settings.ADMIN_EMAILS:
+        if request.is_public and user['email'] not in settings.ADMIN_EMAILS_SET:
             raise HTTPException(
                 status_code=403,
                 detail='Only admins can create public templates'
@@ -0,0 +1,121 @@
+"""
+Scratch directory helpers for ffmpeg temp files.
+
+Prefers /dev/shm (tmpfs, RAM-backed; FAST_TMPDIR picks another fast
+mount) so intermediate video files never touch the block layer. Falls
+back to the system temp dir when tmpfs is disabled, missing (e.g. macOS),
+or too small - Docker gives containers a 64MB /dev/shm by default, which
+a single large video can exceed.
+
+ScratchFiles avoids a mkdtemp/rmtree per request: each worker process
+keeps one persistent scratch dir per root, and requests get uniquely
+prefixed file names inside it that are unlinked individually on cleanup.
+
+To revert: Set USE_TMPFS_SCRATCH=false to keep scratch off tmpfs, or replace
+scratch_tempdir()/ScratchFiles with tempfile.TemporaryDirectory().
+"""
+import atexit
+import os
+import shutil
+import tempfile
+import uuid
+from typing import Dict, List, Optional
+from app.config import settings
+from app.logging_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# Intermediate files per request are roughly input + output (+ audio), so
+# require a few multiples of the payload size to be free on tmpfs
+SCRATCH_HEADROOM = 3
+
+
+def get_scratch_root(size_hint: Optional[int] = 0) -> Optional[str]:
+    """
+    Pick the parent directory for a scratch tempdir.
+
+    Args:
+        size_hint: Approximate size in bytes of the payload being processed,
+            or None when it isn't known up front (e.g. URL inputs)
+
+    Returns:
+        settings.fast_tmpdir ("/dev/shm") if tmpfs scratch is enabled and has
+        room, otherwise None (tempfile's default location). An unknown size
+        always gets the disk temp dir - there's no way to check the headroom.
+    """
+    fast_root = settings.fast_tmpdir
+    if not settings.use_tmpfs_scratch or not fast_root or not os.path.isdir(fast_root):
+        return None
+    if size_hint is None:
+        return None
+    try:
+        free = shutil.disk_usage(fast_root).free
+    except OSError:
+        return None
+    if free < size_hint * SCRATCH_HEADROOM:
+        logger.info(f"{fast_root} has {free} bytes free, need ~{size_hint * SCRATCH_HEADROOM}; using disk temp dir")
+        return None
+    return fast_root
+
+
+def scratch_tempdir(size_hint: Optional[int] = 0) -> tempfile.TemporaryDirectory:
+    """TemporaryDirectory on tmpfs when possible (see get_scratch_root)."""
+    return tempfile.TemporaryDirectory(dir=get_scratch_root(size_hint))
+
+
+# Persistent per-worker scratch dirs, keyed by root (tmpfs or disk temp dir)
+_worker_dirs: Dict[str, str] = {}
+
+
+def _get_worker_dir(root: Optional[str]) -> str:
+    """Get or create this process's scratch dir under root (None = system temp dir)."""
+    root = root or tempfile.gettempdir()
+    path = _worker_dirs.get(root)
+    if path is None:
+        path = os.path.join(root, f"genmedia-scratch-{os.getpid()}")
+        os.makedirs(path, exist_ok=True)
+        _worker_dirs[root] = path
+        # Don't leave the dir (or anything a crashed request left in it) on tmpfs
+        atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+class ScratchFiles:
+    """
+    Per-request scratch files in the worker's persistent scratch dir.
+
+    Usage:
+        with ScratchFiles(len(video_bytes)) as scratch:
+            input_path = scratch.path("input.mp4")
+            ...
+
+    Every path handed out is unlinked by cleanup() (also called on exiting
+    the with block). To stream a file back after the handler returns, open
+    it first and clean up anyway - the open handle keeps the data readable.
+    """
+
+    def __init__(self, size_hint: Optional[int] = 0):
+        self.dir = _get_worker_dir(get_scratch_root(size_hint))
+        self._prefix = uuid.uuid4().hex
+        self._paths: List[str] = []
+
+    def path(self, name: str) -> str:
+        """Unique path for name, removed on cleanup()."""
+        path = os.path.join(self.dir, f"{self._prefix}-{name}")
+        self._paths.append(path)
+        return path
+
+    def cleanup(self) -> None:
+        """Remove every file handed out by path(); missing files are ignored."""
+        for path in self._paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self._paths.clear()
+
+    def __enter__(self) -> "ScratchFiles":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.cleanup()
@@ -1,21 +1,24 @@
 import base64
 import httpx
+import pybase64
 import asyncio
 import re
 import google.auth
 import google.auth.transport.requests
 from google import genai
 from google.genai import types
-from typing import Optional, List
+from typing import NamedTuple, Optional, List, Union
 from app.config import settings
 from app.schemas import ImageResponse, TextResponse, UpscaleResponse, VideoStatusResponse, MusicResponse
 from app.services.library_firestore import LibraryServiceFirestore
 from app.logging_config import setup_logger
+from app.cpu_pool import run_cpu_bound
 from app.exceptions import (
     RateLimitError,
     NoContentGeneratedError,
     UpstreamAPIError,
-    RequestTimeoutError
+    RequestTimeoutError,
+    ValidationError
 )
 
 logger = setup_logger(__name__)
@@ -64,6 +67,21 @@ image_client = genai.Client(
 )
 
 
+class GcsImage(NamedTuple):
+    """An image input the model fetches from GCS itself (no download/re-upload here)."""
+    uri: str  # gs://bucket/path
+    mime_type: str
+
+
+# Image inputs are either raw bytes (inline data) or a GCS reference
+ImageInput = Union[bytes, GcsImage]
+
+
+def _b64_encode(data: bytes) -> str:
+    """Base64-encode image bytes for a REST payload (runs on the CPU pool)."""
+    return pybase64.b64encode(data).decode('ascii')
+
+
 class GenerationService:
     def __init__(self, library_service: Optional[LibraryServiceFirestore] = None):
         self.library = library_service or LibraryServiceFirestore()
@@ -78,6 +96,24 @@ class GenerationService:
         4. Fixes padding to ensure length is multiple of 4
         5. Validates the result can be decoded
         """
+        data = self._clean_base64(data)
+        if not data:
+            return data
+
+        # Validate the base64 can be decoded
+        try:
+            pybase64.b64decode(data)
+            logger.debug(f"Base64 validation passed, length: {len(data)}")
+        except Exception as e:
+            logger.error(f"Base64 validation failed after cleaning: {e}")
+            logger.error(f"Data preview (first 100 chars): {data[:100]}")
+            # Return the data anyway - let the API give a more specific error
+            # rather than failing silently here
+
+        return data
+
+    def _clean_base64(self, data: str) -> str:
+        """Steps 1-4 of _strip_base64_prefix: prefix/whitespace/junk removed, padding fixed."""
         if not data:
             return data
 
@@ -101,20 +137,27 @@ class GenerationService:
         if missing_padding:
             data += '=' * (4 - missing_padding)
 
-        # Validate the base64 can be decoded
+        return data
+
+    def decode_base64_image(self, data: str) -> bytes:
+        """Decode client-supplied base64 image data (data URL prefix allowed) to raw bytes.
+
+        Uses pybase64, which releases the GIL, so it runs in parallel on the
+        CPU pool. Raises ValidationError (400) if the data can't be decoded -
+        an undecodable first/last frame must not silently become a
+        text-only generation.
+        """
         try:
-            base64.b64decode(data)
-            logger.debug(f"Base64 validation passed, length: {len(data)}")
+            image_bytes = pybase64.b64decode(self._clean_base64(data))
         except Exception as e:
-            logger.error(f"Base64 validation failed after cleaning: {e}")
-            logger.error(f"Data preview (first 100 chars): {data[:100]}")
-            # Return the data anyway - let the API give a more specific error
-            # rather than failing silently here
-
-        return data
+            logger.error(f"Base64 image decode failed: {e}")
+            raise ValidationError("Invalid base64 image data")
+        if not image_bytes:
+            raise ValidationError("Invalid base64 image data: no image bytes")
+        return image_bytes
 
-    def _detect_mime_type(self, data: str) -> str:
-        """Detect MIME type from base64 encoded image data by checking file headers.
+    def _detect_mime_type(self, data: bytes) -> str:
+        """Detect MIME type from raw image bytes by checking file headers.
 
         Returns 'image/png' for PNG files, 'image/jpeg' for JPEG files.
         Defaults to 'image/png' if unable to detect.
@@ -122,36 +165,37 @@ class GenerationService:
         if not data:
             return "image/png"
 
-        try:
-            # Strip prefix if present
-            clean_data = self._strip_base64_prefix(data)
-
-            # Decode enough bytes to check the header (first 16 bytes is plenty)
-            # We only need first 8 bytes for PNG and 2 bytes for JPEG
-            header_b64 = clean_data[:24]  # 24 base64 chars = 18 bytes
-            header_bytes = base64.b64decode(header_b64)
-
-            # Check for PNG signature: 89 50 4E 47 0D 0A 1A 0A
-            if header_bytes[:8] == b'\x89PNG\r\n\x1a\n':
-                logger.debug("Detected MIME type: image/png")
-                return "image/png"
-
-            # Check for JPEG signature: FF D8
-            if header_bytes[:2] == b'\xff\xd8':
-                logger.debug("Detected MIME type: image/jpeg")
-                return "image/jpeg"
-
-            # Check for WebP signature: RIFF....WEBP
-            if header_bytes[:4] == b'RIFF' and len(header_bytes) >= 12 and header_bytes[8:12] == b'WEBP':
-                logger.debug("Detected MIME type: image/webp")
-                return "image/webp"
-
-            logger.warning(f"Could not detect MIME type from header bytes: {header_bytes[:8].hex()}, defaulting to image/png")
-            return "image/png"
+        header_bytes = data[:16]
 
-        except Exception as e:
-            logger.warning(f"Error detecting MIME type: {e}, defaulting to image/png")
+        # Check for PNG signature: 89 50 4E 47 0D 0A 1A 0A
+        if header_bytes[:8] == b'\x89PNG\r\n\x1a\n':
+            logger.debug("Detected MIME type: image/png")
             return "image/png"
+
+        # Check for JPEG signature: FF D8
+        if header_bytes[:2] == b'\xff\xd8':
+            logger.debug("Detected MIME type: image/jpeg")
+            return "image/jpeg"
+
+        # Check for WebP signature: RIFF....WEBP
+        if header_bytes[:4] == b'RIFF' and len(header_bytes) >= 12 and header_bytes[8:12] == b'WEBP':
+            logger.debug("Detected MIME type: image/webp")
+            return "image/webp"
+
+        logger.warning(f"Could not detect MIME type from header bytes: {header_bytes[:8].hex()}, defaulting to image/png")
+        return "image/png"
+
+    async def _encode_veo_image(self, image: ImageInput, label: str) -> dict:
+        """Build a Veo REST image object from raw bytes (inline base64) or a GCS reference (gcsUri)."""
+        if isinstance(image, GcsImage):
+            logger.info(f"{label}: mime={image.mime_type}, gcsUri={image.uri}")
+            return {"gcsUri": image.uri, "mimeType": image.mime_type}
+        mime_type = self._detect_mime_type(image)
+        logger.info(f"{label}: mime={mime_type}, bytes={len(image)}, header_hex={image[:16].hex()}")
+        return {
+            "bytesBase64Encoded": await run_cpu_bound(_b64_encode, image),
+            "mimeType": mime_type
+        }
     
     def _get_auth_headers(self) -> dict:
         """Get authentication headers for REST API calls"""
@@ -205,7 +249,7 @@ class GenerationService:
         self,
         prompt: str,
         user_id: str,
-        reference_images: Optional[List[str]] = None,
+        reference_images: Optional[List[Optional[ImageInput]]] = None,
         aspect_ratio: str = "1:1",
         resolution: str = "1K"
     ) -> ImageResponse:
@@ -219,10 +263,14 @@ class GenerationService:
                 logger.info(f"Processing {len(reference_images)} reference images as ingredients")
                 valid_images = []
 
-                for i, ref_image in enumerate(reference_images):
+                for i, image_bytes in enumerate(reference_images):
                     try:
-                        clean_image = self._strip_base64_prefix(ref_image)
-                        image_bytes = base64.b64decode(clean_image)
+                        if isinstance(image_bytes, GcsImage):
+                            # Vertex reads gs:// URIs directly inside Google's network
+                            contents.append(types.Part.from_uri(file_uri=image_bytes.uri, mime_type=image_bytes.mime_type))
+                            valid_images.append(i+1)
+                            logger.info(f"Added reference image {i+1}: {image_bytes.uri}, format: {image_bytes.mime_type}")
+                            continue
 
                         # Validate image size (Gemini requires reasonable sized images)
                         if len(image_bytes) < 100:
@@ -318,65 +366,41 @@ class GenerationService:
         self,
         prompt: str,
         user_id: str,
-        first_frame: Optional[str] = None,
-        last_frame: Optional[str] = None,
-        reference_images: Optional[List[str]] = None,
+        first_frame: Optional[ImageInput] = None,
+        last_frame: Optional[ImageInput] = None,
+        reference_images: Optional[List[Optional[ImageInput]]] = None,
         aspect_ratio: str = "16:9",
         duration_seconds: int = 8,
         generate_audio: bool = True,
         seed: Optional[int] = None
     ) -> dict:
-        """Start video generation using Veo via REST API"""
+        """Start video generation using Veo via REST API
+
+        Frames/reference images are raw bytes (base64-encoded exactly once
+        here, the Veo REST payload is JSON) or GcsImage refs sent as gcsUri.
+        """
         endpoint = f"https://{settings.veo_location}-aiplatform.googleapis.com/v1/projects/{settings.project_id}/locations/{settings.veo_location}/publishers/google/models/{settings.veo_model}:predictLongRunning"
         
         instance = {"prompt": prompt}
         
         if first_frame:
-            cleaned_frame = self._strip_base64_prefix(first_frame)
-            first_frame_mime = self._detect_mime_type(first_frame)
-
-            # Validate and log image details
-            try:
-                frame_bytes = base64.b64decode(cleaned_frame)
-                logger.info(f"First frame: mime={first_frame_mime}, base64_len={len(cleaned_frame)}, decoded_bytes={len(frame_bytes)}, header_hex={frame_bytes[:16].hex()}")
-            except Exception as e:
-                logger.error(f"First frame decode failed: {e}")
-
-            instance["image"] = {
-                "bytesBase64Encoded": cleaned_frame,
-                "mimeType": first_frame_mime
-            }
+            instance["image"] = await self._encode_veo_image(first_frame, "First frame")
         else:
             logger.warning("No first frame provided to generate_video")
 
         if last_frame:
-            last_frame_mime = self._detect_mime_type(last_frame)
-            logger.info(f"Adding last frame with mime_type: {last_frame_mime}")
-            instance["lastFrame"] = {
-                "bytesBase64Encoded": self._strip_base64_prefix(last_frame),
-                "mimeType": last_frame_mime
-            }
+            instance["lastFrame"] = await self._encode_veo_image(last_frame, "Last frame")
 
         # Reference images for subject consistency (Veo 3.1 feature)
         # Format: uses "image" field (not "referenceImage") and lowercase "style" type
         if reference_images:
             ref_images_with_mime = []
             for idx, img in enumerate(reference_images[:3]):
-                img_mime = self._detect_mime_type(img)
-                cleaned_img = self._strip_base64_prefix(img)
-
-                # Validate and log image details
-                try:
-                    img_bytes = base64.b64decode(cleaned_img)
-                    logger.info(f"Reference image {idx+1}: mime={img_mime}, base64_len={len(cleaned_img)}, decoded_bytes={len(img_bytes)}, header_hex={img_bytes[:16].hex()}")
-                except Exception as e:
-                    logger.error(f"Reference image {idx+1} decode failed: {e}")
-
+                if not img:
+                    logger.warning(f"Reference image {idx+1} is empty or failed to decode, skipping")
+                    continue
                 ref_images_with_mime.append({
-                    "image": {
-                        "bytesBase64Encoded": cleaned_img,
-                        "mimeType": img_mime
-                    },
+                    "image": await self._encode_veo_image(img, f"Reference image {idx+1}"),
                     "referenceType": "style"
                 })
             instance["referenceImages"] = ref_images_with_mime
@@ -2,16 +2,18 @@
 Library service using Firestore for metadata and GCS for file storage
 """
 import asyncio
+import time
 import uuid
-import base64
+import pybase64
+from collections import OrderedDict
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from google.cloud import storage
 from app.firestore import get_firestore_client, ASSETS_COLLECTION
 from app.config import settings
 from app.schemas import AssetResponse, LibraryResponse
 from app.logging_config import setup_logger
-from app.exceptions import AssetNotFoundError, AccessDeniedError, InvalidAssetTypeError
+from app.exceptions import AssetNotFoundError, AccessDeniedError, InvalidAssetTypeError, ValidationError
 
 logger = setup_logger(__name__)
 
@@ -22,6 +24,55 @@ async def run_sync(func, *args, **kwargs):
     return await loop.run_in_executor(None, lambda: func(*args, **kwargs))
 
 
+# In-process LRU/TTL cache of downloaded asset bytes, keyed by (asset_id, user_id).
+# Users iterating on prompts resubmit the same reference images, so repeat
+# resolutions skip Firestore + GCS entirely. Bounded by total bytes, not entries.
+# Each worker process has its own cache; delete_asset evicts from this one.
+# To revert: Remove the cache helpers and the cache lookup in get_asset_bytes.
+ASSET_BYTES_CACHE_TTL = 300  # seconds
+ASSET_BYTES_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_asset_bytes_cache: "OrderedDict[Tuple[str, str], Tuple[float, bytes]]" = OrderedDict()  # key -> (expires_at, data)
+_asset_bytes_cache_size = 0
+# In-flight downloads per key, so concurrent requests for the same asset share
+# one fetch (even when it fails or is too large to cache). An entry is removed
+# when its download finishes.
+_asset_bytes_inflight: Dict[Tuple[str, str], "asyncio.Task[bytes]"] = {}
+
+
+def _asset_cache_get(key: Tuple[str, str]) -> Optional[bytes]:
+    """Return cached bytes for key if present and fresh (marks it most recently used)."""
+    entry = _asset_bytes_cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] <= time.monotonic():
+        _asset_cache_pop(key)
+        return None
+    _asset_bytes_cache.move_to_end(key)
+    return entry[1]
+
+
+def _asset_cache_put(key: Tuple[str, str], data: bytes) -> None:
+    """Store bytes for key, evicting least recently used entries over the byte budget."""
+    global _asset_bytes_cache_size
+    if len(data) > ASSET_BYTES_CACHE_MAX_BYTES:
+        return
+    _asset_cache_pop(key)
+    _asset_bytes_cache[key] = (time.monotonic() + ASSET_BYTES_CACHE_TTL, data)
+    _asset_bytes_cache_size += len(data)
+    while _asset_bytes_cache_size > ASSET_BYTES_CACHE_MAX_BYTES:
+        _, (_, evicted) = _asset_bytes_cache.popitem(last=False)
+        _asset_bytes_cache_size -= len(evicted)
+
+
+def _asset_cache_pop(key: Tuple[str, str]) -> None:
+    """Drop key from the cache if present."""
+    global _asset_bytes_cache_size
+    entry = _asset_bytes_cache.pop(key, None)
+    if entry is not None:
+        _asset_bytes_cache_size -= len(entry[1])
+
+
 class LibraryServiceFirestore:
     """
     Library service backed by Firestore for metadata and GCS for file storage.
@@ -87,9 +138,10 @@ class LibraryServiceFirestore:
         # Create blob path
         blob_path = f"users/{user_id}/{asset_type}s/{asset_id}.{ext}"
         
-        # Decode and upload to GCS (non-blocking)
+        # Decode (SIMD pybase64, in a thread - saved videos can be tens of MB)
+        # and upload to GCS (non-blocking)
         clean_data = self._strip_base64_prefix(data)
-        file_bytes = base64.b64decode(clean_data)
+        file_bytes = await run_sync(pybase64.b64decode, clean_data)
 
         blob = self.bucket.blob(blob_path)
         await run_sync(blob.upload_from_string, file_bytes, content_type=mime_type)
@@ -189,6 +241,72 @@ class LibraryServiceFirestore:
             user_id=data["user_id"]
         )
 
+    async def _get_owned_asset_data(self, asset_id: str, user_id: str) -> dict:
+        """Fetch an asset's Firestore document, raising unless user_id owns it."""
+        doc = await run_sync(self.assets_ref.document(asset_id).get)
+
+        if not doc.exists:
+            raise AssetNotFoundError(asset_id)
+
+        data = doc.to_dict()
+
+        # Check ownership
+        if data.get("user_id") != user_id:
+            raise AccessDeniedError()
+
+        return data
+
+    async def get_asset_gcs_uri(self, asset_id: str, user_id: str) -> tuple[str, str]:
+        """
+        Get an asset's gs:// URI and MIME type, with the same ownership check as get_asset.
+
+        Lets Vertex models read the file from GCS directly instead of it
+        being downloaded here and re-uploaded inline. Only image assets are
+        accepted - a video would otherwise be sent to the model as an image
+        and fail the whole generation.
+        """
+        data = await self._get_owned_asset_data(asset_id, user_id)
+        mime_type = data.get("mime_type") or ""
+        if not mime_type.startswith("image/"):
+            raise ValidationError(f"Asset {asset_id} is not an image ({mime_type or 'unknown type'})", field="asset_id")
+        return f"gs://{settings.gcs_bucket}/{data['blob_path']}", mime_type
+
+    async def get_asset_bytes(self, asset_id: str, user_id: str) -> bytes:
+        """
+        Download an asset's file contents, with the same ownership check as get_asset.
+
+        Reads the blob through the authenticated storage client instead of a
+        second HTTPS round-trip to the public URL. Results are cached per
+        (asset_id, user_id) for ASSET_BYTES_CACHE_TTL seconds.
+
+        To revert: Use get_asset() and fetch asset.url over HTTP instead.
+        """
+        key = (asset_id, user_id)
+        data = _asset_cache_get(key)
+        if data is not None:
+            return data
+
+        task = _asset_bytes_inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._download_and_cache_asset_bytes(asset_id, user_id))
+            _asset_bytes_inflight[key] = task
+            task.add_done_callback(lambda _: _asset_bytes_inflight.pop(key, None))
+        # shield: one caller going away mustn't cancel the fetch the others await
+        return await asyncio.shield(task)
+
+    async def _download_and_cache_asset_bytes(self, asset_id: str, user_id: str) -> bytes:
+        """Shared in-flight fetch for get_asset_bytes: download, then cache."""
+        data = await self._download_asset_bytes(asset_id, user_id)
+        _asset_cache_put((asset_id, user_id), data)
+        return data
+
+    async def _download_asset_bytes(self, asset_id: str, user_id: str) -> bytes:
+        """Ownership check + blob download for get_asset_bytes (uncached)."""
+        data = await self._get_owned_asset_data(asset_id, user_id)
+        blob = self.bucket.blob(data["blob_path"])
+        # Same 30s cap the old HTTP download used, so a slow read can't hang the request
+        return await run_sync(blob.download_as_bytes, timeout=30.0)
+
     async def get_asset_by_id(self, asset_id: str) -> Optional[dict]:
         """
         Get asset by ID without ownership check.
@@ -287,6 +405,9 @@ class LibraryServiceFirestore:
         # Delete metadata from Firestore (non-blocking)
         await run_sync(doc_ref.delete)
 
+        # Don't keep serving the deleted file from the asset bytes cache
+        _asset_cache_pop((asset_id, user_id))
+
         logger.info(f"Deleted asset {asset_id} for user {user_id}")
 
         return {"status": "deleted", "id": asset_id}
@@ -58,6 +58,9 @@ GCS_BUCKET=$(uv run python -c "from app.config import settings; print(settings.g
 WORKFLOWS_BUCKET=$(uv run python -c "from app.config import settings; print(settings.workflows_bucket)")
 FIREBASE_PROJECT_ID=$(uv run python -c "from app.config import settings; print(settings.firebase_project_id)")
 
+# Delete large video-processing outputs (returned as signed URLs) after a day
+uv run python -c "from app.routers.video_processing import ensure_output_lifecycle_rule, get_output_bucket; print('  Added lifecycle rule for video-processing/ outputs' if ensure_output_lifecycle_rule(get_output_bucket()) else '  Lifecycle rule for video-processing/ outputs already set')"
+
 # Environment variables (from .env.production or .env)
 ALLOWED_EMAILS="${ALLOWED_EMAILS:-}"
 ALLOWED_DOMAINS="${ALLOWED_DOMAINS:-}"